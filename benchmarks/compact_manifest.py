@@ -0,0 +1,90 @@
+"""Benchmark the compact manifest against the manifest dictionaries.
+
+Compares the peak memory allocated while loading the manifest, the memory
+still held afterwards and the time taken to load the manifest and to look up
+all items, using :meth:`dtoolcore.DataSet.item_properties` and
+:class:`dtool_info.manifest.CompactManifest`, on a synthetic dataset.
+
+Usage::
+
+    python benchmarks/compact_manifest.py --items 1000000
+"""
+
+import argparse
+import gc
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+import dtoolcore
+
+from dtool_info.manifest import CompactManifest
+
+from synthetic import create_dataset
+
+
+def allocated(func):
+    """Return (result, peak bytes allocated, bytes still held) of func."""
+    gc.collect()
+    tracemalloc.start()
+    result = func()
+    gc.collect()
+    held, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, peak, held
+
+
+def timed(func):
+    start = time.time()
+    func()
+    return time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--items", type=int, default=100000)
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        uri = create_dataset(tmp_dir, args.items, "empty")
+
+        def load_dict():
+            dataset = dtoolcore.DataSet.from_uri(uri)
+            dataset._manifest
+            return dataset
+
+        def load_compact():
+            return CompactManifest.from_dataset(
+                dtoolcore.DataSet.from_uri(uri)
+            )
+
+        dataset, peak_dict, held_dict = allocated(load_dict)
+        manifest, peak_compact, held_compact = allocated(load_compact)
+        ids = list(dataset.identifiers)
+
+        rows = [
+            ("load", timed(load_dict), timed(load_compact)),
+            ("lookup all", timed(
+                lambda: [dataset.item_properties(i)["hash"] for i in ids]
+            ), timed(
+                lambda: [manifest.item_properties(i).hash for i in ids]
+            )),
+        ]
+
+        print("{} items".format(args.items))
+        print("{:16s} {:>12s} {:>12s}".format("", "dict", "compact"))
+        print("{:16s} {:>10.1f}MB {:>10.1f}MB".format(
+            "peak memory", peak_dict / 1e6, peak_compact / 1e6))
+        print("{:16s} {:>10.1f}MB {:>10.1f}MB".format(
+            "held memory", held_dict / 1e6, held_compact / 1e6))
+        for name, t_dict, t_compact in rows:
+            print("{:16s} {:>11.3f}s {:>11.3f}s".format(
+                name, t_dict, t_compact))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == "__main__":
+    main()
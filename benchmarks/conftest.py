@@ -0,0 +1,75 @@
+"""Fixtures for the command benchmarks.
+
+The benchmarks run the commands against synthetic datasets created by
+:mod:`synthetic`. The number of items and the item size distributions are
+set by comma separated environment variables::
+
+    DTOOL_INFO_BENCHMARK_SIZES=1000,100000
+    DTOOL_INFO_BENCHMARK_DISTRIBUTIONS=empty,small,lognormal
+
+The datasets are created in a temporary directory, unless the
+``DTOOL_INFO_BENCHMARK_DATA`` environment variable names a directory where
+they are kept and reused between runs.
+"""
+
+import os
+import shutil
+
+import pytest
+
+from synthetic import create_dataset, dataset_name
+
+
+def _env_list(key, default):
+    return [v.strip() for v in os.environ.get(key, default).split(",")
+            if v.strip()]
+
+
+SIZES = [int(v) for v in _env_list("DTOOL_INFO_BENCHMARK_SIZES", "1000")]
+DISTRIBUTIONS = _env_list("DTOOL_INFO_BENCHMARK_DISTRIBUTIONS", "small")
+
+
+class SyntheticDataset(object):
+    """Location of a synthetic dataset, alone in its base directory."""
+
+    def __init__(self, base_dir, num_items, distribution):
+        self.num_items = num_items
+        self.distribution = distribution
+        name = dataset_name(num_items, distribution)
+        self.base_dir = os.path.join(base_dir, name)
+        self.path = os.path.join(self.base_dir, name)
+
+    @property
+    def exists(self):
+        # The overlay is written last, so its presence means that the
+        # creation of the dataset was not interrupted.
+        return os.path.isfile(os.path.join(
+            self.path, ".dtool", "overlays", "size_class.json"))
+
+    def create(self):
+        if os.path.isdir(self.path):
+            shutil.rmtree(self.path)
+        if not os.path.isdir(self.base_dir):
+            os.makedirs(self.base_dir)
+        create_dataset(self.base_dir, self.num_items, self.distribution)
+
+
+@pytest.fixture(scope="session")
+def benchmark_data_dir(tmp_path_factory):
+    data_dir = os.environ.get("DTOOL_INFO_BENCHMARK_DATA")
+    if data_dir is None:
+        return str(tmp_path_factory.mktemp("synthetic"))
+    return data_dir
+
+
+@pytest.fixture(
+    scope="session",
+    params=[(n, d) for n in SIZES for d in DISTRIBUTIONS],
+    ids=lambda p: "{}-{}".format(*p)
+)
+def synthetic_dataset(request, benchmark_data_dir):
+    num_items, distribution = request.param
+    dataset = SyntheticDataset(benchmark_data_dir, num_items, distribution)
+    if not dataset.exists:
+        dataset.create()
+    return dataset
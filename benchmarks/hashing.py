@@ -0,0 +1,88 @@
+"""Benchmark hashing of local files for 'dtool verify/diff --full'.
+
+Compares the hash throughput of the dtoolcore file hasher with the reusable
+buffer and memory mapped hashers in :mod:`dtool_info.hashing` on a synthetic
+set of small and large files.
+
+Usage::
+
+    python benchmarks/hashing.py --small 2000 --large 4 --large-size 256
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from dtoolcore.filehasher import FileHasher as CoreFileHasher, md5sum_hexdigest
+
+from dtool_info.hashing import FileHasher
+
+
+def create_files(directory, num_files, size):
+    """Return paths to files with random content."""
+    content = os.urandom(min(size, 1024 * 1024))
+    fpaths = []
+    for i in range(num_files):
+        fpath = os.path.join(directory, "{}_{}.bin".format(size, i))
+        with open(fpath, "wb") as fh:
+            written = 0
+            while written < size:
+                chunk = content[:size - written]
+                fh.write(chunk)
+                written += len(chunk)
+        fpaths.append(fpath)
+    return fpaths
+
+
+def measure(hasher, fpaths):
+    """Return GB/s hashing the files, the best of three runs."""
+    total_bytes = sum(os.path.getsize(f) for f in fpaths)
+    best = None
+    for _ in range(3):
+        start = time.time()
+        for fpath in fpaths:
+            hasher(fpath)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return total_bytes / best / 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--small", type=int, default=2000,
+                        help="Number of 4 KiB files.")
+    parser.add_argument("--large", type=int, default=4,
+                        help="Number of large files.")
+    parser.add_argument("--large-size", type=int, default=256,
+                        help="Size of large files in MiB.")
+    args = parser.parse_args()
+
+    core_hasher = CoreFileHasher(md5sum_hexdigest)
+    hashers = [
+        ("dtoolcore", core_hasher),
+        ("readinto 64KiB", FileHasher(core_hasher, 64 * 1024, False)),
+        ("readinto 1MiB", FileHasher(core_hasher, 1024 * 1024, False)),
+        ("readinto 8MiB", FileHasher(core_hasher, 8 * 1024 * 1024, False)),
+        ("mmap", FileHasher(core_hasher, use_mmap=True)),
+    ]
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        file_sets = [
+            ("small", create_files(tmp_dir, args.small, 4 * 1024)),
+            ("large", create_files(tmp_dir, args.large,
+                                   args.large_size * 1024 * 1024)),
+        ]
+        for set_name, fpaths in file_sets:
+            for name, hasher in hashers:
+                print("{:6s} {:15s} {:6.2f} GB/s".format(
+                    set_name, name, measure(hasher, fpaths)))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == "__main__":
+    main()
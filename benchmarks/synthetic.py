@@ -0,0 +1,155 @@
+"""Generate synthetic datasets on local disk for benchmarking.
+
+The datasets are written directly through the disk storage broker, hashing
+the item content as it is generated, which is much faster than creating them
+item by item with :class:`dtoolcore.DataSetCreator`. Items are spread over
+directories of 1000 items each.
+
+The item sizes are drawn from one of the distributions in
+:data:`DISTRIBUTIONS`. Every dataset has a "size_class" overlay.
+
+Usage::
+
+    python benchmarks/synthetic.py --items 100000 --distribution lognormal .
+"""
+
+import argparse
+import getpass
+import hashlib
+import math
+import os
+import random
+import time
+import uuid
+
+import dtoolcore
+import dtoolcore.storagebroker
+import dtoolcore.utils
+
+#: Functions returning a random item size in bytes.
+DISTRIBUTIONS = {
+    "empty": lambda rng: 0,
+    "small": lambda rng: rng.randint(0, 4 * 1024),
+    "lognormal": lambda rng: min(
+        int(rng.lognormvariate(math.log(16 * 1024), 1.5)),
+        64 * 1024 * 1024
+    ),
+}
+
+ITEMS_PER_DIRECTORY = 1000
+
+_BLOCK_SIZE = 1024 * 1024
+
+
+def item_relpath(index):
+    """Return relpath of item number index."""
+    return "dir_{:05d}/item_{:08d}.bin".format(
+        index // ITEMS_PER_DIRECTORY,
+        index
+    )
+
+
+def size_class(size_in_bytes):
+    """Return overlay value classifying item sizes by order of magnitude."""
+    if size_in_bytes == 0:
+        return "empty"
+    return "1e{}".format(int(math.log10(size_in_bytes)))
+
+
+def dataset_name(num_items, distribution):
+    return "synthetic-{}-{}".format(num_items, distribution)
+
+
+def create_dataset(base_dir, num_items, distribution="small", seed=0):
+    """Create a synthetic dataset and return its URI.
+
+    :param base_dir: directory the dataset is created in
+    :param num_items: number of items in the dataset
+    :param distribution: name of the item size distribution
+    :param seed: seed of the random number generator, so that datasets
+                 created with the same arguments are identical
+    """
+    rng = random.Random(seed)
+    get_size = DISTRIBUTIONS[distribution]
+    block = os.urandom(_BLOCK_SIZE)
+
+    name = dataset_name(num_items, distribution)
+    uri = dtoolcore.utils.sanitise_uri(os.path.join(base_dir, name))
+    storage_broker = dtoolcore.storagebroker.DiskStorageBroker(uri)
+    storage_broker.create_structure()
+
+    items = {}
+    overlay = {}
+    timestamp = time.time()
+    for index in range(num_items):
+        relpath = item_relpath(index)
+        identifier = dtoolcore.utils.generate_identifier(relpath)
+        fpath = os.path.join(storage_broker._data_abspath, relpath)
+        dirname = os.path.dirname(fpath)
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+
+        # Items start with their index so that their content is unique.
+        size = get_size(rng)
+        hasher = hashlib.md5()
+        with open(fpath, "wb") as fh:
+            remaining = size
+            chunk = "{}\n".format(index).encode("ascii")[:remaining]
+            while remaining > 0:
+                fh.write(chunk)
+                hasher.update(chunk)
+                remaining -= len(chunk)
+                offset = rng.randint(0, _BLOCK_SIZE - 1)
+                chunk = block[offset:offset + min(remaining, _BLOCK_SIZE)]
+
+        items[identifier] = {
+            "relpath": relpath,
+            "size_in_bytes": size,
+            "hash": hasher.hexdigest(),
+            "utc_timestamp": timestamp,
+        }
+        overlay[identifier] = size_class(size)
+
+    storage_broker.put_admin_metadata({
+        "uuid": str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+        "dtoolcore_version": dtoolcore.__version__,
+        "name": name,
+        "type": "dataset",
+        "creator_username": getpass.getuser(),
+        "created_at": timestamp,
+        "frozen_at": timestamp,
+    })
+    storage_broker.put_readme("---\ndescription: synthetic dataset\n")
+    storage_broker.put_manifest({
+        "dtoolcore_version": dtoolcore.__version__,
+        "hash_function": "md5sum_hexdigest",
+        "items": items,
+    })
+    storage_broker.put_overlay("size_class", overlay)
+    return uri
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("base_dir")
+    parser.add_argument("--items", type=int, default=1000)
+    parser.add_argument(
+        "--distribution",
+        choices=sorted(DISTRIBUTIONS.keys()),
+        default="small"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    start = time.time()
+    uri = create_dataset(
+        args.base_dir,
+        args.items,
+        args.distribution,
+        args.seed
+    )
+    print("Created {} in {:.1f}s".format(uri, time.time() - start))
+
+
+if __name__ == "__main__":
+    main()
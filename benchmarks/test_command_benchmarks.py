@@ -0,0 +1,113 @@
+"""Benchmark the time and peak memory of commands on synthetic datasets.
+
+Requires pytest-benchmark. Results are stored with the commit they were
+measured at, so that runs can be compared across commits::
+
+    pytest benchmarks --benchmark-autosave
+    pytest benchmarks --benchmark-compare
+
+The peak memory traced by ``tracemalloc`` and the peak resident set size of
+the process are recorded in the ``extra_info`` of each benchmark, from an
+additional run of the command after it has been timed. Command output is
+written to ``os.devnull``.
+"""
+
+import contextlib
+import os
+import sys
+import tracemalloc
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+from dtool_info.dataset import (  # NOQA
+    diff,
+    identifiers,
+    ls,
+    summary,
+    verify,
+)
+from dtool_info.instrumentation import peak_rss  # NOQA
+from dtool_info.inventory import inventory  # NOQA
+from dtool_info.overlay import show  # NOQA
+
+
+@contextlib.contextmanager
+def _output_to_devnull():
+    stdout, stderr = sys.stdout, sys.stderr
+    with open(os.devnull, "w") as devnull:
+        sys.stdout = sys.stderr = devnull
+        try:
+            yield
+        finally:
+            sys.stdout, sys.stderr = stdout, stderr
+
+
+def _run_command(benchmark, command, args):
+
+    def run():
+        with _output_to_devnull():
+            try:
+                command.main(args, standalone_mode=False)
+            except SystemExit as e:
+                assert not e.code, "{} exited with {}".format(args, e.code)
+
+    benchmark(run)
+
+    tracemalloc.start()
+    try:
+        run()
+        benchmark.extra_info["peak_traced_bytes"] = \
+            tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    benchmark.extra_info["peak_rss_bytes"] = peak_rss()
+
+
+def test_ls(benchmark, synthetic_dataset):
+    _run_command(benchmark, ls, [synthetic_dataset.path])
+
+
+def test_ls_base_uri(benchmark, synthetic_dataset):
+    _run_command(benchmark, ls, [synthetic_dataset.base_dir])
+
+
+def test_summary(benchmark, synthetic_dataset):
+    _run_command(benchmark, summary, [synthetic_dataset.path])
+
+
+def test_identifiers(benchmark, synthetic_dataset):
+    _run_command(benchmark, identifiers, [synthetic_dataset.path])
+
+
+def test_verify(benchmark, synthetic_dataset):
+    _run_command(benchmark, verify, [synthetic_dataset.path])
+
+
+def test_verify_full(benchmark, synthetic_dataset):
+    _run_command(benchmark, verify, ["--full", synthetic_dataset.path])
+
+
+def test_diff(benchmark, synthetic_dataset):
+    path = synthetic_dataset.path
+    _run_command(benchmark, diff, [path, path])
+
+
+def test_diff_full(benchmark, synthetic_dataset):
+    path = synthetic_dataset.path
+    _run_command(benchmark, diff, ["--full", path, path])
+
+
+@pytest.mark.parametrize("fmt", [None, "csv", "tsv", "html"])
+def test_inventory(benchmark, synthetic_dataset, fmt):
+    args = [synthetic_dataset.base_dir]
+    if fmt is not None:
+        args = ["--format", fmt] + args
+    _run_command(benchmark, inventory, args)
+
+
+@pytest.mark.parametrize("fmt", ["json", "ndjson", "tsv"])
+def test_overlay_show(benchmark, synthetic_dataset, fmt):
+    args = ["--format", fmt, synthetic_dataset.path, "size_class"]
+    _run_command(benchmark, show, args)
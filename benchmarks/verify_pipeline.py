@@ -0,0 +1,96 @@
+"""Benchmark pipelined fetching and hashing in 'dtool verify --full'.
+
+Uses a stand-in storage broker that serves a local disk dataset, but sleeps
+before copying each item into a cache directory to simulate the latency of
+fetching items from remote storage.
+
+Usage::
+
+    python benchmarks/verify_pipeline.py --items 200 --latency 0.05
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import dtoolcore
+import dtoolcore.storagebroker
+
+from dtool_info.integrity import iter_problems
+
+
+class LatencyStorageBroker(dtoolcore.storagebroker.DiskStorageBroker):
+    """Disk storage broker simulating fetches from remote storage."""
+
+    key = "latency"
+    latency = 0.05
+    cache_directory = None
+
+    def get_item_abspath(self, identifier):
+        abspath = super(LatencyStorageBroker, self).get_item_abspath(
+            identifier
+        )
+        cache_abspath = os.path.join(self.cache_directory, identifier)
+        if not os.path.isfile(cache_abspath):
+            time.sleep(self.latency)
+            shutil.copyfile(abspath, cache_abspath)
+        return cache_abspath
+
+
+def create_dataset(base_dir, num_items, item_size):
+    """Return URI of a dataset with random item content."""
+    with dtoolcore.DataSetCreator("bench", base_dir) as creator:
+        for i in range(num_items):
+            fpath = os.path.join(base_dir, "tmp_item")
+            with open(fpath, "wb") as fh:
+                fh.write(os.urandom(item_size))
+            creator.put_item(fpath, "item_{}.bin".format(i))
+        return creator.uri
+
+
+def run(uri, num_fetchers, num_hashers):
+    """Return time taken to verify the dataset with a cold cache."""
+    shutil.rmtree(LatencyStorageBroker.cache_directory)
+    os.mkdir(LatencyStorageBroker.cache_directory)
+    dataset = dtoolcore.DataSet.from_uri(uri)
+    start = time.time()
+    problems = list(iter_problems(dataset, True, None, num_fetchers,
+                                  num_hashers))
+    elapsed = time.time() - start
+    assert problems == []
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--items", type=int, default=200)
+    parser.add_argument("--item-size", type=int, default=1024 * 1024)
+    parser.add_argument("--latency", type=float, default=0.05)
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        uri = create_dataset(tmp_dir, args.items, args.item_size)
+
+        LatencyStorageBroker.latency = args.latency
+        LatencyStorageBroker.cache_directory = os.path.join(tmp_dir, "cache")
+        os.mkdir(LatencyStorageBroker.cache_directory)
+
+        # Serve the dataset through the stand-in broker.
+        dtoolcore._get_storage_broker = LatencyStorageBroker
+
+        total_mb = args.items * args.item_size / 1e6
+        print("{} items of {} bytes, {}s fetch latency".format(
+            args.items, args.item_size, args.latency))
+        for num_fetchers, num_hashers in [(1, 1), (4, 1), (8, 2), (16, 4)]:
+            elapsed = run(uri, num_fetchers, num_hashers)
+            print("fetchers={:2d} hashers={:2d} {:7.2f}s {:8.1f} MB/s".format(
+                num_fetchers, num_hashers, elapsed, total_mb / elapsed))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,311 @@
+"""Local catalog of the datasets in base URIs.
+
+The admin metadata of the datasets is stored in a SQLite database in the
+dtool-info cache directory, indexed by name, creator, UUID and date, so that
+datasets can be found without listing the base URIs again. Refreshing the
+catalog only reads the admin metadata of datasets that are not in it yet.
+
+The catalog also holds an inverted index of the words in the READMEs, names
+and creators of the datasets, keyed by dataset UUID, for ranked keyword
+searches.
+"""
+
+import math
+import os
+import re
+import sqlite3
+import time
+
+import dtoolcore
+
+from dtool_cli.cli import CONFIG_PATH
+
+from dtool_info.instrumentation import phase
+from dtool_info.utils import cache_dir
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS base_uris (
+    base_uri TEXT PRIMARY KEY,
+    refreshed_at REAL
+);
+CREATE TABLE IF NOT EXISTS datasets (
+    uri TEXT PRIMARY KEY,
+    base_uri TEXT,
+    uuid TEXT,
+    name TEXT,
+    creator TEXT,
+    type TEXT,
+    frozen_at REAL
+);
+CREATE INDEX IF NOT EXISTS datasets_base_uri ON datasets (base_uri);
+CREATE INDEX IF NOT EXISTS datasets_uuid ON datasets (uuid);
+CREATE INDEX IF NOT EXISTS datasets_name ON datasets (name);
+CREATE INDEX IF NOT EXISTS datasets_creator ON datasets (creator);
+CREATE INDEX IF NOT EXISTS datasets_frozen_at ON datasets (frozen_at);
+CREATE TABLE IF NOT EXISTS documents (
+    uuid TEXT PRIMARY KEY,
+    length INTEGER
+);
+CREATE TABLE IF NOT EXISTS postings (
+    term TEXT,
+    uuid TEXT,
+    count INTEGER,
+    PRIMARY KEY (term, uuid)
+);
+CREATE INDEX IF NOT EXISTS postings_uuid ON postings (uuid);
+"""
+
+#: Parameters of the Okapi BM25 ranking of keyword searches.
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_TOKEN_REGEX = re.compile(r"[^\W_]+", re.UNICODE)
+
+_COLUMNS = ("uri", "base_uri", "uuid", "name", "creator", "type", "frozen_at")
+
+
+def catalog_fpath():
+    """Return path to the catalog database."""
+    return os.path.join(cache_dir("catalog"), "catalog.sqlite")
+
+
+def tokenize(text):
+    """Return list of the lower case words in the text."""
+    return [token.lower() for token in _TOKEN_REGEX.findall(text)]
+
+
+def _readme_content(uri):
+    with phase("load readme"):
+        storage_broker = dtoolcore._get_storage_broker(uri, CONFIG_PATH)
+        return storage_broker.get_readme_content()
+
+
+def _admin_metadata(uri):
+    with phase("load admin metadata"):
+        return dtoolcore._admin_metadata_from_uri(uri, CONFIG_PATH)
+
+
+class Catalog(object):
+    """Catalog of the datasets in base URIs.
+
+    Use as a context manager to close the database when done::
+
+        with Catalog() as catalog:
+            catalog.refresh(base_uri)
+            datasets = catalog.search(name="*climate*")
+    """
+
+    def __init__(self, fpath=None):
+        if fpath is None:
+            fpath = catalog_fpath()
+        self._connection = sqlite3.connect(fpath)
+        self._connection.executescript(_SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self._connection.close()
+
+    @property
+    def base_uris(self):
+        """Return sorted list of the base URIs in the catalog."""
+        return [row[0] for row in self._connection.execute(
+            "SELECT base_uri FROM base_uris ORDER BY base_uri")]
+
+    def refresh(self, base_uri, executor=None):
+        """Update the datasets of a base URI and return the number read.
+
+        The admin metadata is only read for datasets that are not in the
+        catalog yet, and for proto datasets, which may have been frozen since.
+        Datasets that are no longer in the base URI are removed, along with
+        their READMEs in the keyword index unless a copy of the dataset is
+        left in the catalog.
+
+        :param base_uri: sanitised base URI
+        :param executor: optional executor reading the admin metadata of
+                         several datasets concurrently
+        """
+        with phase("list datasets"):
+            StorageBroker = dtoolcore._get_storage_broker(
+                base_uri,
+                CONFIG_PATH
+            )
+            uris = set(StorageBroker.list_dataset_uris(base_uri, CONFIG_PATH))
+
+        known = dict(self._connection.execute(
+            "SELECT uri, type FROM datasets WHERE base_uri = ?",
+            (base_uri,)
+        ))
+        to_read = sorted(
+            uri for uri in uris if known.get(uri, "protodataset") != "dataset"
+        )
+        mapper = map if executor is None else executor.map
+        rows = []
+        for uri, admin_metadata in zip(to_read, mapper(_admin_metadata,
+                                                       to_read)):
+            rows.append((
+                uri,
+                base_uri,
+                admin_metadata["uuid"],
+                admin_metadata["name"],
+                admin_metadata["creator_username"],
+                admin_metadata["type"],
+                admin_metadata.get("frozen_at"),
+            ))
+
+        removed = [(uri,) for uri in set(known).difference(uris)]
+        with self._connection:
+            removed_uuids = set(
+                self._connection.execute(
+                    "SELECT uuid FROM datasets WHERE uri = ?", uri
+                ).fetchone()
+                for uri in removed
+            )
+            self._connection.executemany(
+                "DELETE FROM datasets WHERE uri = ?",
+                removed
+            )
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO datasets VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+            # Remove the keyword index of datasets without any copy left.
+            for table in ("documents", "postings"):
+                self._connection.executemany(
+                    "DELETE FROM {} WHERE uuid = ? AND NOT EXISTS "
+                    "(SELECT 1 FROM datasets WHERE datasets.uuid = ?)".format(
+                        table),
+                    [(uuid, uuid) for (uuid,) in removed_uuids]
+                )
+            self._connection.execute(
+                "INSERT OR REPLACE INTO base_uris VALUES (?, ?)",
+                (base_uri, time.time())
+            )
+        return len(rows)
+
+    def search(self, base_uris=None, name=None, creator=None, uuid=None,
+               frozen_after=None, frozen_before=None):
+        """Return list of the datasets matching all the given criteria.
+
+        The datasets are dictionaries with the keys uri, base_uri, uuid,
+        name, creator, type and frozen_at, sorted by name and URI.
+
+        :param base_uris: list of base URIs holding the datasets
+        :param name: glob pattern matching the dataset names
+        :param creator: username of the creator
+        :param uuid: UUID, or start of the UUID, of the datasets
+        :param frozen_after: timestamp the datasets were frozen at or after
+        :param frozen_before: timestamp the datasets were frozen before
+        """
+        conditions = []
+        parameters = []
+        if base_uris:
+            conditions.append("base_uri IN ({})".format(
+                ", ".join("?" * len(base_uris))))
+            parameters.extend(base_uris)
+        if name is not None:
+            conditions.append("name GLOB ?")
+            parameters.append(name)
+        if creator is not None:
+            conditions.append("creator = ?")
+            parameters.append(creator)
+        if uuid is not None:
+            conditions.append("uuid LIKE ?")
+            parameters.append(uuid.replace("%", "").replace("_", "") + "%")
+        if frozen_after is not None:
+            conditions.append("frozen_at >= ?")
+            parameters.append(frozen_after)
+        if frozen_before is not None:
+            conditions.append("frozen_at < ?")
+            parameters.append(frozen_before)
+
+        sql = "SELECT {} FROM datasets".format(", ".join(_COLUMNS))
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY name, uri"
+        return [
+            dict(zip(_COLUMNS, row))
+            for row in self._connection.execute(sql, parameters)
+        ]
+
+    def index_readmes(self, base_uris=None, executor=None, reindex=False):
+        """Add the READMEs of frozen datasets to the keyword index.
+
+        The README is only read for datasets whose UUID is not in the index
+        yet, unless reindex is True. The name and creator of the datasets are
+        indexed along with the README.
+
+        :param base_uris: optional list of base URIs of the datasets
+        :param executor: optional executor reading several READMEs
+                         concurrently
+        :param reindex: read the READMEs of the datasets already indexed
+        :returns: number of READMEs read
+        """
+        datasets = {}
+        for d in self.search(base_uris):
+            if d["type"] == "dataset":
+                datasets.setdefault(d["uuid"], d)
+        if not reindex:
+            indexed = set(row[0] for row in self._connection.execute(
+                "SELECT uuid FROM documents"))
+            datasets = dict(
+                (uuid, d) for uuid, d in datasets.items()
+                if uuid not in indexed
+            )
+
+        uuids = sorted(datasets)
+        uris = [datasets[uuid]["uri"] for uuid in uuids]
+        mapper = map if executor is None else executor.map
+        with self._connection:
+            for uuid, readme in zip(uuids, mapper(_readme_content, uris)):
+                d = datasets[uuid]
+                tokens = tokenize(
+                    " ".join([d["name"], d["creator"], readme or ""])
+                )
+                counts = {}
+                for token in tokens:
+                    counts[token] = counts.get(token, 0) + 1
+                self._connection.execute(
+                    "DELETE FROM postings WHERE uuid = ?", (uuid,))
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO documents VALUES (?, ?)",
+                    (uuid, len(tokens))
+                )
+                self._connection.executemany(
+                    "INSERT INTO postings VALUES (?, ?, ?)",
+                    [(term, uuid, count) for term, count in counts.items()]
+                )
+        return len(uuids)
+
+    def keyword_scores(self, query):
+        """Return dictionary of the BM25 scores of the datasets by UUID.
+
+        Only datasets containing at least one of the words of the query are
+        scored.
+        """
+        num_documents, total_length = self._connection.execute(
+            "SELECT COUNT(*), SUM(length) FROM documents").fetchone()
+        if not num_documents:
+            return {}
+        average_length = float(total_length) / num_documents or 1.0
+
+        scores = {}
+        for term in set(tokenize(query)):
+            postings = self._connection.execute(
+                "SELECT postings.uuid, count, length FROM postings "
+                "JOIN documents ON postings.uuid = documents.uuid "
+                "WHERE term = ?",
+                (term,)
+            ).fetchall()
+            idf = math.log(1.0 + (num_documents - len(postings) + 0.5)
+                           / (len(postings) + 0.5))
+            for uuid, count, length in postings:
+                norm = BM25_K1 * (1.0 - BM25_B + BM25_B * length
+                                  / average_length)
+                scores[uuid] = scores.get(uuid, 0.0) \
+                    + idf * count * (BM25_K1 + 1.0) / (count + norm)
+        return scores
@@ -1,8 +1,11 @@
 """Commands for getting information about datasets."""
 
+import errno
+import json
 import sys
+import time
 
-from operator import itemgetter
+from concurrent.futures import ThreadPoolExecutor
 
 import click
 
@@ -11,11 +14,6 @@ import pygments.lexers
 import pygments.formatters
 
 import dtoolcore
-from dtoolcore.compare import (
-    diff_identifiers,
-    diff_sizes,
-    diff_content,
-)
 
 from dtool_cli.cli import (
     base_dataset_uri_argument,
@@ -24,11 +22,122 @@ from dtool_cli.cli import (
     CONFIG_PATH,
 )
 
-from dtool_info.utils import sizeof_fmt, date_fmt
+from dtool_info import overlay_cache
+from dtool_info.catalog import Catalog
+from dtool_info.directory import DirectoryView, local_directory
+from dtool_info.duplicates import renamed_items
+from dtool_info.integrity import (
+    diff_content,
+    diff_identifiers,
+    diff_sizes,
+    iter_problems,
+    merge_results,
+    parse_shard,
+    write_result,
+)
+from dtool_info.fetch import (
+    key_stamp,
+    prefetch as _prefetch,
+    select_identifiers,
+    stream_item,
+)
+from dtool_info.fingerprint import (
+    ANNOTATION_NAME as FINGERPRINT_ANNOTATION_NAME,
+    bucket,
+    cache_fingerprint,
+    dataset_fingerprint,
+    load_cached_fingerprint,
+    Fingerprint,
+)
+from dtool_info.hashing import IOThrottle
+from dtool_info.manifest import CompactManifest, ManifestStream
+from dtool_info.query import parse_item_predicate, select_rows
+from dtool_info.tree import SizeTree
+from dtool_info.instrumentation import (
+    memstats_option,
+    phase,
+    timings_option,
+)
+from dtool_info.utils import (
+    sizeof_fmt,
+    date_fmt,
+    exit_on_broken_pipe,
+    size_validation,
+    OutputWriter,
+)
 
 item_identifier_argument = click.argument("item_identifier")
 
 
+def _jobs_default(ctx, param, value):
+    """Click callback defaulting to the DTOOL_NUM_PROCESSES setting."""
+    if value is not None:
+        return value
+    try:
+        value = int(dtoolcore.utils.get_config_value(
+            "DTOOL_NUM_PROCESSES",
+            CONFIG_PATH,
+            default=1
+        ))
+    except ValueError:
+        raise click.BadParameter("DTOOL_NUM_PROCESSES must be an integer")
+    return max(value, 1)
+
+
+jobs_option = click.option(
+    "-j",
+    "--jobs",
+    type=click.IntRange(min=1),
+    callback=_jobs_default,
+    help="Number of threads calculating hashes. Defaults to the "
+         "DTOOL_NUM_PROCESSES setting used by dtool, or 1."
+)
+
+fetch_jobs_option = click.option(
+    "--fetch-jobs",
+    type=click.IntRange(min=1),
+    default=4,
+    show_default=True,
+    help="Number of threads fetching item content for hashing."
+)
+
+
+def _bandwidth_validation(ctx, param, value):
+    """Click callback parsing a positive number of bytes per second."""
+    value = size_validation(ctx, param, value)
+    if value is not None and value <= 0:
+        raise click.BadParameter("Bandwidth must be positive")
+    return value
+
+
+max_bandwidth_option = click.option(
+    "--max-bandwidth",
+    callback=_bandwidth_validation,
+    help="Maximum bytes per second read when hashing, e.g. 100M."
+)
+
+max_iops_option = click.option(
+    "--max-iops",
+    type=click.IntRange(min=1),
+    help="Maximum number of reads per second when hashing."
+)
+
+
+def _dataset_or_directory_validation(ctx, param, value):
+    """Click callback accepting a dataset URI or a plain local directory."""
+    path = local_directory(value)
+    if path is not None:
+        return DirectoryView(path)
+    return dataset_uri_validation(ctx, param, value)
+
+
+stream_option = click.option(
+    "--stream",
+    is_flag=True,
+    help="Parse the manifest incrementally to reduce peak memory."
+)
+
+
 @click.command()
 @click.option(
     "-f",
@@ -36,9 +145,22 @@ item_identifier_argument = click.argument("item_identifier")
     is_flag=True,
     help="Include file hash comparisons."
 )
-@dataset_uri_argument
+@jobs_option
+@fetch_jobs_option
+@max_bandwidth_option
+@max_iops_option
+@click.option(
+    "-c",
+    "--cache",
+    is_flag=True,
+    help="Compare datasets using fingerprints stored locally."
+)
+@click.argument("dataset_uri", callback=_dataset_or_directory_validation)
 @click.argument("reference_dataset_uri", callback=dataset_uri_validation)
-def diff(full, dataset_uri, reference_dataset_uri):
+@timings_option
+@memstats_option
+def diff(full, jobs, fetch_jobs, max_bandwidth, max_iops, cache, dataset_uri,
+         reference_dataset_uri):
     """Report the difference between two datasets.
 
     1. Checks that the identifiers are identicial
@@ -49,9 +171,23 @@ def diff(full, dataset_uri, reference_dataset_uri):
     out. Similarly if a difference is detected in step 2, step 3 will not be
     carried out.
 
+    Items only present in one of the datasets that have the same hash and
+    size as an item only present in the other are reported as renamed.
+
     When checking that the hashes are identical the hashes for the first
     dataset are recalculated using the hashing algorithm of the reference
-    dataset.
+    dataset. The '--max-bandwidth' and '--max-iops' options limit the load
+    this puts on the storage.
+
+    The first dataset can also be a plain local directory, for example to
+    check that it matches a dataset before uploading it. Its files are
+    identified by their relpaths, in the same way as the items of a dataset.
+
+    With the '--cache' option the fingerprints of the manifests are stored
+    locally by dataset UUID and URI. Once both are stored, datasets with the
+    same fingerprint are reported identical without loading their manifests
+    and otherwise only the items in the parts of the manifests that differ
+    are compared. The '--full' option still hashes the content of all items.
     """
 
     def echo_header(desc, ds_name, ref_ds_name, prop):
@@ -64,20 +200,82 @@ def diff(full, dataset_uri, reference_dataset_uri):
             line = "{}, {}, {}".format(d[0], d[1], d[2])
             click.secho(line)
 
-    ds = dtoolcore.DataSet.from_uri(dataset_uri)
-    ref_ds = dtoolcore.DataSet.from_uri(reference_dataset_uri)
+    with phase("load datasets"):
+        if isinstance(dataset_uri, DirectoryView):
+            ds = dataset_uri
+        else:
+            ds = dtoolcore.DataSet.from_uri(dataset_uri)
+        ref_ds = dtoolcore.DataSet.from_uri(reference_dataset_uri)
+
+    # Directories have no UUID to cache fingerprints by.
+    cache = cache and not isinstance(ds, DirectoryView)
+
+    buckets = None
+    if cache:
+        with phase("compare fingerprints"):
+            fingerprint = load_cached_fingerprint(ds)
+            ref_fingerprint = load_cached_fingerprint(ref_ds)
+        if fingerprint is not None and ref_fingerprint is not None \
+                and not full:
+            if fingerprint == ref_fingerprint:
+                return
+            buckets = fingerprint.differing_buckets(ref_fingerprint)
+    select = None if buckets is None else lambda i: bucket(i) in buckets
+
+    with phase("load manifests"):
+        if isinstance(ds, DirectoryView):
+            manifest = ds.manifest(select)
+        else:
+            manifest = CompactManifest.from_dataset(ds, select=select)
+        ref_manifest = CompactManifest.from_dataset(ref_ds, select=select)
+
+    if cache and buckets is None:
+        with phase("cache fingerprints"):
+            if fingerprint is None:
+                cache_fingerprint(ds, Fingerprint.from_manifest(manifest))
+            if ref_fingerprint is None:
+                cache_fingerprint(
+                    ref_ds,
+                    Fingerprint.from_manifest(ref_manifest)
+                )
 
-    num_items = len(list(ref_ds.identifiers))
+    num_items = len(ref_manifest)
 
-    ids_diff = diff_identifiers(ds, ref_ds)
+    with phase("compare identifiers"):
+        ids_diff = diff_identifiers(manifest, ref_manifest)
     if len(ids_diff) > 0:
-        echo_header("identifiers", ds.name, ref_ds.name, "present")
-        echo_diff(ids_diff)
+        renamed = []
+        if manifest.hash_function == ref_manifest.hash_function:
+            with phase("find renamed items"):
+                renamed = renamed_items(
+                    [(i, manifest.item_properties(i))
+                     for i, in_a, _ in ids_diff if in_a],
+                    [(i, ref_manifest.item_properties(i))
+                     for i, _, in_b in ids_diff if in_b],
+                    manifest.hash_function
+                )
+            renamed_ids = set()
+            for _, relpath, ref_relpath in renamed:
+                renamed_ids.add(dtoolcore.utils.generate_identifier(relpath))
+                renamed_ids.add(
+                    dtoolcore.utils.generate_identifier(ref_relpath)
+                )
+            ids_diff = [d for d in ids_diff if d[0] not in renamed_ids]
+
+        if len(ids_diff) > 0:
+            echo_header("identifiers", ds.name, ref_ds.name, "present")
+            echo_diff(ids_diff)
+        if len(renamed) > 0:
+            click.secho("Renamed items", fg="red")
+            click.secho("hash, relpath in '{}', relpath in '{}'".format(
+                ds.name, ref_ds.name))
+            echo_diff(renamed)
         sys.exit(1)
 
     with click.progressbar(length=num_items,
-                           label="Comparing sizes") as progressbar:
-        sizes_diff = diff_sizes(ds, ref_ds, progressbar)
+                           label="Comparing sizes") as progressbar, \
+            phase("compare sizes"):
+        sizes_diff = diff_sizes(manifest, ref_manifest, progressbar)
     if len(sizes_diff) > 0:
         echo_header("sizes", ds.name, ref_ds.name, "size")
         echo_diff(sizes_diff)
@@ -85,20 +283,78 @@ def diff(full, dataset_uri, reference_dataset_uri):
 
     if full:
         with click.progressbar(length=num_items,
-                               label="Comparing hashes") as progressbar:
-            content_diff = diff_content(ds, ref_ds, progressbar)
+                               label="Comparing hashes") as progressbar, \
+                phase("compare hashes"):
+            content_diff = diff_content(
+                ds,
+                ref_ds,
+                progressbar,
+                fetch_jobs,
+                jobs,
+                IOThrottle(max_bandwidth, max_iops),
+                manifest,
+                ref_manifest
+            )
         if len(content_diff) > 0:
             echo_header("content", ds.name, ref_ds.name, "hash")
             echo_diff(content_diff)
             sys.exit(3)
 
 
-def _list_dataset_items(uri, quiet, verbose):
+@click.command()
+@click.option(
+    "-c",
+    "--cache",
+    is_flag=True,
+    help="Store the fingerprint locally and reuse it later."
+)
+@click.option(
+    "-a",
+    "--annotate",
+    is_flag=True,
+    help="Store the fingerprint as an annotation of the dataset."
+)
+@dataset_uri_argument
+@timings_option
+def fingerprint(cache, annotate, dataset_uri):
+    """Return fingerprint of the items in the dataset manifest.
+
+    The fingerprint is a digest of the identifiers, sizes and hashes of all
+    items. Datasets with the same fingerprint have the same items.
+
+    With the '--annotate' option the fingerprint is stored in the
+    "fingerprint" annotation of the dataset. Annotations are copied along
+    with the dataset, so the annotation of a copy describes the dataset it
+    was copied from; 'dtool diff --cache' therefore does not use it.
+    """
+    with phase("load dataset"):
+        dataset = dtoolcore.DataSet.from_uri(dataset_uri)
+
+    fp = dataset_fingerprint(dataset, cache)
+
+    if annotate:
+        with phase("annotate"):
+            dataset.put_annotation(FINGERPRINT_ANNOTATION_NAME, fp.as_dict())
+
+    click.secho(fp.root)
+
+
+def _iter_manifest_items(dataset, stream):
+    """Yield (identifier, properties) tuples of the items in the manifest."""
+    if stream:
+        return iter(ManifestStream(dataset))
+    with phase("load manifest"):
+        dataset._manifest
+    return ((i, dataset.item_properties(i)) for i in dataset.identifiers)
+
+
+def _list_dataset_items(uri, quiet, verbose, stream=False):
     try:
-        dataset = dtoolcore.DataSet.from_uri(
-            uri=uri,
-            config_path=CONFIG_PATH
-        )
+        with phase("load dataset"):
+            dataset = dtoolcore.DataSet.from_uri(
+                uri=uri,
+                config_path=CONFIG_PATH
+            )
     except dtoolcore.DtoolCoreTypeError:
         click.secho(
             "Cannot list the items of a proto dataset",
@@ -107,70 +363,99 @@ def _list_dataset_items(uri, quiet, verbose):
         )
         sys.exit(1)
 
-    content = []
-    for i in dataset.identifiers:
-        props = dataset.item_properties(i)
-        content.append({
-            "identifier": i,
-            "relpath": props["relpath"],
-            "size_in_bytes": props["size_in_bytes"]
-        })
-
-    for c in sorted(content, key=itemgetter("relpath")):
-        line = "{}\t{}".format(c["identifier"], c["relpath"])
-        if verbose:
-            line = "{}{}  {}".format(
-                c["identifier"],
-                sizeof_fmt(c["size_in_bytes"]),
-                c["relpath"]
-            )
-        if quiet:
-            line = c["relpath"]
-        click.secho(line)
+    items = _iter_manifest_items(dataset, stream)
+
+    # Only keep what is needed for the output, as tuples sorting by relpath.
+    with phase("collect items"):
+        content = [
+            (props["relpath"], i, props["size_in_bytes"])
+            for i, props in items
+        ]
+
+    with phase("sort items"):
+        content.sort()
+
+    with OutputWriter() as out, phase("output"):
+        for relpath, identifier, size_in_bytes in content:
+            line = "{}\t{}".format(identifier, relpath)
+            if verbose:
+                line = "{}{}  {}".format(
+                    identifier,
+                    sizeof_fmt(size_in_bytes),
+                    relpath
+                )
+            if quiet:
+                line = relpath
+            out.line(line)
 
 
 def _list_datasets(base_uri, quiet, verbose):
     base_uri = dtoolcore.utils.sanitise_uri(base_uri)
-    StorageBroker = dtoolcore._get_storage_broker(base_uri, CONFIG_PATH)
+    with phase("list datasets"):
+        StorageBroker = dtoolcore._get_storage_broker(base_uri, CONFIG_PATH)
+        uris = list(StorageBroker.list_dataset_uris(base_uri, CONFIG_PATH))
     info = []
-    for uri in StorageBroker.list_dataset_uris(base_uri, CONFIG_PATH):
-        admin_metadata = dtoolcore._admin_metadata_from_uri(uri, CONFIG_PATH)
-        fg = "green"
-        name = admin_metadata["name"]
-        if admin_metadata["type"] == "protodataset":
-            fg = "red"
-            name = "*" + name
-        i = dict(
-            name=name,
-            uuid=admin_metadata["uuid"],
-            creator=admin_metadata["creator_username"],
-            uri=uri,
-            fg=fg)
-        if "frozen_at" in admin_metadata:
-            i["date"] = date_fmt(admin_metadata["frozen_at"])
-        info.append(i)
+    for uri in uris:
+        with phase("load admin metadata"):
+            admin_metadata = dtoolcore._admin_metadata_from_uri(
+                uri,
+                CONFIG_PATH
+            )
+        info.append(_dataset_listing_info(
+            uri,
+            admin_metadata["name"],
+            admin_metadata["uuid"],
+            admin_metadata["creator_username"],
+            admin_metadata["type"],
+            admin_metadata.get("frozen_at")
+        ))
 
     if len(info) == 0:
         sys.exit(0)
 
-    for i in info:
-        if quiet:
-            click.secho(i["uri"], fg=i["fg"])
-            continue
-        click.secho(i["name"], fg=i["fg"])
-        click.secho("  " + i["uri"])
-        if verbose:
-            click.secho("  " + i["creator"], nl=False)
-            if "date" in i:
-                click.secho("  " + i["date"], nl=False)
-            click.secho("  " + i["uuid"])
+    _echo_datasets(info, quiet, verbose)
+
+
+def _dataset_listing_info(uri, name, uuid, creator, type, frozen_at):
+    """Return dictionary of the values shown when listing a dataset."""
+    fg = "green"
+    if type == "protodataset":
+        fg = "red"
+        name = "*" + name
+    i = dict(
+        name=name,
+        uuid=uuid,
+        creator=creator,
+        uri=uri,
+        fg=fg)
+    if frozen_at is not None:
+        i["date"] = date_fmt(frozen_at)
+    return i
+
+
+def _echo_datasets(info, quiet, verbose):
+    with OutputWriter() as out, phase("output"):
+        for i in info:
+            if quiet:
+                out.line(i["uri"], fg=i["fg"])
+                continue
+            out.line(i["name"], fg=i["fg"])
+            out.line("  " + i["uri"])
+            if verbose:
+                out.write("  " + i["creator"])
+                if "date" in i:
+                    out.write("  " + i["date"])
+                out.line("  " + i["uuid"])
 
 
 @click.command()
 @click.option("-q", "--quiet", is_flag=True)
 @click.option("-v", "--verbose", is_flag=True)
+@stream_option
 @click.argument("uri")
-def ls(quiet, verbose, uri):
+@timings_option
+@memstats_option
+def ls(quiet, verbose, stream, uri):
     """List datasets / items in a dataset.
 
     If the URI is a dataset the items in the dataset will be listed.
@@ -178,20 +463,156 @@ def ls(quiet, verbose, uri):
 
     If the URI is a location containing datasets the datasets will be listed.
     Proto datasets are highlighted in red.
+
+    The '--stream' option reduces the memory needed to list the items of
+    large datasets on local disk.
     """
     if dtoolcore._is_dataset(uri, CONFIG_PATH):
-        _list_dataset_items(uri, quiet, verbose)
+        _list_dataset_items(uri, quiet, verbose, stream)
     else:
         _list_datasets(uri, quiet, verbose)
 
 
+def _date_timestamp(ctx, param, value):
+    """Click callback converting a date to a local timestamp."""
+    if value is None:
+        return None
+    return time.mktime(value.timetuple())
+
+
+@click.command()
+@click.option("-q", "--quiet", is_flag=True)
+@click.option("-v", "--verbose", is_flag=True)
+@click.option(
+    "-r",
+    "--refresh",
+    is_flag=True,
+    help="Add the datasets not in the catalog yet."
+)
+@click.option(
+    "-j",
+    "--jobs",
+    type=click.IntRange(min=1),
+    default=4,
+    show_default=True,
+    help="Number of datasets read concurrently when refreshing."
+)
+@click.option("-n", "--name", help="Glob pattern matching dataset names.")
+@click.option("--creator", help="Username of the dataset creator.")
+@click.option("-u", "--uuid", "uuid_prefix", help="Start of dataset UUID.")
+@click.option(
+    "--after",
+    type=click.DateTime(formats=["%Y-%m-%d"]),
+    callback=_date_timestamp,
+    help="Frozen on or after date, e.g. 2020-01-31."
+)
+@click.option(
+    "--before",
+    type=click.DateTime(formats=["%Y-%m-%d"]),
+    callback=_date_timestamp,
+    help="Frozen before date, e.g. 2020-01-31."
+)
+@click.option(
+    "-t",
+    "--text",
+    help="Words to look for in the READMEs, names and creators."
+)
+@click.option(
+    "--reindex",
+    is_flag=True,
+    help="Read the READMEs of the datasets already indexed again."
+)
+@click.argument("base_uris", nargs=-1)
+@timings_option
+def search(quiet, verbose, refresh, jobs, name, creator, uuid_prefix, after,
+           before, text, reindex, base_uris):
+    """Find datasets in a local catalog of base URIs.
+
+    Base URIs are added to the catalog the first time they are searched.
+    Searches without base URIs cover all base URIs in the catalog. With the
+    '--refresh' option the catalog is updated with the datasets added to and
+    removed from the base URIs since, only reading the metadata of the new
+    datasets.
+
+    Datasets are listed in the same way as by 'dtool ls' and match all the
+    criteria given.
+
+    With the '--text' option the datasets containing any of the words of the
+    text in their README, name or creator are listed, best matches first.
+    The words are looked up in an index of the catalog, keyed by dataset
+    UUID. The READMEs of datasets not in the index yet are read and indexed
+    first. READMEs updated since they were indexed are read again with the
+    '--reindex' option.
+    """
+    if reindex and text is None:
+        raise click.BadParameter(
+            "Only valid with '--text'",
+            param_hint="'--reindex'"
+        )
+    base_uris = [dtoolcore.utils.sanitise_uri(u) for u in base_uris]
+
+    with Catalog() as catalog:
+        to_refresh = [
+            u for u in base_uris if refresh or u not in catalog.base_uris
+        ]
+        if refresh and not base_uris:
+            to_refresh = catalog.base_uris
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            for base_uri in to_refresh:
+                catalog.refresh(base_uri, executor)
+            if text is not None:
+                with phase("index readmes"):
+                    catalog.index_readmes(base_uris, executor, reindex)
+
+        with phase("search"):
+            datasets = catalog.search(
+                base_uris,
+                name=name,
+                creator=creator,
+                uuid=uuid_prefix,
+                frozen_after=after,
+                frozen_before=before
+            )
+            if text is not None:
+                scores = catalog.keyword_scores(text)
+                datasets = sorted(
+                    (d for d in datasets if d["uuid"] in scores),
+                    key=lambda d: -scores[d["uuid"]]
+                )
+
+    if len(datasets) == 0:
+        sys.exit(0)
+
+    _echo_datasets(
+        [
+            _dataset_listing_info(
+                d["uri"],
+                d["name"],
+                d["uuid"],
+                d["creator"],
+                d["type"],
+                d["frozen_at"]
+            )
+            for d in datasets
+        ],
+        quiet,
+        verbose
+    )
+
+
 @click.command()
+@stream_option
 @dataset_uri_argument
-def identifiers(dataset_uri):
+@timings_option
+@memstats_option
+def identifiers(stream, dataset_uri):
     """List the item identifiers in the dataset."""
-    dataset = dtoolcore.DataSet.from_uri(dataset_uri)
-    for i in dataset.identifiers:
-        click.secho(i)
+    with phase("load dataset"):
+        dataset = dtoolcore.DataSet.from_uri(dataset_uri)
+    items = _iter_manifest_items(dataset, stream)
+    with OutputWriter() as out, phase("output"):
+        for i, _ in items:
+            out.line(i)
 
 
 @click.command()
@@ -202,14 +623,22 @@ def identifiers(dataset_uri):
     type=click.Choice(["json"]),
     help="Select the output format."
 )
-def summary(dataset_uri, format):
+@stream_option
+@timings_option
+@memstats_option
+def summary(dataset_uri, format, stream):
     """Report summary information about a dataset."""
-    dataset = dtoolcore.DataSet.from_uri(dataset_uri)
+    with phase("load dataset"):
+        dataset = dtoolcore.DataSet.from_uri(dataset_uri)
     creator_username = dataset._admin_metadata["creator_username"]
     frozen_at = dataset._admin_metadata["frozen_at"]
-    num_items = len(dataset.identifiers)
-    tot_size = sum([dataset.item_properties(i)["size_in_bytes"]
-                    for i in dataset.identifiers])
+    items = _iter_manifest_items(dataset, stream)
+    with phase("sum sizes"):
+        num_items = 0
+        tot_size = 0
+        for _, props in items:
+            num_items += 1
+            tot_size += props["size_in_bytes"]
 
     if format == "json":
         json_lines = [
@@ -243,6 +672,52 @@ def summary(dataset_uri, format):
             click.secho(value, fg="green")
 
 
+@click.command()
+@click.option(
+    "-d",
+    "--depth",
+    type=click.IntRange(min=0),
+    default=1,
+    show_default=True,
+    help="Number of directory levels listed."
+)
+@click.option(
+    "-b",
+    "--bytes",
+    "in_bytes",
+    is_flag=True,
+    help="Report sizes in bytes."
+)
+@stream_option
+@dataset_uri_argument
+@timings_option
+@memstats_option
+def du(depth, in_bytes, stream, dataset_uri):
+    """Report the size of the directories in a dataset.
+
+    Lists the total size and number of items of the directories in the item
+    relpaths, including their subdirectories, largest first. The total of
+    the whole dataset is listed as '.'.
+
+    The sizes are summed in a single pass over the manifest; use '--stream'
+    to reduce the memory needed for large datasets on local disk.
+    """
+    with phase("load dataset"):
+        dataset = dtoolcore.DataSet.from_uri(dataset_uri)
+
+    items = _iter_manifest_items(dataset, stream)
+    with phase("build tree"):
+        tree = SizeTree(items)
+
+    with phase("sum sizes"):
+        directories = tree.summary(depth)
+
+    with OutputWriter() as out, phase("output"):
+        for path, size, count in directories:
+            size = str(size) if in_bytes else sizeof_fmt(size)
+            out.line("{}\t{}\t{}".format(size, count, path))
+
+
 @click.group()
 def item():
     """
@@ -253,6 +728,7 @@ def item():
 @item.command()
 @dataset_uri_argument
 @item_identifier_argument
+@timings_option
 def properties(dataset_uri, item_identifier):
     """Report item properties."""
     dataset = dtoolcore.DataSet.from_uri(dataset_uri)
@@ -285,6 +761,7 @@ def properties(dataset_uri, item_identifier):
 @item.command()
 @dataset_uri_argument
 @item_identifier_argument
+@timings_option
 def fetch(dataset_uri, item_identifier):
     """Return abspath to file with item content.
 
@@ -295,15 +772,121 @@ def fetch(dataset_uri, item_identifier):
 
 
 @item.command()
-@click.argument("overlay_name")
+@dataset_uri_argument
+@click.argument("item_identifiers", nargs=-1)
+@click.option(
+    "-g",
+    "--glob",
+    help="Only fetch items with relpaths matching the glob pattern."
+)
+@click.option(
+    "-j",
+    "--jobs",
+    type=click.IntRange(min=1),
+    default=8,
+    show_default=True,
+    help="Number of concurrent downloads."
+)
+@timings_option
+def prefetch(dataset_uri, item_identifiers, glob, jobs):
+    """Fetch the content of many items concurrently.
+
+    Fetches the items given as arguments, or all items in the dataset if no
+    identifiers are given. Use '-' to read identifiers from stdin. Reports the
+    identifier and abspath of each item.
+
+    Items fetched by a previous run are skipped, so an interrupted prefetch
+    can be resumed by running the command again.
+    """
+    dataset = dtoolcore.DataSet.from_uri(dataset_uri)
+
+    if item_identifiers == ("-",):
+        stdin = sys.stdin
+        item_identifiers = [line.strip() for line in stdin if line.strip()]
+
+    try:
+        identifiers = select_identifiers(dataset, item_identifiers, glob)
+    except KeyError as e:
+        click.secho(
+            "No such item in dataset: {}".format(e.args[0]),
+            fg="red",
+            err=True
+        )
+        sys.exit(20)
+
+    num_fetched = 0
+    num_bytes = 0
+    start = time.time()
+    with OutputWriter() as out:
+        for i, abspath, fetched in _prefetch(dataset, identifiers, jobs):
+            if fetched:
+                num_fetched += 1
+                num_bytes += dataset.item_properties(i)["size_in_bytes"]
+            out.line("{}\t{}".format(i, abspath))
+    elapsed = time.time() - start
+
+    click.secho(
+        "Fetched {} of {} items, {} in {:.1f}s ({}/s)".format(
+            num_fetched,
+            len(identifiers),
+            sizeof_fmt(num_bytes).strip(),
+            elapsed,
+            sizeof_fmt(num_bytes / max(elapsed, 1e-6)).strip()
+        ),
+        err=True
+    )
+
+
+@item.command()
 @dataset_uri_argument
 @item_identifier_argument
-def overlay(overlay_name, dataset_uri, item_identifier):
-    """Return abspath to file with item content.
+@click.option(
+    "-o",
+    "--offset",
+    type=click.IntRange(min=0),
+    default=0,
+    help="Byte offset to start reading from."
+)
+@click.option(
+    "-n",
+    "--length",
+    type=click.IntRange(min=0),
+    help="Maximum number of bytes to read."
+)
+@timings_option
+def cat(dataset_uri, item_identifier, offset, length):
+    """Write item content to stdout.
 
-    Fetches the file from remote storage if required.
+    The '--offset' and '--length' options can be used to read part of an
+    item, e.g. the header of a large file.
     """
     dataset = dtoolcore.DataSet.from_uri(dataset_uri)
+    try:
+        dataset.item_properties(item_identifier)
+    except KeyError:
+        click.secho(
+            "No such item in dataset: {}".format(item_identifier),
+            fg="red",
+            err=True
+        )
+        sys.exit(20)
+
+    # Python 2 file objects have no separate binary buffer.
+    stdout = getattr(sys.stdout, "buffer", sys.stdout)
+    try:
+        stream_item(dataset, item_identifier, stdout, offset, length)
+    except IOError as e:
+        if e.errno != errno.EPIPE:
+            raise
+        exit_on_broken_pipe(stdout)
+
+
+def _get_overlay(dataset, overlay_name, cache):
+    """Return overlay, or mapped view of the locally cached overlay.
+
+    Cache files are rebuilt when the overlay has been written since. Overlays
+    that cannot be stamped are not cached.
+    """
     if overlay_name not in dataset.list_overlay_names():
         click.secho(
             "No such overlay in dataset: {}".format(overlay_name),
@@ -311,8 +894,51 @@ def overlay(overlay_name, dataset_uri, item_identifier):
             err=True
         )
         sys.exit(4)
+
+    stamp = None
+    if cache:
+        stamp = key_stamp(
+            dataset,
+            dataset._storage_broker.get_overlay_key(overlay_name)
+        )
+    if stamp is not None:
+        fpath = overlay_cache.cache_fpath(dataset.uuid, overlay_name)
+        mapped = overlay_cache.load_overlay_cache(fpath, stamp)
+        if mapped is not None:
+            return mapped
+
     overlay = dataset.get_overlay(overlay_name)
 
+    if stamp is not None:
+        try:
+            overlay_cache.write_overlay_cache(fpath, overlay, stamp)
+        except ValueError:
+            # Overlays not keyed by SHA-1 identifiers are not cached.
+            pass
+    return overlay
+
+
+@item.command()
+@click.argument("overlay_name")
+@dataset_uri_argument
+@item_identifier_argument
+@click.option(
+    "-c",
+    "--cache",
+    is_flag=True,
+    help="Store the overlay locally and reuse it in later lookups."
+)
+@timings_option
+def overlay(overlay_name, dataset_uri, item_identifier, cache):
+    """Return the overlay value associated with the item.
+
+    With the '--cache' option the overlay is stored locally by dataset UUID
+    and overlay name, so that later lookups only read the value of the item
+    rather than loading the whole overlay.
+    """
+    dataset = dtoolcore.DataSet.from_uri(dataset_uri)
+    overlay = _get_overlay(dataset, overlay_name, cache)
+
     try:
         click.secho(str(overlay[item_identifier]))
     except KeyError:
@@ -327,6 +953,7 @@ def overlay(overlay_name, dataset_uri, item_identifier):
 @item.command()
 @dataset_uri_argument
 @item_identifier_argument
+@timings_option
 def relpath(dataset_uri, item_identifier):
     """Return relpath associated with the item.
     """
@@ -343,6 +970,92 @@ def relpath(dataset_uri, item_identifier):
     click.secho(props["relpath"])
 
 
+def _item_predicate_validation(ctx, param, value):
+    """Click callback for parsing predicates on item properties."""
+    try:
+        return [parse_item_predicate(e) for e in value]
+    except (ValueError, IOError) as e:
+        raise click.BadParameter(str(e))
+
+
+@item.command()
+@dataset_uri_argument
+@click.argument("predicates", nargs=-1,
+                callback=_item_predicate_validation)
+@click.option(
+    "-r",
+    "--relpaths",
+    is_flag=True,
+    help="Report relpaths rather than identifiers."
+)
+@click.option(
+    "-p",
+    "--properties",
+    is_flag=True,
+    help="Report the properties of the items as JSON lines."
+)
+@timings_option
+@memstats_option
+def query(dataset_uri, predicates, relpaths, properties):
+    """List the items whose properties satisfy all predicates.
+
+    Predicates are given as item property, operator and value, e.g.::
+
+        dtool item query <DS_URI> 'size_in_bytes>1GiB' 'relpath matches *.gz'
+
+    The properties are identifier, relpath, size_in_bytes, hash and
+    utc_timestamp. Supported operators are ==, !=, <, <=, >, >=, in and
+    matches (glob patterns). Sizes can be given with units and timestamps as
+    dates, e.g. 'utc_timestamp>=2020-01-31'. The values of 'in' can be read
+    from a file with one value per line, e.g. 'hash in @hashes.txt'.
+
+    The identifiers can be piped into 'dtool item prefetch <DS_URI> -' and
+    'dtool verify --identifiers - <DS_URI>'.
+    """
+    with phase("load dataset"):
+        dataset = dtoolcore.DataSet.from_uri(dataset_uri)
+    with phase("load manifest"):
+        manifest = CompactManifest.from_dataset(dataset)
+    with phase("select items"):
+        rows = select_rows(manifest, predicates)
+
+    with OutputWriter() as out, phase("output"):
+        if properties:
+            for row in rows:
+                props = manifest.record(row).as_dict()
+                props["identifier"] = manifest.identifiers[row]
+                out.line(json.dumps(props, sort_keys=True))
+        elif relpaths:
+            for relpath in sorted(manifest.relpath(row) for row in rows):
+                out.line(relpath)
+        else:
+            for row in rows:
+                out.line(manifest.identifiers[row])
+
+
+def _shard_validation(ctx, param, value):
+    if value is None:
+        return None
+    try:
+        return parse_shard(value)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+
+
+def _echo_verify_problems(problems):
+    """Report problems and return True if there were none."""
+    all_okay = True
+    with OutputWriter() as out:
+        for problem, identifier, relpath in problems:
+            message = "{}: {} {}".format(problem, identifier, relpath)
+            out.line(message, fg="red")
+            all_okay = False
+
+    if all_okay:
+        click.secho("All good :)", fg="green")
+    return all_okay
+
+
 @click.command()
 @click.option(
     "-f",
@@ -350,75 +1063,126 @@ def relpath(dataset_uri, item_identifier):
     is_flag=True,
     help="Include file hash comparisons."
 )
+@click.option(
+    "-s",
+    "--shard",
+    callback=_shard_validation,
+    help="Only verify shard I of N, given as I/N with I from 0 to N-1."
+)
+@click.option(
+    "-r",
+    "--result",
+    type=click.Path(dir_okay=False, writable=True),
+    help="Write the result as JSON to this file."
+)
+@click.option(
+    "-i",
+    "--identifiers",
+    "identifiers_file",
+    type=click.File("r"),
+    help="Only verify the items listed in this file, '-' for stdin."
+)
+@jobs_option
+@fetch_jobs_option
+@max_bandwidth_option
+@max_iops_option
 @dataset_uri_argument
-def verify(full, dataset_uri):
+@timings_option
+@memstats_option
+def verify(full, shard, result, identifiers_file, jobs, fetch_jobs,
+           max_bandwidth, max_iops, dataset_uri):
     """Verify the integrity of a dataset.
-    """
-    dataset = dtoolcore.DataSet.from_uri(dataset_uri)
-    all_okay = True
 
-    # Generate identifiers and sizes quickly without the
-    # hash calculation used when calling dataset.generate_manifest().
-    generated_sizes = {}
-    generated_relpaths = {}
-    for handle in dataset._storage_broker.iter_item_handles():
-        identifier = dtoolcore.utils.generate_identifier(handle)
-        size = dataset._storage_broker.get_size_in_bytes(handle)
-        relpath = dataset._storage_broker.get_relpath(handle)
-        generated_sizes[identifier] = size
-        generated_relpaths[identifier] = relpath
-
-    generated_identifiers = set(generated_sizes.keys())
-    manifest_identifiers = set(dataset.identifiers)
-
-    for i in generated_identifiers.difference(manifest_identifiers):
-        message = "Unknown item: {} {}".format(
-            i,
-            generated_relpaths[i]
-        )
-        click.secho(message, fg="red")
-        all_okay = False
+    Large datasets can be verified in parallel, e.g. as a cluster job array,
+    by verifying each shard of the items using the '--shard' option and
+    writing the results to files using the '--result' option. The results
+    are then combined using the 'dtool verify-merge' command.
 
-    for i in manifest_identifiers.difference(generated_identifiers):
-        message = "Missing item: {} {}".format(
-            i,
-            dataset.item_properties(i)["relpath"]
+    When checking hashes, checksums kept by the storage are used where the
+    storage broker provides them. Other items are fetched from storage while
+    the hashes of previously fetched items are being calculated. The
+    '--max-bandwidth' and '--max-iops' options limit the load this puts on
+    the storage.
+
+    The manifest of datasets on local disk is parsed incrementally, only
+    keeping the item properties needed for the checks.
+
+    The '--identifiers' option restricts the checks to a selection of items,
+    e.g. from 'dtool item query'.
+
+    Hashes are calculated by the number of threads given by the '--jobs'
+    option, which replaces the processes 'dtool verify' used to start
+    according to the DTOOL_NUM_PROCESSES setting. That setting is the
+    default number of threads.
+    """
+    with phase("load dataset"):
+        dataset = dtoolcore.DataSet.from_uri(dataset_uri)
+    selected = None
+    if identifiers_file is not None:
+        selected = set(
+            line.strip() for line in identifiers_file if line.strip()
         )
-        click.secho(message, fg="red")
-        all_okay = False
-
-    for i in manifest_identifiers.intersection(generated_identifiers):
-        generated_size = generated_sizes[i]
-        manifest_size = dataset.item_properties(i)["size_in_bytes"]
-        if generated_size != manifest_size:
-            message = "Altered item size: {} {}".format(
-                i,
-                dataset.item_properties(i)["relpath"]
-            )
-            click.secho(message, fg="red")
-            all_okay = False
+    stats = {}
+    throttle = IOThrottle(max_bandwidth, max_iops)
+    problems = list(iter_problems(
+        dataset,
+        full,
+        shard,
+        fetch_jobs,
+        jobs,
+        stats,
+        throttle,
+        selected
+    ))
+    if result is not None:
+        write_result(result, dataset, full, shard, problems)
+    with phase("output"):
+        all_okay = _echo_verify_problems(problems)
 
     if full:
-        generated_manifest = dataset.generate_manifest()
-        for i in manifest_identifiers.intersection(generated_identifiers):
-            generated_hash = generated_manifest["items"][i]["hash"]
-            manifest_hash = dataset.item_properties(i)["hash"]
-            if generated_hash != manifest_hash:
-                message = "Altered item hash: {} {}".format(
-                    i,
-                    dataset.item_properties(i)["relpath"]
-                )
-                click.secho(message, fg="red")
-                all_okay = False
+        click.secho(
+            "Checked hashes of {} items using storage checksums and {} "
+            "items by hashing their content".format(
+                stats["native"],
+                stats["hashed"]
+            ),
+            err=True
+        )
 
     if not all_okay:
         sys.exit(1)
-    else:
-        click.secho("All good :)", fg="green")
+
+
+@click.command()
+@click.argument(
+    "result_files",
+    nargs=-1,
+    required=True,
+    type=click.File("r")
+)
+@timings_option
+def verify_merge(result_files):
+    """Combine the results of verifying the shards of a dataset.
+
+    Reports the problems found in all shards and exits with the same exit
+    code as verifying the whole dataset with 'dtool verify' would.
+    """
+    try:
+        problems = merge_results([json.load(fh) for fh in result_files])
+    except (ValueError, KeyError) as e:
+        click.secho(
+            "Cannot merge verify results: {}".format(e),
+            fg="red",
+            err=True
+        )
+        sys.exit(2)
+    if not _echo_verify_problems(problems):
+        sys.exit(1)
 
 
 @click.command()
 @base_dataset_uri_argument
+@timings_option
 def status(dataset_uri):
     """Return dataset status (frozen or proto)."""
     try:
@@ -433,6 +1197,7 @@ def status(dataset_uri):
 
 @click.command()
 @base_dataset_uri_argument
+@timings_option
 def uri(dataset_uri):
     """Return full dataset URI.
 
@@ -453,6 +1218,7 @@ def uri(dataset_uri):
 
 @click.command()
 @dataset_uri_argument
+@timings_option
 def uuid(dataset_uri):
     """Return the UUID of the dataset."""
     dataset = dtoolcore.DataSet.from_uri(dataset_uri)
@@ -0,0 +1,80 @@
+"""Dataset like view of a plain local directory.
+
+Makes it possible to compare a directory with a dataset, for example before
+uploading it, without creating a proto dataset first. The files in the
+directory are identified by their relpaths in the same way as the items of
+datasets are.
+"""
+
+import os
+
+import dtoolcore.utils
+
+from dtool_info.manifest import CompactManifest
+
+
+def local_directory(value):
+    """Return path of a local directory that is not a dataset, else None.
+
+    :param value: path or file URI
+    """
+    parsed = dtoolcore.utils.generous_parse_uri(value)
+    if parsed.scheme != "file":
+        return None
+    path = parsed.path
+    if not os.path.isdir(path) or os.path.exists(os.path.join(path, ".dtool")):
+        return None
+    return path
+
+
+class DirectoryView(object):
+    """Files in a local directory presented as the items of a dataset.
+
+    Provides the parts of the :class:`dtoolcore.DataSet` interface used by
+    'dtool diff'. The files have no hashes until they are calculated.
+    """
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self.name = os.path.basename(self.path.rstrip(os.sep))
+
+    def iter_items(self):
+        """Yield (identifier, properties) tuples of the files."""
+        path_length = len(os.path.join(self.path, ""))
+        for dirpath, dirnames, filenames in os.walk(self.path):
+            for fn in filenames:
+                fpath = os.path.join(dirpath, fn)
+                relpath = dtoolcore.utils.relpath_to_handle(
+                    fpath[path_length:],
+                    os.sep == "\\"
+                )
+                stat = os.stat(fpath)
+                yield dtoolcore.utils.generate_identifier(relpath), {
+                    "relpath": relpath,
+                    "size_in_bytes": stat.st_size,
+                    "hash": "",
+                    "utc_timestamp": stat.st_mtime,
+                }
+
+    def manifest(self, select=None):
+        """Return :class:`dtool_info.manifest.CompactManifest` of the files.
+
+        :param select: optional function returning True for the identifiers
+                       of the files to keep
+        """
+        return CompactManifest(self.iter_items(), select=select)
+
+    def make_fetcher(self, item_properties):
+        """Return function returning the abspath of a file by identifier.
+
+        :param item_properties: function returning the properties of a file
+        """
+        def fetch(identifier):
+            return os.path.join(
+                self.path,
+                dtoolcore.utils.handle_to_osrelpath(
+                    item_properties(identifier)["relpath"],
+                    os.sep == "\\"
+                )
+            )
+        return fetch
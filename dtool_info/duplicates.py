@@ -0,0 +1,318 @@
+"""Finding items with the same content across datasets.
+
+The items of many datasets are indexed by content in a SQLite database in a
+temporary file, so that the index is not limited by the available memory.
+Items have the same content if they have the same hash, calculated with the
+same hash function, and the same size.
+"""
+
+import os
+import shutil
+import sqlite3
+import tempfile
+
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+
+import dtoolcore
+import dtoolcore.utils
+
+from dtool_cli.cli import CONFIG_PATH
+
+from dtool_info.instrumentation import phase, timings_option
+from dtool_info.manifest import ManifestStream
+from dtool_info.replicas import find_replicas
+from dtool_info.utils import OutputWriter, size_validation, sizeof_fmt
+
+#: Number of items inserted into the index at a time.
+BATCH_SIZE = 10000
+
+_SCHEMA = """
+CREATE TABLE datasets (uuid TEXT PRIMARY KEY, name TEXT, hash_function TEXT);
+CREATE TABLE items (uuid TEXT, hash TEXT, size INTEGER, relpath TEXT);
+"""
+
+_INDEXES = """
+CREATE INDEX IF NOT EXISTS items_content ON items (hash, size);
+CREATE INDEX IF NOT EXISTS items_relpath ON items (uuid, relpath);
+"""
+
+# Distinct content of each dataset, with the hash function of its hashes.
+_CONTENT = """
+SELECT DISTINCT items.uuid, hash_function, hash, size
+FROM items JOIN datasets ON items.uuid = datasets.uuid
+WHERE size >= ?
+"""
+
+# Items with the same content in two different datasets, counted once per
+# dataset.
+_SHARED_CONTENT = """
+SELECT a.uuid, b.uuid, COUNT(*), SUM(a.size)
+FROM ({content}) AS a JOIN ({content}) AS b
+ON a.hash = b.hash
+    AND a.size = b.size
+    AND a.hash_function = b.hash_function
+    AND a.uuid < b.uuid
+GROUP BY a.uuid, b.uuid
+""".format(content=_CONTENT)
+
+# Additional copies of the same content within a dataset.
+_REPEATED_CONTENT = """
+SELECT uuid, uuid, SUM(n - 1), SUM((n - 1) * size)
+FROM (SELECT uuid, size, COUNT(*) AS n
+      FROM items WHERE size >= ?
+      GROUP BY uuid, hash, size)
+WHERE n > 1
+GROUP BY uuid
+"""
+
+# Items with the same content at different relpaths of two datasets, where
+# neither dataset also has the content at the relpath used by the other.
+_MOVED_ITEMS = """
+SELECT a.hash, a.uuid, a.relpath, b.uuid, b.relpath
+FROM items AS a
+JOIN items AS b
+ON a.hash = b.hash
+    AND a.size = b.size
+    AND a.uuid < b.uuid
+    AND a.relpath != b.relpath
+JOIN datasets AS da ON da.uuid = a.uuid
+JOIN datasets AS db ON db.uuid = b.uuid
+WHERE a.size >= ?
+    AND da.hash_function = db.hash_function
+    AND NOT EXISTS (
+        SELECT 1 FROM items AS c
+        WHERE c.uuid = b.uuid AND c.relpath = a.relpath AND c.hash = a.hash
+    )
+    AND NOT EXISTS (
+        SELECT 1 FROM items AS c
+        WHERE c.uuid = a.uuid AND c.relpath = b.relpath AND c.hash = b.hash
+    )
+ORDER BY a.uuid, b.uuid, a.relpath, b.relpath
+"""
+
+
+class ContentIndex(object):
+    """Index of the items of datasets by content.
+
+    Use as a context manager to remove the index file when done::
+
+        with ContentIndex() as index:
+            index.add_items(uuid, items)
+            index.add_dataset(uuid, name, hash_function)
+            duplicates = index.duplicate_content()
+    """
+
+    def __init__(self):
+        self._tmp_dir = tempfile.mkdtemp(prefix="dtool-info-")
+        self._connection = sqlite3.connect(
+            os.path.join(self._tmp_dir, "index.sqlite")
+        )
+        self._connection.execute("PRAGMA journal_mode = OFF")
+        self._connection.execute("PRAGMA synchronous = OFF")
+        self._connection.executescript(_SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self._connection.close()
+        shutil.rmtree(self._tmp_dir)
+
+    def add_items(self, uuid, items):
+        """Add the items of a dataset to the index.
+
+        Items without a hash are ignored. The items can be streamed, they are
+        inserted in batches of :data:`BATCH_SIZE`.
+
+        :param uuid: UUID of the dataset
+        :param items: iterable of (identifier, properties) tuples
+        """
+        insert = "INSERT INTO items VALUES (?, ?, ?, ?)"
+        cursor = self._connection.cursor()
+        batch = []
+        for _, props in items:
+            if not props["hash"]:
+                continue
+            batch.append((
+                uuid,
+                props["hash"],
+                props["size_in_bytes"],
+                props["relpath"],
+            ))
+            if len(batch) == BATCH_SIZE:
+                cursor.executemany(insert, batch)
+                batch = []
+        cursor.executemany(insert, batch)
+        self._connection.commit()
+
+    def add_dataset(self, uuid, name, hash_function):
+        """Record the name and hash function of an indexed dataset.
+
+        Only content hashed with the same hash function is compared.
+        """
+        self._connection.execute(
+            "INSERT INTO datasets VALUES (?, ?, ?)",
+            (uuid, name, hash_function)
+        )
+        self._connection.commit()
+
+    def _query(self, sql, parameters):
+        self._connection.executescript(_INDEXES)
+        return self._connection.execute(sql, parameters)
+
+    def duplicate_content(self, min_size=1):
+        """Return list of the content shared by each pair of datasets.
+
+        Tuple structure:
+        (uuid of first dataset, uuid of second dataset, number of items,
+        number of bytes)
+
+        The content of two different datasets is counted once per dataset.
+        Tuples where both UUIDs are the same count the additional copies of
+        content within that dataset. The list is sorted by decreasing number
+        of bytes.
+
+        :param min_size: ignore items smaller than this number of bytes
+        """
+        duplicates = list(self._query(_SHARED_CONTENT, (min_size, min_size)))
+        duplicates.extend(self._query(_REPEATED_CONTENT, (min_size,)))
+        return sorted(duplicates, key=lambda d: (-d[3], d[0], d[1]))
+
+    def moved_items(self, min_size=1):
+        """Yield items with the same content at different relpaths.
+
+        Tuple structure:
+        (hash, uuid of first dataset, relpath in first dataset,
+        uuid of second dataset, relpath in second dataset)
+
+        Content the second dataset also holds at the relpath used by the
+        first, or the other way round, is not reported as moved.
+
+        :param min_size: ignore items smaller than this number of bytes
+        """
+        for moved in self._query(_MOVED_ITEMS, (min_size,)):
+            yield moved
+
+
+def renamed_items(a_items, b_items, hash_function):
+    """Return list of tuples pairing items with the same content.
+
+    Tuple structure:
+    (hash, relpath in a, relpath in b)
+
+    Each item is paired at most once. Used by 'dtool diff' to report items
+    that are only in one of the datasets because they were renamed.
+
+    :param a_items: iterable of (identifier, properties) tuples of the items
+                    only in a
+    :param b_items: iterable of (identifier, properties) tuples of the items
+                    only in b
+    :param hash_function: name of the hash function of both datasets
+    """
+    renamed = []
+    with ContentIndex() as index:
+        index.add_items("a", a_items)
+        index.add_items("b", b_items)
+        index.add_dataset("a", "a", hash_function)
+        index.add_dataset("b", "b", hash_function)
+        paired = set()
+        for item_hash, _, a_relpath, _, b_relpath in index.moved_items(0):
+            if ("a", a_relpath) in paired or ("b", b_relpath) in paired:
+                continue
+            paired.add(("a", a_relpath))
+            paired.add(("b", b_relpath))
+            renamed.append((item_hash, a_relpath, b_relpath))
+    return renamed
+
+
+@click.command()
+@click.option(
+    "-m",
+    "--moved",
+    is_flag=True,
+    help="List the items with the same content at different relpaths."
+)
+@click.option(
+    "--min-size",
+    callback=size_validation,
+    default="1",
+    show_default=True,
+    help="Ignore items smaller than this size, e.g. 1M."
+)
+@click.option(
+    "-j",
+    "--jobs",
+    type=click.IntRange(min=1),
+    default=4,
+    show_default=True,
+    help="Number of base URIs and datasets read concurrently."
+)
+@click.argument("base_uris", nargs=-1, required=True)
+@timings_option
+def duplicates(moved, min_size, jobs, base_uris):
+    """Report content duplicated across the datasets in base URIs.
+
+    Lists the size and number of the items with the same content for each
+    pair of datasets, largest first. Lines where both datasets are the same
+    count the additional copies of content within that dataset. Copies of a
+    dataset, with the same UUID, are only indexed once.
+
+    With the '--moved' option the items with the same content at different
+    relpaths of two datasets are listed as well.
+
+    The manifests are indexed in a temporary SQLite database, rather than in
+    memory, so that large numbers of datasets can be compared.
+    """
+    base_uris = [dtoolcore.utils.sanitise_uri(u) for u in base_uris]
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        replicas = find_replicas(base_uris, executor)
+
+    with ContentIndex() as index:
+        for uuid, info in sorted(replicas.items()):
+            base_uri = [u for u in base_uris if u in info["uris"]][0]
+            with phase("load dataset"):
+                dataset = dtoolcore.DataSet.from_uri(
+                    info["uris"][base_uri],
+                    CONFIG_PATH
+                )
+            with phase("index manifests"):
+                items = ManifestStream(dataset)
+                index.add_items(uuid, items)
+                index.add_dataset(
+                    uuid,
+                    info["name"],
+                    items.metadata.get("hash_function")
+                )
+
+        with phase("find duplicates"):
+            duplicate_content = index.duplicate_content(min_size)
+
+        with OutputWriter() as out, phase("output"):
+            out.line("Duplicate content", fg="red")
+            for a, b, num_items, num_bytes in duplicate_content:
+                out.line("\t".join([
+                    sizeof_fmt(num_bytes),
+                    str(num_items),
+                    a,
+                    replicas[a]["name"],
+                    b,
+                    replicas[b]["name"],
+                ]))
+
+            if moved:
+                out.line("Moved items", fg="red")
+                for _, a, a_relpath, b, b_relpath in index.moved_items(
+                    min_size
+                ):
+                    out.line("\t".join([
+                        replicas[a]["name"],
+                        a_relpath,
+                        replicas[b]["name"],
+                        b_relpath,
+                    ]))
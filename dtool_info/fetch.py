@@ -0,0 +1,278 @@
+"""Helper functions for fetching item content from datasets."""
+
+import errno
+import fnmatch
+import os
+import threading
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import dtoolcore
+import dtoolcore.utils
+
+from dtool_cli.cli import CONFIG_PATH
+
+from dtool_info.utils import cache_dir
+
+#: Storage brokers whose item content is always available locally.
+LOCAL_STORAGE_BROKERS = ("file", "symlink")
+
+#: Number of bytes read and written at a time when streaming item content.
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+
+def is_local(dataset):
+    """Return True if the item content of the dataset is on local disk."""
+    return dataset._storage_broker.key in LOCAL_STORAGE_BROKERS
+
+
+def key_stamp(dataset, key):
+    """Return value that changes when the object at a storage key is written.
+
+    The stamp is the modification time and size of files on local disk and
+    the ETag and size of objects in S3. Returns None for other storage
+    brokers, whose objects cannot be stamped cheaply; anything derived from
+    them should not be cached.
+
+    :param key: key returned by a storage broker method such as
+                ``get_manifest_key`` or ``get_overlay_key``
+    """
+    storage_broker = dataset._storage_broker
+    if storage_broker.key in LOCAL_STORAGE_BROKERS:
+        stat = os.stat(key)
+        return [stat.st_mtime, stat.st_size]
+    s3resource = getattr(storage_broker, "s3resource", None)
+    if s3resource is not None:
+        obj = s3resource.Object(storage_broker.bucket, key)
+        obj.load()
+        return [obj.e_tag, obj.content_length]
+    return None
+
+
+def item_abspath(dataset, identifier, relpath=None):
+    """Return absolute path at which item content can be accessed.
+
+    Avoids reloading the manifest for every item of datasets on local disk.
+
+    :param relpath: relpath of the item, looked up in the manifest if None
+    """
+    if dataset._storage_broker.key == "file":
+        if relpath is None:
+            relpath = dataset.item_properties(identifier)["relpath"]
+        relpath = dtoolcore.utils.handle_to_osrelpath(
+            relpath,
+            dtoolcore.utils.IS_WINDOWS
+        )
+        return os.path.join(dataset._storage_broker._data_abspath, relpath)
+    return dataset.item_content_abspath(identifier)
+
+
+def select_identifiers(dataset, identifiers=None, glob=None):
+    """Return sorted list of identifiers selected by identifiers and glob.
+
+    All identifiers in the dataset are selected if neither identifiers nor a
+    relpath glob pattern are given.
+
+    :raises: KeyError if an identifier is not in the dataset
+    """
+    if identifiers:
+        for i in identifiers:
+            dataset.item_properties(i)
+        selected = set(identifiers)
+    else:
+        selected = set(dataset.identifiers)
+    if glob is not None:
+        selected = set(
+            i for i in selected
+            if fnmatch.fnmatchcase(
+                dataset.item_properties(i)["relpath"],
+                glob
+            )
+        )
+    return sorted(selected)
+
+
+class ThreadLocalDataSets(threading.local):
+    """One dataset instance, and hence storage broker, per thread."""
+
+    def __init__(self, uri):
+        self.dataset = dtoolcore.DataSet.from_uri(uri, config_path=CONFIG_PATH)
+
+
+def make_fetcher(dataset, item_properties=None):
+    """Return thread safe function returning the item content abspath.
+
+    Items in remote storage are fetched using one storage broker per thread,
+    as storage broker clients are not necessarily thread safe.
+
+    :param item_properties: optional function returning the properties of
+                            an item, used instead of the dataset manifest to
+                            look up the relpaths of local items
+    """
+    if is_local(dataset):
+        if item_properties is None:
+            item_properties = dataset.item_properties
+
+        def fetch(identifier):
+            return item_abspath(
+                dataset,
+                identifier,
+                item_properties(identifier)["relpath"]
+            )
+    else:
+        datasets = ThreadLocalDataSets(dataset.uri)
+
+        def fetch(identifier):
+            return datasets.dataset.item_content_abspath(identifier)
+    return fetch
+
+
+class FetchJournal(object):
+    """Record of items fetched from a dataset, used to resume prefetches.
+
+    Each line of the journal file holds an identifier, the size of the item
+    and the path to the fetched content separated by tabs.
+    """
+
+    def __init__(self, uuid):
+        self.fpath = os.path.join(cache_dir("prefetch"), uuid)
+        self._fetched = {}
+        if os.path.isfile(self.fpath):
+            with open(self.fpath) as fh:
+                for line in fh:
+                    words = line.rstrip("\n").split("\t")
+                    if len(words) == 3:
+                        self._fetched[words[0]] = (int(words[1]), words[2])
+        self._fh = open(self.fpath, "a")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._fh.close()
+
+    def abspath(self, identifier, size_in_bytes):
+        """Return abspath of previously fetched content that is still intact.
+
+        Returns None if the item needs to be fetched.
+        """
+        try:
+            size, abspath = self._fetched[identifier]
+        except KeyError:
+            return None
+        if size != size_in_bytes or not os.path.isfile(abspath):
+            return None
+        if os.path.getsize(abspath) != size:
+            return None
+        return abspath
+
+    def record(self, identifier, size_in_bytes, abspath):
+        """Record that the item content has been fetched to abspath."""
+        self._fetched[identifier] = (size_in_bytes, abspath)
+        line = "{}\t{}\t{}\n".format(identifier, size_in_bytes, abspath)
+        self._fh.write(line)
+        self._fh.flush()
+
+
+def prefetch(dataset, identifiers, num_workers):
+    """Fetch the content of the items using a pool of worker threads.
+
+    Items that were fetched by a previous call and are still present in the
+    local cache are skipped, which makes it possible to resume interrupted
+    prefetches.
+
+    Yields (identifier, abspath, fetched) tuples in order of completion, where
+    fetched is False for items that were already present.
+    """
+    if is_local(dataset):
+        for i in identifiers:
+            yield i, item_abspath(dataset, i), False
+        return
+
+    fetcher = make_fetcher(dataset)
+
+    def fetch(identifier):
+        return identifier, fetcher(identifier)
+
+    with FetchJournal(dataset.uuid) as journal:
+        to_fetch = []
+        for i in identifiers:
+            size = dataset.item_properties(i)["size_in_bytes"]
+            abspath = journal.abspath(i, size)
+            if abspath is None:
+                to_fetch.append(i)
+            else:
+                yield i, abspath, False
+
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            futures = [executor.submit(fetch, i) for i in to_fetch]
+            try:
+                for future in as_completed(futures):
+                    i, abspath = future.result()
+                    size = dataset.item_properties(i)["size_in_bytes"]
+                    journal.record(i, size, abspath)
+                    yield i, abspath, True
+            except BaseException:
+                # Do not wait for the pending downloads when interrupted.
+                for future in futures:
+                    future.cancel()
+                raise
+
+
+def _sendfile(in_fh, out_stream, offset, count):
+    """Copy bytes from file to stream in the kernel, where supported.
+
+    Returns False if the stream does not support zero-copy writes.
+    """
+    if not hasattr(os, "sendfile"):
+        return False
+    try:
+        out_fd = out_stream.fileno()
+    except (AttributeError, ValueError, IOError):
+        return False
+
+    out_stream.flush()
+    in_fd = in_fh.fileno()
+    started = False
+    while count > 0:
+        try:
+            sent = os.sendfile(out_fd, in_fd, offset, count)
+        except OSError as e:
+            if e.errno in (errno.EINVAL, errno.ENOSYS) and not started:
+                return False
+            raise
+        if sent == 0:
+            break
+        started = True
+        offset += sent
+        count -= sent
+    return True
+
+
+def stream_item(dataset, identifier, out_stream, offset=0, length=None):
+    """Write the content of an item to a binary stream.
+
+    Items on local disk are copied straight from the dataset, using zero-copy
+    ``os.sendfile`` when the stream is a file or pipe. Other items are fetched
+    into the local cache first.
+
+    :param offset: byte offset to start reading from
+    :param length: maximum number of bytes to write, None for all remaining
+    """
+    fpath = item_abspath(dataset, identifier)
+    with open(fpath, "rb") as fh:
+        size = os.fstat(fh.fileno()).st_size
+        end = size if length is None else min(size, offset + length)
+        count = max(end - offset, 0)
+
+        if _sendfile(fh, out_stream, offset, count):
+            return
+
+        fh.seek(offset)
+        while count > 0:
+            chunk = fh.read(min(STREAM_CHUNK_SIZE, count))
+            if not chunk:
+                break
+            out_stream.write(chunk)
+            count -= len(chunk)
+        out_stream.flush()
@@ -0,0 +1,201 @@
+"""Merkle fingerprints of dataset manifests.
+
+The fingerprint of a dataset is a digest of the (identifier, size, hash)
+entries of its manifest, sorted by identifier. The entries are split into
+:data:`NUM_BUCKETS` buckets by the leading byte of the identifier. Each
+bucket has its own digest and the fingerprint is the digest of the bucket
+digests, so that two datasets with equal fingerprints have the same items,
+and the items of datasets that differ only need to be compared in the
+buckets whose digests differ.
+
+Fingerprints are cached locally by dataset UUID and URI, since copies of a
+dataset share its UUID but need not have the same content. They are stored
+with the stamp of the manifest and are not cached for storage brokers whose
+manifests cannot be stamped.
+"""
+
+import binascii
+import hashlib
+import json
+import os
+import struct
+
+from dtool_info.fetch import key_stamp
+from dtool_info.instrumentation import phase
+from dtool_info.manifest import CompactManifest
+from dtool_info.utils import cache_dir
+
+FINGERPRINT_VERSION = 1
+
+#: Number of buckets the manifest entries are split into.
+NUM_BUCKETS = 256
+
+#: Name of the annotation the fingerprint is stored in.
+ANNOTATION_NAME = "fingerprint"
+
+_SIZE = struct.Struct(">Q")
+_LENGTH = struct.Struct(">H")
+
+
+def bucket(identifier):
+    """Return bucket of an item identifier."""
+    return int(identifier[:2], 16)
+
+
+def _entry(binary_identifier, size_in_bytes, item_hash):
+    item_hash = item_hash.encode("utf-8")
+    return binary_identifier \
+        + _SIZE.pack(size_in_bytes) \
+        + _LENGTH.pack(len(item_hash)) \
+        + item_hash
+
+
+class Fingerprint(object):
+    """Bucket digests of a manifest and the root digest combining them."""
+
+    def __init__(self, hash_function, buckets):
+        """Initialise from the hex bucket digests.
+
+        :param hash_function: name of the hash function of the manifest
+        :param buckets: list of :data:`NUM_BUCKETS` hex digests
+        :raises: ValueError if the number of buckets is wrong
+        """
+        if len(buckets) != NUM_BUCKETS:
+            raise ValueError("Expected {} buckets, got {}".format(
+                NUM_BUCKETS, len(buckets)))
+        self.hash_function = hash_function
+        self.buckets = list(buckets)
+
+        hasher = hashlib.sha256()
+        hasher.update("dtool-info-fingerprint-v{}\n{}\n".format(
+            FINGERPRINT_VERSION, hash_function).encode("utf-8"))
+        for digest in self.buckets:
+            hasher.update(binascii.unhexlify(digest))
+        self.root = hasher.hexdigest()
+
+    @classmethod
+    def from_manifest(cls, manifest):
+        """Return fingerprint of a compact manifest.
+
+        :param manifest: :class:`dtool_info.manifest.CompactManifest`
+        """
+        hashers = [hashlib.sha256() for _ in range(NUM_BUCKETS)]
+        identifiers = manifest.identifiers
+        for row in range(len(manifest)):
+            binary_identifier = identifiers.binary(row)
+            hashers[bytearray(binary_identifier)[0]].update(_entry(
+                binary_identifier,
+                manifest.sizes[row],
+                manifest.hashes[row]
+            ))
+        return cls(manifest.hash_function, [h.hexdigest() for h in hashers])
+
+    @classmethod
+    def from_dict(cls, data):
+        """Return fingerprint from the dictionary returned by :meth:`as_dict`.
+
+        :raises: ValueError if the dictionary is not a fingerprint of this
+                 version
+        """
+        if data.get("version") != FINGERPRINT_VERSION:
+            raise ValueError("Unsupported fingerprint version: {}".format(
+                data.get("version")))
+        fingerprint = cls(data["hash_function"], data["buckets"])
+        if fingerprint.root != data["root"]:
+            raise ValueError("Inconsistent fingerprint root")
+        return fingerprint
+
+    def as_dict(self):
+        return {
+            "version": FINGERPRINT_VERSION,
+            "hash_function": self.hash_function,
+            "root": self.root,
+            "buckets": self.buckets,
+        }
+
+    def __eq__(self, other):
+        return isinstance(other, Fingerprint) and self.root == other.root
+
+    def __ne__(self, other):
+        return not self == other
+
+    def differing_buckets(self, other):
+        """Return set of buckets whose digests differ from those of other."""
+        return set(
+            b for b in range(NUM_BUCKETS)
+            if self.buckets[b] != other.buckets[b]
+        )
+
+
+def cache_fpath(dataset):
+    """Return path to the cached fingerprint of a dataset."""
+    key = hashlib.sha1(dataset.uri.encode("utf-8")).hexdigest()
+    return os.path.join(
+        cache_dir("fingerprint", dataset.uuid),
+        key + ".json"
+    )
+
+
+def _manifest_stamp(dataset):
+    """Return stamp of the manifest of a dataset, or None.
+
+    See :func:`dtool_info.fetch.key_stamp`.
+    """
+    return key_stamp(dataset, dataset._storage_broker.get_manifest_key())
+
+
+def load_cached_fingerprint(dataset):
+    """Return the cached fingerprint of a dataset, or None.
+
+    Cached fingerprints are discarded when the manifest has been written
+    since. Nothing is returned for datasets whose manifest cannot be stamped.
+    """
+    fpath = cache_fpath(dataset)
+    if not os.path.isfile(fpath):
+        return None
+    stamp = _manifest_stamp(dataset)
+    if stamp is None:
+        return None
+    try:
+        with open(fpath) as fh:
+            data = json.load(fh)
+        if data.get("manifest_stamp") != stamp:
+            return None
+        return Fingerprint.from_dict(data)
+    except (ValueError, KeyError):
+        return None
+
+
+def cache_fingerprint(dataset, fingerprint):
+    """Write the fingerprint of a dataset to the local cache.
+
+    Nothing is written for datasets whose manifest cannot be stamped.
+    """
+    stamp = _manifest_stamp(dataset)
+    if stamp is None:
+        return
+    data = fingerprint.as_dict()
+    data["uri"] = dataset.uri
+    data["manifest_stamp"] = stamp
+    fpath = cache_fpath(dataset)
+    tmp_fpath = fpath + ".tmp"
+    with open(tmp_fpath, "w") as fh:
+        json.dump(data, fh)
+    os.rename(tmp_fpath, fpath)
+
+
+def dataset_fingerprint(dataset, cache=False):
+    """Return fingerprint of a dataset.
+
+    :param cache: reuse the fingerprint from the local cache, and store it
+                  there when it had to be calculated
+    """
+    fingerprint = load_cached_fingerprint(dataset) if cache else None
+    if fingerprint is None:
+        with phase("load manifest"):
+            manifest = CompactManifest.from_dataset(dataset)
+        with phase("calculate fingerprint"):
+            fingerprint = Fingerprint.from_manifest(manifest)
+        if cache:
+            cache_fingerprint(dataset, fingerprint)
+    return fingerprint
@@ -0,0 +1,197 @@
+"""Fast hashing of files on local disk."""
+
+import hashlib
+import mmap
+import os
+import threading
+import time
+
+import dtoolcore.utils
+
+from dtool_cli.cli import CONFIG_PATH
+
+#: Default size of the buffer used to read files when hashing them.
+HASH_BUFFER_SIZE = 1024 * 1024
+
+#: Map from the names of dtoolcore file hashers to hashlib algorithms.
+HASHLIB_ALGORITHMS = {
+    "md5sum_hexdigest": "md5",
+    "sha1sum_hexdigest": "sha1",
+    "sha256sum_hexdigest": "sha256",
+}
+
+
+class TokenBucket(object):
+    """Thread safe token bucket limiting the rate of some resource use.
+
+    Tokens are added at a fixed rate up to the capacity of the bucket.
+    Consuming more tokens than are available blocks until the bucket has
+    been refilled, so that the long term rate never exceeds the limit.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = self.rate if capacity is None else float(capacity)
+        self._tokens = self.capacity
+        self._last = time.time()
+        self._lock = threading.Lock()
+
+    def consume(self, amount):
+        """Take tokens from the bucket, sleeping until they are available."""
+        with self._lock:
+            now = time.time()
+            self._tokens = min(
+                self.capacity,
+                self._tokens + (now - self._last) * self.rate
+            )
+            self._last = now
+            self._tokens -= amount
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+
+
+class IOThrottle(object):
+    """Limit the bandwidth and number of read operations per second."""
+
+    def __init__(self, max_bandwidth=None, max_iops=None):
+        """Limits of None mean unlimited.
+
+        :raises: ValueError if a limit is not positive
+        """
+        self._bandwidth = None
+        self._iops = None
+        for limit in (max_bandwidth, max_iops):
+            if limit is not None and limit <= 0:
+                raise ValueError("Limits must be positive: {}".format(limit))
+        if max_bandwidth is not None:
+            self._bandwidth = TokenBucket(max_bandwidth)
+        if max_iops is not None:
+            self._iops = TokenBucket(max_iops)
+
+    def read(self, num_bytes):
+        """Wait until a read of num_bytes is allowed."""
+        if self._iops is not None:
+            self._iops.consume(1)
+        if self._bandwidth is not None:
+            self._bandwidth.consume(num_bytes)
+
+
+def _advise_sequential(fh):
+    """Tell the kernel that the file will be read sequentially."""
+    if hasattr(os, "posix_fadvise"):
+        try:
+            os.posix_fadvise(fh.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        except OSError:
+            pass
+
+
+def hash_file_readinto(fpath, algorithm, buffer, throttle=None):
+    """Return hex digest of file read into a reusable buffer.
+
+    :param fpath: path to the file
+    :param algorithm: name of the hashlib algorithm
+    :param buffer: bytearray the file is read into
+    :param throttle: optional :class:`IOThrottle` limiting the reads
+    """
+    hasher = hashlib.new(algorithm)
+    view = memoryview(buffer)
+    with open(fpath, "rb", buffering=0) as fh:
+        _advise_sequential(fh)
+        while True:
+            num_bytes = fh.readinto(buffer)
+            if throttle is not None:
+                throttle.read(num_bytes)
+            if not num_bytes:
+                break
+            hasher.update(view[:num_bytes])
+    return hasher.hexdigest()
+
+
+def hash_file_mmap(fpath, algorithm, throttle=None,
+                   chunk_size=HASH_BUFFER_SIZE):
+    """Return hex digest of file hashed straight from a memory map.
+
+    :param fpath: path to the file
+    :param algorithm: name of the hashlib algorithm
+    :param throttle: optional :class:`IOThrottle` limiting the reads
+    :param chunk_size: number of bytes hashed per throttled read
+    """
+    hasher = hashlib.new(algorithm)
+    with open(fpath, "rb") as fh:
+        size = os.fstat(fh.fileno()).st_size
+        if size > 0:
+            _advise_sequential(fh)
+            mapped = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                if throttle is None:
+                    hasher.update(mapped)
+                else:
+                    view = memoryview(mapped)
+                    try:
+                        for start in range(0, size, chunk_size):
+                            chunk = view[start:start + chunk_size]
+                            throttle.read(len(chunk))
+                            hasher.update(chunk)
+                            chunk.release()
+                    finally:
+                        view.release()
+            finally:
+                mapped.close()
+    return hasher.hexdigest()
+
+
+class FileHasher(object):
+    """Drop in replacement for storage broker hashers of local files.
+
+    Files are either memory mapped or read into a buffer that is reused
+    between files, one buffer per thread. Hash functions that are not
+    available in hashlib fall back to the storage broker hasher.
+
+    The ``DTOOL_INFO_HASH_BUFFER_SIZE`` and ``DTOOL_INFO_HASH_MMAP``
+    configuration values set the buffer size and enable memory mapping.
+    Reads can be rate limited by an :class:`IOThrottle` shared between
+    threads.
+    """
+
+    def __init__(self, hasher, buffer_size=None, use_mmap=None,
+                 throttle=None):
+        self.name = hasher.name
+        self._hasher = hasher
+        self._algorithm = HASHLIB_ALGORITHMS.get(hasher.name)
+        if buffer_size is None:
+            buffer_size = int(dtoolcore.utils.get_config_value(
+                "DTOOL_INFO_HASH_BUFFER_SIZE",
+                config_path=CONFIG_PATH,
+                default=HASH_BUFFER_SIZE
+            ))
+        if use_mmap is None:
+            use_mmap = str(dtoolcore.utils.get_config_value(
+                "DTOOL_INFO_HASH_MMAP",
+                config_path=CONFIG_PATH,
+                default="false"
+            )).lower() in ("1", "true", "yes")
+        self.buffer_size = buffer_size
+        self.use_mmap = use_mmap
+        self.throttle = throttle
+        self._local = threading.local()
+
+    def __call__(self, fpath):
+        if self._algorithm is None:
+            return self._hasher(fpath)
+        if self.use_mmap:
+            return hash_file_mmap(
+                fpath,
+                self._algorithm,
+                self.throttle,
+                self.buffer_size
+            )
+        buffer = getattr(self._local, "buffer", None)
+        if buffer is None:
+            buffer = self._local.buffer = bytearray(self.buffer_size)
+        return hash_file_readinto(
+            fpath,
+            self._algorithm,
+            buffer,
+            self.throttle
+        )
@@ -0,0 +1,477 @@
+"""Timing and memory usage of command phases and storage broker calls.
+
+Commands decorated with :func:`timings_option` accept a ``--timings`` flag.
+When it is given, or the ``DTOOL_INFO_TIMINGS`` configuration value is set,
+the storage brokers created while the command runs are instrumented to count
+the calls, bytes and time spent in each of their methods, and the time spent
+in each :func:`phase` of the command is recorded. A report is written to
+stderr when the command finishes, as JSON if ``DTOOL_INFO_TIMINGS`` is
+``json``.
+
+Commands decorated with :func:`memstats_option` accept a ``--memstats`` flag,
+with the corresponding ``DTOOL_INFO_MEMSTATS`` configuration value, that
+reports the peak resident set size and the memory allocated in each phase,
+along with the source lines allocating the most memory, using tracemalloc.
+"""
+
+import contextlib
+import functools
+import inspect
+import json
+import os
+import sys
+import threading
+import time
+import types
+
+from collections import OrderedDict
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+try:
+    import tracemalloc
+except ImportError:  # Python 2
+    tracemalloc = None
+
+import click
+
+import dtoolcore
+import dtoolcore.utils
+
+from dtool_cli.cli import CONFIG_PATH
+
+from dtool_info.utils import sizeof_fmt
+
+#: Storage broker methods returning content whose length is counted as bytes.
+TEXT_METHODS = ("get_text", "get_readme_content")
+
+#: Storage broker methods returning the path to fetched item content.
+ABSPATH_METHODS = ("get_item_abspath",)
+
+#: Number of allocation sites reported for each phase by ``--memstats``.
+NUM_ALLOCATION_SITES = 5
+
+_active = None
+_memstats = None
+
+
+class Timings(object):
+    """Thread safe record of phase and storage broker call timings."""
+
+    def __init__(self):
+        self.start = time.time()
+        self.phases = OrderedDict()
+        self.calls = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add_phase(self, name, seconds):
+        with self._lock:
+            count, total = self.phases.get(name, (0, 0.0))
+            self.phases[name] = (count + 1, total + seconds)
+
+    def add_call(self, method, seconds, num_bytes=0):
+        with self._lock:
+            count, total, total_bytes = self.calls.get(method, (0, 0.0, 0))
+            self.calls[method] = (
+                count + 1,
+                total + seconds,
+                total_bytes + num_bytes
+            )
+
+    def as_dict(self):
+        """Return the timings as a JSON serialisable dictionary."""
+        return {
+            "total_seconds": time.time() - self.start,
+            "phases": [
+                {"name": name, "count": count, "seconds": seconds}
+                for name, (count, seconds) in self.phases.items()
+            ],
+            "storage_broker_calls": [
+                {
+                    "method": method,
+                    "count": count,
+                    "seconds": seconds,
+                    "bytes": num_bytes,
+                }
+                for method, (count, seconds, num_bytes) in self.calls.items()
+            ],
+        }
+
+    def report_lines(self):
+        """Return list of lines of a human readable report."""
+        info = self.as_dict()
+        lines = ["Total time: {:.3f}s".format(info["total_seconds"])]
+        if info["phases"]:
+            lines.append("{:<32} {:>8} {:>10}".format(
+                "Phase", "Count", "Seconds"))
+            for p in info["phases"]:
+                lines.append("{:<32} {:>8} {:>10.3f}".format(
+                    p["name"], p["count"], p["seconds"]))
+        if info["storage_broker_calls"]:
+            lines.append("{:<32} {:>8} {:>10} {:>12}".format(
+                "Storage broker call", "Count", "Seconds", "Bytes"))
+            for c in info["storage_broker_calls"]:
+                lines.append("{:<32} {:>8} {:>10.3f} {:>12}".format(
+                    c["method"], c["count"], c["seconds"], c["bytes"]))
+        return lines
+
+
+def peak_rss():
+    """Return peak resident set size of the process in bytes, or None."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return peak
+    return peak * 1024
+
+
+class MemStats(object):
+    """Record of the memory allocated in each phase of a command.
+
+    The memory allocated by Python is traced using tracemalloc, where
+    available. Each phase compares snapshots taken at its start and end to
+    find the source lines that allocated the most memory. Phases can be
+    nested, also in other threads: each thread keeps a stack of the snapshots
+    of its open phases, and the peak traced since the start of every open
+    phase is kept up to date whenever the tracemalloc peak is reset, so that
+    the allocations and peak of a nested phase count towards the phases
+    enclosing it as well.
+    """
+
+    def __init__(self, num_sites=NUM_ALLOCATION_SITES):
+        self.num_sites = num_sites
+        self.phases = OrderedDict()
+        self._open = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._started_tracing = False
+
+    @property
+    def tracing(self):
+        return tracemalloc is not None and tracemalloc.is_tracing()
+
+    def start(self):
+        if tracemalloc is not None and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+
+    def stop(self):
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def _take_snapshot(self):
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, __file__),
+        ))
+
+    @property
+    def _stack(self):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _update_peaks(self):
+        """Keep the peak traced since the last reset in all open phases."""
+        peak = tracemalloc.get_traced_memory()[1]
+        for entry in self._open:
+            entry[1] = max(entry[1], peak)
+
+    def start_phase(self):
+        if not self.tracing:
+            self._stack.append(None)
+            return
+        entry = [self._take_snapshot(), 0]
+        with self._lock:
+            # Resetting the peak would lose the peaks of the open phases.
+            self._update_peaks()
+            if hasattr(tracemalloc, "reset_peak"):
+                tracemalloc.reset_peak()
+            self._open.append(entry)
+        self._stack.append(entry)
+
+    def end_phase(self, name):
+        info = self.phases.setdefault(name, {
+            "count": 0,
+            "peak_traced": None,
+            "net_traced": None,
+            "peak_rss": None,
+            "sites": {},
+        })
+        info["count"] += 1
+        info["peak_rss"] = peak_rss()
+        entry = self._stack.pop() if self._stack else None
+        if not self.tracing or entry is None:
+            return
+
+        with self._lock:
+            self._update_peaks()
+            self._open.remove(entry)
+        snapshot, peak = entry
+        stats = self._take_snapshot().compare_to(snapshot, "lineno")
+        info["peak_traced"] = max(peak, info["peak_traced"] or 0)
+        info["net_traced"] = (info["net_traced"] or 0) \
+            + sum(stat.size_diff for stat in stats)
+        for stat in stats[:self.num_sites]:
+            if stat.size_diff <= 0:
+                break
+            frame = stat.traceback[0]
+            site = "{}:{}".format(frame.filename, frame.lineno)
+            info["sites"][site] = info["sites"].get(site, 0) + stat.size_diff
+
+    def as_dict(self):
+        """Return the memory statistics as a JSON serialisable dictionary."""
+        phases = []
+        for name, info in self.phases.items():
+            sites = sorted(
+                info["sites"].items(),
+                key=lambda item: item[1],
+                reverse=True
+            )[:self.num_sites]
+            phases.append({
+                "name": name,
+                "count": info["count"],
+                "peak_traced_bytes": info["peak_traced"],
+                "net_traced_bytes": info["net_traced"],
+                "peak_rss_bytes": info["peak_rss"],
+                "allocation_sites": [
+                    {"site": site, "bytes": num_bytes}
+                    for site, num_bytes in sites
+                ],
+            })
+        return {
+            "peak_rss_bytes": peak_rss(),
+            "tracemalloc": tracemalloc is not None,
+            "phases": phases,
+        }
+
+    def report_lines(self):
+        """Return list of lines of a human readable report."""
+
+        def fmt(num_bytes):
+            if num_bytes is None:
+                return "-"
+            return sizeof_fmt(num_bytes).strip()
+
+        info = self.as_dict()
+        lines = ["Peak RSS: {}".format(fmt(info["peak_rss_bytes"]))]
+        if not info["tracemalloc"]:
+            lines.append("Allocations are not traced without tracemalloc")
+        if info["phases"]:
+            lines.append("{:<32} {:>12} {:>12} {:>12}".format(
+                "Phase", "Peak traced", "Net traced", "Peak RSS"))
+        for p in info["phases"]:
+            lines.append("{:<32} {:>12} {:>12} {:>12}".format(
+                p["name"],
+                fmt(p["peak_traced_bytes"]),
+                fmt(p["net_traced_bytes"]),
+                fmt(p["peak_rss_bytes"])
+            ))
+            for site in p["allocation_sites"]:
+                lines.append("    {:>10}  {}".format(
+                    fmt(site["bytes"]), site["site"]))
+        return lines
+
+
+@contextlib.contextmanager
+def phase(name):
+    """Record the time and memory spent in a phase of a command.
+
+    Nothing is recorded unless timings or memory statistics are active.
+    Phases with the same name are accumulated.
+    """
+    timings = _active
+    memstats = _memstats
+    if timings is None and memstats is None:
+        yield
+        return
+    if memstats is not None:
+        memstats.start_phase()
+    start = time.time()
+    try:
+        yield
+    finally:
+        elapsed = time.time() - start
+        if memstats is not None:
+            memstats.end_phase(name)
+        if timings is not None:
+            timings.add_phase(name, elapsed)
+
+
+def record_call(method, seconds, num_bytes=0):
+    """Record a storage broker call that bypassed the storage broker.
+
+    Used where content is read directly from local disk rather than through
+    the storage broker, so that the read still shows up in the timings.
+    Nothing is recorded unless timings are active.
+    """
+    timings = _active
+    if timings is not None:
+        timings.add_call(method, seconds, num_bytes)
+
+
+def _num_bytes(method, result):
+    """Return number of bytes transferred by a storage broker call."""
+    if method in TEXT_METHODS and result is not None:
+        if not isinstance(result, bytes):
+            result = result.encode("utf-8")
+        return len(result)
+    if method in ABSPATH_METHODS and result is not None:
+        try:
+            return os.path.getsize(result)
+        except OSError:
+            return 0
+    return 0
+
+
+def _timed_iterator(timings, method, iterator):
+    """Yield from iterator recording the time spent producing the values."""
+    elapsed = 0.0
+    try:
+        while True:
+            start = time.time()
+            try:
+                value = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                elapsed += time.time() - start
+            yield value
+    finally:
+        timings.add_call(method, elapsed)
+
+
+def _timed_method(timings, method, func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.time()
+        result = func(*args, **kwargs)
+        if isinstance(result, types.GeneratorType):
+            return _timed_iterator(timings, method, result)
+        timings.add_call(
+            method,
+            time.time() - start,
+            _num_bytes(method, result)
+        )
+        return result
+    return wrapper
+
+
+def instrument_storage_broker(storage_broker, timings):
+    """Replace the public methods of a storage broker by timed wrappers.
+
+    Methods that return generators are timed while they are iterated over.
+
+    :returns: the instrumented storage broker
+    """
+    for name in dir(storage_broker):
+        if name.startswith("_"):
+            continue
+        attr = getattr(storage_broker, name, None)
+        if inspect.ismethod(attr):
+            setattr(storage_broker, name, _timed_method(timings, name, attr))
+    return storage_broker
+
+
+@contextlib.contextmanager
+def instrumented():
+    """Record timings of the storage brokers created within the context."""
+    global _active
+    timings = Timings()
+    get_storage_broker = dtoolcore._get_storage_broker
+
+    def instrumented_get_storage_broker(uri, config_path):
+        return instrument_storage_broker(
+            get_storage_broker(uri, config_path),
+            timings
+        )
+
+    _active = timings
+    dtoolcore._get_storage_broker = instrumented_get_storage_broker
+    try:
+        yield timings
+    finally:
+        dtoolcore._get_storage_broker = get_storage_broker
+        _active = None
+
+
+@contextlib.contextmanager
+def memory_traced():
+    """Record the memory allocated in phases within the context."""
+    global _memstats
+    memstats = MemStats()
+    memstats.start()
+    _memstats = memstats
+    try:
+        yield memstats
+    finally:
+        _memstats = None
+        memstats.stop()
+
+
+def report_format(flag, config_key="DTOOL_INFO_TIMINGS"):
+    """Return "text", "json" or None if the report is not requested."""
+    value = str(dtoolcore.utils.get_config_value(
+        config_key,
+        config_path=CONFIG_PATH,
+        default=""
+    )).lower()
+    if value == "json":
+        return "json"
+    if flag or value in ("1", "true", "yes", "text"):
+        return "text"
+    return None
+
+
+def echo_report(stats, fmt):
+    """Write timings or memory statistics report to stderr."""
+    if fmt == "json":
+        click.secho(json.dumps(stats.as_dict(), indent=2), err=True)
+    else:
+        for line in stats.report_lines():
+            click.secho(line, err=True)
+
+
+def timings_option(f):
+    """Add ``--timings`` option reporting where the command spends time."""
+    @functools.wraps(f)
+    def wrapper(*args, **kwargs):
+        fmt = report_format(kwargs.pop("timings"))
+        if fmt is None:
+            return f(*args, **kwargs)
+        with instrumented() as timings:
+            try:
+                return f(*args, **kwargs)
+            finally:
+                echo_report(timings, fmt)
+    return click.option(
+        "--timings",
+        is_flag=True,
+        help="Report time spent in each phase and storage broker call."
+    )(wrapper)
+
+
+def memstats_option(f):
+    """Add ``--memstats`` option reporting memory use of the command."""
+    @functools.wraps(f)
+    def wrapper(*args, **kwargs):
+        fmt = report_format(kwargs.pop("memstats"), "DTOOL_INFO_MEMSTATS")
+        if fmt is None:
+            return f(*args, **kwargs)
+        with memory_traced() as memstats:
+            try:
+                return f(*args, **kwargs)
+            finally:
+                echo_report(memstats, fmt)
+    return click.option(
+        "--memstats",
+        is_flag=True,
+        help="Report peak memory use and allocations in each phase."
+    )(wrapper)
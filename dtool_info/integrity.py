@@ -0,0 +1,467 @@
+"""Logic for verifying the integrity of datasets."""
+
+import itertools
+import json
+import sys
+import threading
+
+try:
+    import queue
+except ImportError:  # Python 2
+    import Queue as queue
+
+from concurrent.futures import ThreadPoolExecutor
+
+import dtoolcore.utils
+
+from dtool_info.directory import DirectoryView
+from dtool_info.fetch import ThreadLocalDataSets, make_fetcher
+from dtool_info.hashing import FileHasher
+from dtool_info.instrumentation import phase
+from dtool_info.manifest import CompactManifest
+
+#: Types of problems reported when verifying a dataset, in reporting order.
+PROBLEMS = (
+    "Unknown item",
+    "Missing item",
+    "Altered item size",
+    "Altered item hash",
+)
+
+#: Version of the verify result file format.
+RESULT_FORMAT_VERSION = 1
+
+
+def parse_shard(text):
+    """Return (index, num_shards) tuple from a string of the form "I/N".
+
+    :raises: ValueError if the text is not a valid shard
+    """
+    try:
+        index, num_shards = [int(v) for v in text.split("/")]
+    except ValueError:
+        raise ValueError("Shard must be of the form I/N: {}".format(text))
+    if num_shards < 1 or not 0 <= index < num_shards:
+        raise ValueError("Shard index must be in the range 0 to N-1")
+    return index, num_shards
+
+
+def in_shard(identifier, shard):
+    """Return True if the item identifier belongs to the shard.
+
+    Items are partitioned by the value of their identifiers, which are
+    hex encoded SHA-1 digests, so the partitioning is deterministic and
+    balanced. All items belong to the shard None.
+    """
+    if shard is None:
+        return True
+    index, num_shards = shard
+    return int(identifier[:12], 16) % num_shards == index
+
+
+_DONE = object()
+_POLL_INTERVAL = 0.1
+
+
+class _PipelineError(object):
+    """Exception raised in a pipeline worker thread."""
+
+    def __init__(self, exc_info):
+        self.exc_info = exc_info
+
+
+def _put(q, item, stop):
+    """Put item on a bounded queue unless the pipeline has been stopped."""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=_POLL_INTERVAL)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _get(q, stop):
+    """Return item from queue, or _DONE if the pipeline has been stopped."""
+    while not stop.is_set():
+        try:
+            return q.get(timeout=_POLL_INTERVAL)
+        except queue.Empty:
+            pass
+    return _DONE
+
+
+def pipelined_hashes(identifiers, fetch, hasher, num_fetchers=4,
+                     num_hashers=1, queue_size=None):
+    """Yield (identifier, hash) tuples in order of completion.
+
+    A pool of fetcher threads retrieves the item content and feeds a bounded
+    queue consumed by a pool of hasher threads, so that fetching and hashing
+    happen at the same time. The bounded queue limits the number of fetched
+    items waiting to be hashed.
+
+    :param identifiers: item identifiers to hash
+    :param fetch: function returning the abspath to the item content
+    :param hasher: function returning the hash of the file at a path
+    :param num_fetchers: number of fetcher threads
+    :param num_hashers: number of hasher threads
+    :param queue_size: maximum number of fetched items waiting to be hashed
+    """
+    identifiers = list(identifiers)
+    if queue_size is None:
+        queue_size = 2 * max(num_fetchers, num_hashers)
+
+    todo = queue.Queue()
+    for identifier in identifiers:
+        todo.put(identifier)
+    fetched = queue.Queue(maxsize=queue_size)
+    results = queue.Queue()
+    stop = threading.Event()
+
+    def fetcher():
+        try:
+            while not stop.is_set():
+                try:
+                    identifier = todo.get_nowait()
+                except queue.Empty:
+                    return
+                if not _put(fetched, (identifier, fetch(identifier)), stop):
+                    return
+        except Exception:
+            results.put(_PipelineError(sys.exc_info()))
+
+    def hasher_worker():
+        try:
+            while True:
+                item = _get(fetched, stop)
+                if item is _DONE:
+                    return
+                identifier, fpath = item
+                results.put((identifier, hasher(fpath)))
+        except Exception:
+            results.put(_PipelineError(sys.exc_info()))
+
+    def start(target):
+        thread = threading.Thread(target=target)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def coordinator():
+        for thread in fetcher_threads:
+            thread.join()
+        for _ in range(num_hashers):
+            _put(fetched, _DONE, stop)
+
+    fetcher_threads = [start(fetcher) for _ in range(num_fetchers)]
+    for _ in range(num_hashers):
+        start(hasher_worker)
+    start(coordinator)
+
+    try:
+        for _ in identifiers:
+            result = results.get()
+            if isinstance(result, _PipelineError):
+                raise result.exc_info[1]
+            yield result
+    finally:
+        stop.set()
+
+
+def native_checksums(dataset, identifiers, num_workers=4,
+                     hash_function=None):
+    """Return dict of item checksums kept by the storage backend.
+
+    Storage brokers can provide checksums that the storage keeps for each
+    object by implementing a ``get_native_checksum(identifier)`` method
+    returning a (hash function name, hex digest) tuple, or None if there is
+    no checksum for the item. Only checksums calculated with the same hash
+    function as the hashes in the manifest are returned.
+
+    :param dataset: :class:`dtoolcore.DataSet`
+    :param identifiers: item identifiers
+    :param num_workers: number of threads requesting checksums
+    :param hash_function: name of the hash function of the manifest, read
+                          from the manifest if None
+    :returns: dict mapping identifiers to checksums
+    """
+    if not hasattr(dataset._storage_broker, "get_native_checksum"):
+        return {}
+
+    if hash_function is None:
+        hash_function = dataset._manifest.get(
+            "hash_function",
+            dataset._storage_broker.hasher.name
+        )
+    datasets = ThreadLocalDataSets(dataset.uri)
+
+    def get_native_checksum(identifier):
+        storage_broker = datasets.dataset._storage_broker
+        return storage_broker.get_native_checksum(identifier)
+
+    checksums = {}
+    identifiers = list(identifiers)
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        results = executor.map(get_native_checksum, identifiers)
+        for identifier, result in zip(identifiers, results):
+            if result is None:
+                continue
+            name, checksum = result
+            if name == hash_function:
+                checksums[identifier] = checksum
+    return checksums
+
+
+def iter_problems(dataset, full, shard=None, num_fetchers=4, num_hashers=1,
+                  stats=None, throttle=None, identifiers=None):
+    """Yield (problem, identifier, relpath) tuples for items failing checks.
+
+    :param dataset: :class:`dtoolcore.DataSet`
+    :param full: also compare the hashes of the item content
+    :param shard: (index, num_shards) tuple to only check some items
+    :param num_fetchers: number of threads fetching item content
+    :param num_hashers: number of threads calculating hashes
+    :param stats: optional dict updated with the number of item hashes
+                  checked using storage checksums ("native") and by hashing
+                  the item content ("hashed")
+    :param throttle: optional :class:`dtool_info.hashing.IOThrottle`
+                     limiting the reads when hashing
+    :param identifiers: optional set of identifiers of the items to check
+    """
+    storage_broker = dataset._storage_broker
+
+    def selected(identifier):
+        if identifiers is not None and identifier not in identifiers:
+            return False
+        return in_shard(identifier, shard)
+
+    # Generate identifiers and sizes quickly without the
+    # hash calculation used when calling dataset.generate_manifest().
+    generated_sizes = {}
+    generated_relpaths = {}
+    with phase("list storage items"):
+        for handle in storage_broker.iter_item_handles():
+            identifier = dtoolcore.utils.generate_identifier(handle)
+            if not selected(identifier):
+                continue
+            generated_sizes[identifier] = storage_broker.get_size_in_bytes(
+                handle
+            )
+            generated_relpaths[identifier] = storage_broker.get_relpath(
+                handle
+            )
+
+    with phase("load manifest"):
+        manifest = CompactManifest.from_dataset(dataset, selected)
+
+    manifest_identifiers = set()
+    common_identifiers = []
+    missing = []
+    altered_size = []
+    for row, i in enumerate(manifest.identifiers):
+        manifest_identifiers.add(i)
+        if i not in generated_sizes:
+            missing.append((i, manifest.relpath(row)))
+            continue
+        common_identifiers.append(i)
+        if generated_sizes[i] != manifest.sizes[row]:
+            altered_size.append((i, manifest.relpath(row)))
+
+    for i in generated_sizes:
+        if i not in manifest_identifiers:
+            yield "Unknown item", i, generated_relpaths[i]
+
+    for i, relpath in missing:
+        yield "Missing item", i, relpath
+
+    for i, relpath in altered_size:
+        yield "Altered item size", i, relpath
+
+    if full:
+        # Use checksums kept by the storage where possible and fall back
+        # to fetching and hashing the item content.
+        with phase("native checksums"):
+            checksums = native_checksums(
+                dataset,
+                common_identifiers,
+                num_fetchers,
+                manifest.hash_function
+            )
+        to_hash = [i for i in common_identifiers if i not in checksums]
+        if stats is not None:
+            stats["native"] = len(checksums)
+            stats["hashed"] = len(to_hash)
+
+        generated_hashes = pipelined_hashes(
+            to_hash,
+            make_fetcher(dataset, manifest.item_properties),
+            FileHasher(storage_broker.hasher, throttle=throttle),
+            num_fetchers,
+            num_hashers
+        )
+        altered = []
+        with phase("hash items"):
+            for i, generated_hash in itertools.chain(
+                checksums.items(),
+                generated_hashes
+            ):
+                props = manifest.item_properties(i)
+                if generated_hash != props.hash:
+                    altered.append((props.relpath, i))
+        for relpath, i in sorted(altered):
+            yield "Altered item hash", i, relpath
+
+
+def diff_identifiers(a, b):
+    """Return list of tuples where identifiers in manifests differ.
+
+    Tuple structure:
+    (identifier, present in a, present in b)
+
+    :param a: first :class:`dtool_info.manifest.CompactManifest`
+    :param b: second :class:`dtool_info.manifest.CompactManifest`
+    :returns: list of tuples where identifiers in manifests differ
+    """
+    a_ids = set(a.identifiers)
+    b_ids = set(b.identifiers)
+
+    difference = []
+    for i in sorted(a_ids.difference(b_ids)):
+        difference.append((i, True, False))
+    for i in sorted(b_ids.difference(a_ids)):
+        difference.append((i, False, True))
+    return difference
+
+
+def diff_sizes(a, b, progressbar=None):
+    """Return list of tuples where sizes differ.
+
+    Tuple structure:
+    (identifier, size in a, size in b)
+
+    Assumes list of identifiers in a and b are identical, so that the items
+    are in the same rows of both manifests.
+
+    :param a: first :class:`dtool_info.manifest.CompactManifest`
+    :param b: second :class:`dtool_info.manifest.CompactManifest`
+    :param progressbar: optional progressbar updated for each item
+    :returns: list of tuples for all items with different sizes
+    """
+    difference = []
+    for row, (a_size, b_size) in enumerate(zip(a.sizes, b.sizes)):
+        if a_size != b_size:
+            difference.append((a.identifiers[row], a_size, b_size))
+        if progressbar:
+            progressbar.update(1)
+    return difference
+
+
+def diff_content(a, reference, progressbar=None, num_fetchers=4,
+                 num_hashers=1, throttle=None, a_manifest=None,
+                 reference_manifest=None):
+    """Return list of tuples where content differ.
+
+    Tuple structure:
+    (identifier, hash in a, hash in reference)
+
+    Assumes list of identifiers in a and b are identical. The hashes of the
+    items in a are calculated using the hash function of the reference.
+
+    :param a: first :class:`dtoolcore.DataSet` or
+              :class:`dtool_info.directory.DirectoryView`
+    :param reference: reference :class:`dtoolcore.DataSet`
+    :param progressbar: optional progressbar updated for each item
+    :param num_fetchers: number of threads fetching item content
+    :param num_hashers: number of threads calculating hashes
+    :param throttle: optional :class:`dtool_info.hashing.IOThrottle`
+                     limiting the reads when hashing
+    :param a_manifest: optional :class:`dtool_info.manifest.CompactManifest`
+                       of a
+    :param reference_manifest: optional
+                               :class:`dtool_info.manifest.CompactManifest`
+                               of the reference
+    :returns: list of tuples for all items with different content
+    """
+    if a_manifest is None:
+        if isinstance(a, DirectoryView):
+            a_manifest = a.manifest()
+        else:
+            a_manifest = CompactManifest.from_dataset(a)
+    if reference_manifest is None:
+        reference_manifest = CompactManifest.from_dataset(reference)
+
+    if isinstance(a, DirectoryView):
+        fetch = a.make_fetcher(a_manifest.item_properties)
+    else:
+        fetch = make_fetcher(a, a_manifest.item_properties)
+
+    difference = []
+    calc_hashes = pipelined_hashes(
+        a_manifest.identifiers,
+        fetch,
+        FileHasher(reference._storage_broker.hasher, throttle=throttle),
+        num_fetchers,
+        num_hashers
+    )
+    for i, calc_hash in calc_hashes:
+        ref_hash = reference_manifest.item_properties(i).hash
+        if calc_hash != ref_hash:
+            difference.append((i, calc_hash, ref_hash))
+        if progressbar:
+            progressbar.update(1)
+    return sorted(difference)
+
+
+def write_result(fpath, dataset, full, shard, problems):
+    """Write the result of verifying (a shard of) a dataset to a JSON file."""
+    index, num_shards = (0, 1) if shard is None else shard
+    result = {
+        "version": RESULT_FORMAT_VERSION,
+        "uri": dataset.uri,
+        "uuid": dataset.uuid,
+        "full": full,
+        "shard": index,
+        "num_shards": num_shards,
+        "problems": [list(p) for p in problems],
+    }
+    with open(fpath, "w") as fh:
+        json.dump(result, fh, indent=2)
+
+
+def merge_results(results):
+    """Return sorted list of problems from the results of all shards.
+
+    :param results: list of dictionaries read from verify result files
+    :raises: ValueError if the results are not a complete set of shards from
+             the same verification, or have an unknown format version
+    """
+    if len(results) == 0:
+        raise ValueError("No results to merge")
+
+    for result in results:
+        if result.get("version") != RESULT_FORMAT_VERSION:
+            raise ValueError("Unsupported result format version: {}".format(
+                result.get("version")))
+
+    first = results[0]
+    for key in ("uuid", "full", "num_shards"):
+        for result in results:
+            if result[key] != first[key]:
+                raise ValueError("Results differ in {}: {} {}".format(
+                    key, first[key], result[key]))
+
+    shards = sorted(result["shard"] for result in results)
+    if shards != list(range(first["num_shards"])):
+        missing = set(range(first["num_shards"])).difference(shards)
+        raise ValueError(
+            "Results are not a complete set of shards; missing: {}, "
+            "duplicated: {}".format(
+                sorted(missing),
+                sorted(set(s for s in shards if shards.count(s) > 1))
+            )
+        )
+
+    problems = []
+    for result in results:
+        problems.extend(tuple(p) for p in result["problems"])
+    return sorted(problems, key=lambda p: (PROBLEMS.index(p[0]), p[2], p[1]))
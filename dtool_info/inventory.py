@@ -10,7 +10,12 @@ import dtoolcore
 
 from dtool_cli.cli import CONFIG_PATH
 
-from dtool_info.utils import sizeof_fmt, date_fmt
+from dtool_info.instrumentation import (
+    memstats_option,
+    phase,
+    timings_option,
+)
+from dtool_info.utils import sizeof_fmt, date_fmt, OutputWriter
 
 JINJA2_ENV = Environment(loader=PackageLoader('dtool_info', 'templates'))
 
@@ -23,8 +28,11 @@ def _dataset_info(dataset):
     info["uuid"] = dataset.uuid
 
     # Computer and human readable size of dataset.
-    tot_size = sum([dataset.item_properties(i)["size_in_bytes"]
-                    for i in dataset.identifiers])
+    with phase("load manifest"):
+        dataset._manifest
+    with phase("sum sizes"):
+        tot_size = sum([dataset.item_properties(i)["size_in_bytes"]
+                        for i in dataset.identifiers])
     info["size_int"] = tot_size
     info["size_str"] = sizeof_fmt(tot_size)
 
@@ -35,7 +43,8 @@ def _dataset_info(dataset):
 
     info["num_items"] = len(dataset.identifiers)
 
-    info["readme_content"] = dataset.get_readme_content()
+    with phase("load readme"):
+        info["readme_content"] = dataset.get_readme_content()
 
     return info
 
@@ -46,17 +55,20 @@ def _is_frozen_dataset(uri, CONFIG_PATH):
 
 
 def _base_uri_info(base_uri):
-    StorageBroker = dtoolcore._get_storage_broker(base_uri, CONFIG_PATH)
+    with phase("list datasets"):
+        StorageBroker = dtoolcore._get_storage_broker(base_uri, CONFIG_PATH)
+        uris = list(StorageBroker.list_dataset_uris(base_uri, CONFIG_PATH))
 
     info = {}
     info["total_size_int"] = 0
     info["total_items"] = 0
     info["datasets"] = []
 
-    for uri in StorageBroker.list_dataset_uris(base_uri, CONFIG_PATH):
-        if not _is_frozen_dataset(uri, CONFIG_PATH):
-            continue
-        dataset = dtoolcore.DataSet.from_uri(uri)
+    for uri in uris:
+        with phase("load dataset"):
+            if not _is_frozen_dataset(uri, CONFIG_PATH):
+                continue
+            dataset = dtoolcore.DataSet.from_uri(uri)
         dataset_info = _dataset_info(dataset)
         info["datasets"].append(dataset_info)
         info["total_size_int"] += dataset_info["size_int"]
@@ -99,14 +111,15 @@ def _line_formats(info):
 def _cmd_line_report(info):
     # Report on each individual dataset.
     ds_line, summary_line = _line_formats(info)
-    for ds_info in sorted(
-        info["datasets"],
-        key=itemgetter("creator", "date", "name")
-    ):
-        click.secho(ds_line.format(**ds_info))
+    with OutputWriter() as out:
+        for ds_info in sorted(
+            info["datasets"],
+            key=itemgetter("creator", "date", "name")
+        ):
+            out.line(ds_line.format(**ds_info))
 
-    # Summary report on all datasets in base_uri.
-    click.secho(summary_line.format(**info))
+        # Summary report on all datasets in base_uri.
+        out.line(summary_line.format(**info))
 
 
 def _html_report(info):
@@ -139,9 +152,10 @@ def _csv_tsv_column_items(ds_info):
 
 
 def _csv_tsv_report(info, separator):
-    click.secho(separator.join(_csv_tsv_header_items()))
-    for ds_info in info["datasets"]:
-        click.secho(separator.join(_csv_tsv_column_items(ds_info)))
+    with OutputWriter() as out:
+        out.line(separator.join(_csv_tsv_header_items()))
+        for ds_info in info["datasets"]:
+            out.line(separator.join(_csv_tsv_column_items(ds_info)))
 
 
 @click.command()
@@ -152,16 +166,19 @@ def _csv_tsv_report(info, separator):
     type=click.Choice(["csv", "tsv", "html"]),
     help="Select the output format."
 )
+@timings_option
+@memstats_option
 def inventory(uri, format):
     """Generate an inventory of datasets in a base URI."""
     base_uri = dtoolcore.utils.sanitise_uri(uri)
     info = _base_uri_info(base_uri)
 
-    if format is None:
-        _cmd_line_report(info)
-    elif format == "csv":
-        _csv_tsv_report(info, ",")
-    elif format == "tsv":
-        _csv_tsv_report(info, "\t")
-    elif format == "html":
-        _html_report(info)
+    with phase("output"):
+        if format is None:
+            _cmd_line_report(info)
+        elif format == "csv":
+            _csv_tsv_report(info, ",")
+        elif format == "tsv":
+            _csv_tsv_report(info, "\t")
+        elif format == "html":
+            _html_report(info)
@@ -0,0 +1,562 @@
+"""Streaming and compact access to the items of dataset manifests.
+
+Loading a manifest with :func:`json.loads` holds the properties of every item
+as nested dictionaries. For datasets with millions of items that amounts to
+gigabytes before any work starts. :class:`ManifestStream` instead reads the
+manifest of datasets on local disk incrementally and yields the items one at
+a time, so that commands only keep what they need. :class:`OverlayStream`
+does the same for the overlays of datasets.
+
+:class:`CompactManifest` keeps the item properties in columns: identifiers
+and hashes as packed binary digests, sizes and timestamps in arrays and
+relpaths split into a table of interned directory names and the file names.
+"""
+
+import binascii
+import bisect
+import io
+import json
+import re
+import time
+
+from array import array
+
+from dtool_info.fetch import is_local
+from dtool_info.instrumentation import record_call
+from dtool_info.overlay_cache import _MAX_BUCKET_BITS, _bucket, _bucket_bits
+
+#: Number of characters read from the manifest file at a time.
+MANIFEST_CHUNK_SIZE = 1024 * 1024
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+# Separating comma and key of an object member after the first. Keys with
+# escape sequences are left to the JSON decoder.
+_MEMBER_KEY = re.compile(
+    r'[ \t\n\r]*,[ \t\n\r]*"([^"\\]*)"[ \t\n\r]*:[ \t\n\r]*'
+)
+
+try:
+    _SIZE_TYPECODE = "Q"
+    array(_SIZE_TYPECODE)
+except ValueError:  # Python 2
+    _SIZE_TYPECODE = "L"
+
+
+class _TimedReader(object):
+    """File wrapper adding up the time spent reading."""
+
+    def __init__(self, fh):
+        self._fh = fh
+        self.seconds = 0.0
+
+    def read(self, size):
+        start = time.time()
+        try:
+            return self._fh.read(size)
+        finally:
+            self.seconds += time.time() - start
+
+
+class _TextBuffer(object):
+    """Chunked reader of JSON text from a file."""
+
+    def __init__(self, fh, chunk_size):
+        self._fh = fh
+        self._chunk_size = chunk_size
+        self._decoder = json.JSONDecoder()
+        self.text = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        chunk = self._fh.read(self._chunk_size)
+        if not chunk:
+            self.eof = True
+        self.text = self.text[self.pos:] + chunk
+        self.pos = 0
+
+    def _skip_whitespace(self):
+        while True:
+            self.pos = _WHITESPACE.match(self.text, self.pos).end()
+            if self.pos < len(self.text) or self.eof:
+                return
+            self._fill()
+
+    def next_char(self):
+        """Return the next character that is not whitespace."""
+        self._skip_whitespace()
+        if self.pos >= len(self.text):
+            raise ValueError("Unexpected end of manifest")
+        char = self.text[self.pos]
+        self.pos += 1
+        return char
+
+    def expect(self, char):
+        found = self.next_char()
+        if found != char:
+            raise ValueError(
+                "Invalid manifest: expected '{}' but found '{}'".format(
+                    char, found))
+
+    def peek(self):
+        self._skip_whitespace()
+        return self.text[self.pos:self.pos + 1]
+
+    def members(self):
+        """Yield the (key, value) pairs of an object up to its closing brace.
+
+        The opening brace must have been read. Members are matched directly
+        in the text where possible, which is much faster than reading the
+        keys, separators and values one at a time.
+        """
+        raw_decode = self._decoder.raw_decode
+        first = True
+        while True:
+            text = self.text
+            match = None if first else _MEMBER_KEY.match(text, self.pos)
+            if match is not None:
+                try:
+                    value, end = raw_decode(text, match.end())
+                except ValueError:
+                    end = None
+                if end is not None and (end < len(text) or self.eof):
+                    self.pos = end
+                    yield match.group(1), value
+                    continue
+
+            # The closing brace, a member split across chunks or a key with
+            # escape sequences.
+            char = self.next_char()
+            if char == "}":
+                return
+            if first:
+                self.pos -= 1
+            elif char != ",":
+                raise ValueError(
+                    "Invalid manifest: expected ',' or '}}' but found "
+                    "'{}'".format(char))
+            first = False
+            key = self.decode()
+            self.expect(":")
+            yield key, self.decode()
+
+    def decode(self):
+        """Return the next JSON value, reading more text as required."""
+        while True:
+            self._skip_whitespace()
+            try:
+                value, end = self._decoder.raw_decode(self.text, self.pos)
+            except ValueError:
+                if self.eof:
+                    raise
+                self._fill()
+                continue
+            # A value ending with the text, e.g. a number, may be incomplete.
+            if end == len(self.text) and not self.eof:
+                self._fill()
+                continue
+            self.pos = end
+            return value
+
+
+def iter_manifest_file(fh, metadata=None, chunk_size=MANIFEST_CHUNK_SIZE):
+    """Yield (identifier, properties) tuples from a manifest file.
+
+    :param fh: manifest file opened in text mode
+    :param metadata: optional dict updated with the manifest values other
+                     than the items, e.g. "hash_function"
+    :param chunk_size: number of characters read at a time
+    :raises: ValueError if the manifest is not valid JSON
+    """
+    if metadata is None:
+        metadata = {}
+    buf = _TextBuffer(fh, chunk_size)
+
+    buf.expect("{")
+    if buf.peek() == "}":
+        return
+    while True:
+        key = buf.decode()
+        buf.expect(":")
+        if key == "items":
+            buf.expect("{")
+            for item in buf.members():
+                yield item
+        else:
+            metadata[key] = buf.decode()
+        if buf.next_char() == "}":
+            return
+
+
+def iter_object_file(fh, chunk_size=MANIFEST_CHUNK_SIZE):
+    """Yield the (key, value) members of a JSON object in a file.
+
+    :param fh: file opened in text mode
+    :param chunk_size: number of characters read at a time
+    :raises: ValueError if the file is not a valid JSON object
+    """
+    buf = _TextBuffer(fh, chunk_size)
+    buf.expect("{")
+    for member in buf.members():
+        yield member
+
+
+def _iter_local_file(fpath, method, iter_file, *args):
+    """Yield the values parsed by iter_file from a file on local disk.
+
+    The file is read directly rather than through the storage broker, so the
+    read is recorded as the storage broker call it replaces.
+
+    :param method: name of the storage broker method the read replaces
+    """
+    with io.open(fpath, encoding="utf-8") as fh:
+        reader = _TimedReader(fh)
+        try:
+            for member in iter_file(reader, *args):
+                yield member
+        finally:
+            record_call(method, reader.seconds, fh.buffer.tell())
+
+
+class ManifestStream(object):
+    """Iterable of the (identifier, properties) tuples of a dataset manifest.
+
+    The manifest of datasets on local disk is parsed incrementally, other
+    manifests are loaded in full. The manifest values other than the items,
+    such as the "hash_function", are available from :attr:`metadata` once
+    the iteration has reached the items.
+    """
+
+    def __init__(self, dataset, chunk_size=MANIFEST_CHUNK_SIZE):
+        self.dataset = dataset
+        self.chunk_size = chunk_size
+        self.metadata = {}
+
+    def __iter__(self):
+        dataset = self.dataset
+        if dataset._manifest_cache is not None or not is_local(dataset):
+            manifest = dataset._manifest
+            self.metadata.update(
+                (k, v) for k, v in manifest.items() if k != "items"
+            )
+            for item in manifest["items"].items():
+                yield item
+            return
+
+        for item in _iter_local_file(
+            dataset._storage_broker.get_manifest_key(),
+            "get_manifest",
+            iter_manifest_file,
+            self.metadata,
+            self.chunk_size
+        ):
+            yield item
+
+
+class OverlayStream(object):
+    """Iterable of the (identifier, value) tuples of a dataset overlay.
+
+    The overlays of datasets on local disk are parsed incrementally, other
+    overlays are loaded in full.
+    """
+
+    def __init__(self, dataset, overlay_name, chunk_size=MANIFEST_CHUNK_SIZE):
+        self.dataset = dataset
+        self.overlay_name = overlay_name
+        self.chunk_size = chunk_size
+
+    def __iter__(self):
+        dataset = self.dataset
+        if not is_local(dataset):
+            for item in dataset.get_overlay(self.overlay_name).items():
+                yield item
+            return
+
+        for item in _iter_local_file(
+            dataset._storage_broker.get_overlay_key(self.overlay_name),
+            "get_overlay",
+            iter_object_file,
+            self.chunk_size
+        ):
+            yield item
+
+
+class _PackedHex(object):
+    """Sequence of fixed width hex strings stored as binary digests.
+
+    :raises: ValueError when appending a value that is not a lower case hex
+             string of the same width as the first value
+    """
+
+    def __init__(self):
+        self._data = bytearray()
+        self.width = None
+
+    def append(self, value):
+        try:
+            binary = binascii.unhexlify(value)
+        except (TypeError, binascii.Error):
+            raise ValueError("Not a hex string: {}".format(value))
+        if not binary or value != value.lower():
+            raise ValueError("Not a lower case hex string: {}".format(value))
+        if self.width is None:
+            self.width = len(binary)
+        elif len(binary) != self.width:
+            raise ValueError("Hex string of different width: {}".format(
+                value))
+        self._data += binary
+
+    def binary(self, index):
+        start = index * self.width
+        return bytes(self._data[start:start + self.width])
+
+    def __len__(self):
+        if not self.width:
+            return 0
+        return len(self._data) // self.width
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return binascii.hexlify(self.binary(index)).decode("ascii")
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+
+def _reorder(column, order):
+    """Return copy of a column with the rows in the given order."""
+    if isinstance(column, _PackedHex):
+        reordered = _PackedHex()
+        reordered.width = column.width
+        for row in order:
+            reordered._data += column.binary(row)
+        return reordered
+    if isinstance(column, array):
+        return array(column.typecode, (column[row] for row in order))
+    return [column[row] for row in order]
+
+
+class ItemProperties(object):
+    """Read only view of the properties of an item in a compact manifest.
+
+    Supports item access like the dictionaries returned by
+    :meth:`dtoolcore.DataSet.item_properties`.
+    """
+
+    __slots__ = ("_manifest", "_row")
+
+    KEYS = ("relpath", "size_in_bytes", "hash", "utc_timestamp")
+
+    def __init__(self, manifest, row):
+        self._manifest = manifest
+        self._row = row
+
+    @property
+    def identifier(self):
+        return self._manifest.identifiers[self._row]
+
+    @property
+    def relpath(self):
+        return self._manifest.relpath(self._row)
+
+    @property
+    def size_in_bytes(self):
+        return self._manifest.sizes[self._row]
+
+    @property
+    def hash(self):
+        return self._manifest.hashes[self._row]
+
+    @property
+    def utc_timestamp(self):
+        return self._manifest.timestamps[self._row]
+
+    def __getitem__(self, key):
+        if key not in self.KEYS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def keys(self):
+        return list(self.KEYS)
+
+    def as_dict(self):
+        return dict((key, self[key]) for key in self.KEYS)
+
+
+class CompactManifest(object):
+    """Columnar in-memory manifest, with the items sorted by identifier.
+
+    Looking up an item by identifier is a binary search of the packed
+    identifiers. Item properties are returned as :class:`ItemProperties`
+    views.
+    """
+
+    def __init__(self, items, metadata=None, select=None):
+        """Build the columns from (identifier, properties) tuples.
+
+        :param items: iterable of (identifier, properties) tuples
+        :param metadata: dict of the manifest values other than the items,
+                         read after the items have been consumed
+        :param select: optional function returning True for the identifiers
+                       of the items to keep
+        :raises: ValueError if the identifiers are not SHA-1 hex digests
+        """
+        identifiers = _PackedHex()
+        hashes = _PackedHex()
+        dirnames = []
+        dirname_rows = {}
+        dirname_indices = array("L")
+        basenames = []
+        sizes = array(_SIZE_TYPECODE)
+        timestamps = array("d")
+        prefix_counts = array("L", [0]) * (1 << _MAX_BUCKET_BITS)
+
+        # Manifests written by dtoolcore list the items sorted by identifier,
+        # in which case the rows need not be reordered.
+        in_order = True
+        previous = ""
+
+        for identifier, props in items:
+            if select is not None and not select(identifier):
+                continue
+            identifiers.append(identifier)
+            if identifier < previous:
+                in_order = False
+            previous = identifier
+            prefix_counts[int(identifier[:4], 16)] += 1
+            if isinstance(hashes, _PackedHex):
+                try:
+                    hashes.append(props["hash"])
+                except ValueError:
+                    hashes = list(hashes)
+            if isinstance(hashes, list):
+                hashes.append(props["hash"])
+            dirname, _, basename = props["relpath"].rpartition("/")
+            index = dirname_rows.get(dirname)
+            if index is None:
+                index = dirname_rows[dirname] = len(dirnames)
+                dirnames.append(dirname)
+            dirname_indices.append(index)
+            basenames.append(basename)
+            sizes.append(props["size_in_bytes"])
+            timestamps.append(props["utc_timestamp"])
+
+        if not in_order:
+            order = sorted(range(len(identifiers)), key=identifiers.binary)
+            identifiers = _reorder(identifiers, order)
+            hashes = _reorder(hashes, order)
+            dirname_indices = _reorder(dirname_indices, order)
+            basenames = _reorder(basenames, order)
+            sizes = _reorder(sizes, order)
+            timestamps = _reorder(timestamps, order)
+
+        self.identifiers = identifiers
+        self.hashes = hashes
+        self._dirnames = dirnames
+        self._dirname_indices = dirname_indices
+        self._basenames = basenames
+        self.sizes = sizes
+        self.timestamps = timestamps
+        self.metadata = {} if metadata is None else metadata
+
+        # Offsets of the rows of each value of the leading identifier bits,
+        # narrowing the binary search when looking up identifiers. The number
+        # of rows with each 16 bit prefix does not depend on the row order.
+        self._bits = _bucket_bits(len(self.identifiers))
+        shift = _MAX_BUCKET_BITS - self._bits
+        self._buckets = array("L", [0]) * ((1 << self._bits) + 1)
+        for prefix, count in enumerate(prefix_counts):
+            if count:
+                self._buckets[(prefix >> shift) + 1] += count
+        for bucket in range(1 << self._bits):
+            self._buckets[bucket + 1] += self._buckets[bucket]
+
+    @classmethod
+    def from_dataset(cls, dataset, select=None):
+        """Return compact manifest of a dataset.
+
+        The columns are built while the manifest is parsed, see
+        :class:`ManifestStream`, so that the manifest of datasets on local
+        disk is never held as dictionaries.
+
+        :param select: optional function returning True for the identifiers
+                       of the items to keep
+        """
+        manifest_stream = ManifestStream(dataset)
+        return cls(manifest_stream, manifest_stream.metadata, select)
+
+    @property
+    def hash_function(self):
+        return self.metadata.get("hash_function")
+
+    def __len__(self):
+        return len(self.identifiers)
+
+    def row(self, identifier):
+        """Return row of the item with the identifier.
+
+        :raises: KeyError if the identifier is not in the manifest
+        """
+        try:
+            binary = binascii.unhexlify(identifier)
+        except (TypeError, binascii.Error):
+            raise KeyError(identifier)
+        if len(binary) != self.identifiers.width:
+            raise KeyError(identifier)
+        bucket = _bucket(binary, self._bits)
+        packed = _BinaryView(self.identifiers)
+        row = bisect.bisect_left(
+            packed,
+            binary,
+            self._buckets[bucket],
+            self._buckets[bucket + 1]
+        )
+        if row == self._buckets[bucket + 1] or packed[row] != binary:
+            raise KeyError(identifier)
+        return row
+
+    def __contains__(self, identifier):
+        try:
+            self.row(identifier)
+        except KeyError:
+            return False
+        return True
+
+    def relpath(self, row):
+        dirname = self._dirnames[self._dirname_indices[row]]
+        if dirname:
+            return dirname + "/" + self._basenames[row]
+        return self._basenames[row]
+
+    def record(self, row):
+        return ItemProperties(self, row)
+
+    def records(self):
+        """Yield the properties of all items, sorted by identifier."""
+        for row in range(len(self)):
+            yield ItemProperties(self, row)
+
+    def item_properties(self, identifier):
+        """Return properties of the item with the identifier.
+
+        :raises: KeyError if the identifier is not in the manifest
+        """
+        return ItemProperties(self, self.row(identifier))
+
+
+class _BinaryView(object):
+    """Sequence of the binary digests in a :class:`_PackedHex`."""
+
+    def __init__(self, packed):
+        self._packed = packed
+
+    def __len__(self):
+        return len(self._packed)
+
+    def __getitem__(self, index):
+        return self._packed.binary(index)
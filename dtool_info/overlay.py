@@ -1,7 +1,13 @@
 """Commands for displaying dataset overlay information."""
 
+import csv
 import json
+import os
+import re
+import shutil
+import sqlite3
 import sys
+import tempfile
 
 import click
 
@@ -15,6 +21,102 @@ from dtool_cli.cli import (
     dataset_uri_argument,
 )
 
+from dtool_info.fetch import key_stamp
+from dtool_info.instrumentation import phase, timings_option
+from dtool_info.manifest import CompactManifest, OverlayStream
+from dtool_info.utils import (
+    OutputWriter,
+    cache_dir,
+    evaluate_predicate,
+    predicate_validation,
+)
+
+#: Only highlight JSON output smaller than this number of characters.
+HIGHLIGHT_MAX_SIZE = 1024 * 1024
+
+#: Number of overlay values inserted into the join table at a time.
+BATCH_SIZE = 10000
+
+
+def _iter_json_chunks(overlay):
+    """Yield the overlay as indented JSON one item at a time."""
+    if len(overlay) == 0:
+        yield "{}\n"
+        return
+    yield "{\n"
+    last = len(overlay) - 1
+    for n, (identifier, value) in enumerate(overlay.items()):
+        value = json.dumps(value, indent=2).replace("\n", "\n  ")
+        separator = ",\n" if n < last else "\n"
+        yield '  "{}": {}{}'.format(identifier, value, separator)
+    yield "}\n"
+
+
+def _iter_ndjson_chunks(overlay):
+    """Yield the overlay as one JSON object per line."""
+    for identifier, value in overlay.items():
+        yield json.dumps({"identifier": identifier, "value": value}) + "\n"
+
+
+def _value_str(value):
+    """Return overlay value as text, JSON encoding anything but strings."""
+    if isinstance(value, str):
+        return value
+    return json.dumps(value)
+
+
+_TSV_ESCAPES = {"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"}
+
+_TSV_SPECIAL = re.compile(r"[\\\t\n\r]")
+
+
+def _tsv_field(value):
+    r"""Return overlay value as a TSV field.
+
+    Backslashes, tabs and line breaks are escaped as ``\\``, ``\t``,
+    ``\n`` and ``\r`` so that they do not break the rows.
+    """
+    return _TSV_SPECIAL.sub(
+        lambda m: _TSV_ESCAPES[m.group()],
+        _value_str(value)
+    )
+
+
+def _iter_tsv_chunks(overlay):
+    """Yield the overlay as identifier and value separated by a tab."""
+    for identifier, value in overlay.items():
+        yield "{}\t{}\n".format(identifier, _tsv_field(value))
+
+
+_CHUNK_GENERATORS = {
+    "json": _iter_json_chunks,
+    "ndjson": _iter_ndjson_chunks,
+    "tsv": _iter_tsv_chunks,
+}
+
+
+def _write_highlighted_json(out, chunks):
+    """Write JSON chunks, highlighting them if the JSON is small enough."""
+    head = []
+    size = 0
+    for chunk in chunks:
+        head.append(chunk)
+        size += len(chunk)
+        if size > HIGHLIGHT_MAX_SIZE:
+            break
+    else:
+        out.write(pygments.highlight(
+            "".join(head),
+            pygments.lexers.JsonLexer(),
+            pygments.formatters.TerminalFormatter()))
+        return
+
+    # Too large to highlight, stream the remainder as plain text.
+    for chunk in head:
+        out.write(chunk)
+    for chunk in chunks:
+        out.write(chunk)
+
 
 @click.group()
 def overlay():
@@ -35,21 +137,35 @@ def overlay():
 
 @overlay.command()
 @dataset_uri_argument
+@timings_option
 def ls(dataset_uri):
     """
     DEPRECATED: List the overlays in the dataset.
     """
     dataset = dtoolcore.DataSet.from_uri(dataset_uri)
-    for overlay_name in dataset.list_overlay_names():
-        click.secho(overlay_name)
+    with OutputWriter() as out:
+        for overlay_name in dataset.list_overlay_names():
+            out.line(overlay_name)
 
 
 @overlay.command()
 @dataset_uri_argument
 @click.argument("overlay_name")
-def show(dataset_uri, overlay_name):
+@click.option(
+    "-f",
+    "--format",
+    type=click.Choice(["json", "ndjson", "tsv"]),
+    default="json",
+    help="Select the output format."
+)
+@timings_option
+def show(dataset_uri, overlay_name, format):
     """
     DEPRECATED: Show the content of a specific overlay.
+
+    The JSON output is only highlighted when writing small overlays to a
+    terminal. Use the ndjson or tsv formats to stream large overlays into
+    other tools.
     """
     dataset = dtoolcore.DataSet.from_uri(dataset_uri)
     try:
@@ -62,9 +178,344 @@ def show(dataset_uri, overlay_name):
         )
         sys.exit(11)
 
-    formatted_json = json.dumps(overlay, indent=2)
-    colorful_json = pygments.highlight(
-        formatted_json,
-        pygments.lexers.JsonLexer(),
-        pygments.formatters.TerminalFormatter())
-    click.secho(colorful_json, nl=False)
+    chunks = _CHUNK_GENERATORS[format](overlay)
+    with OutputWriter() as out:
+        if format == "json" and out.styled:
+            _write_highlighted_json(out, chunks)
+        else:
+            for chunk in chunks:
+                out.write(chunk)
+
+
+def _check_overlay_names(dataset, overlay_names):
+    """Return list of overlay names, exiting if any of them are missing.
+
+    All overlay names are returned if no overlay names are given.
+    """
+    available = dataset.list_overlay_names()
+    if len(overlay_names) == 0:
+        return list(available)
+    for overlay_name in overlay_names:
+        if overlay_name not in available:
+            click.secho(
+                "No such overlay: {}".format(overlay_name),
+                fg="red",
+                err=True
+            )
+            sys.exit(11)
+    return list(overlay_names)
+
+
+def _load_overlays(dataset, overlay_names):
+    """Return list of overlay names and dict of overlays.
+
+    All overlays are loaded if no overlay names are given. Exits if any of the
+    overlays are missing.
+    """
+    overlay_names = _check_overlay_names(dataset, overlay_names)
+    overlays = {}
+    for overlay_name in overlay_names:
+        overlays[overlay_name] = dataset.get_overlay(overlay_name)
+    return overlay_names, overlays
+
+
+class OverlayTable(object):
+    """Values of several overlays by row of a compact manifest.
+
+    The values are stored in a SQLite database in a temporary file, so that
+    joining large overlays is not limited by the available memory.
+
+    Use as a context manager to remove the database file when done::
+
+        with OverlayTable(manifest) as table:
+            table.add_overlay(OverlayStream(dataset, "age"))
+            rows = list(table.rows())
+    """
+
+    def __init__(self, manifest):
+        """Initialise an empty table.
+
+        :param manifest: :class:`dtool_info.manifest.CompactManifest`
+        """
+        self._manifest = manifest
+        self._num_overlays = 0
+        self._tmp_dir = tempfile.mkdtemp(prefix="dtool-info-")
+        self._connection = sqlite3.connect(
+            os.path.join(self._tmp_dir, "overlays.sqlite")
+        )
+        self._connection.execute("PRAGMA journal_mode = OFF")
+        self._connection.execute("PRAGMA synchronous = OFF")
+        self._connection.execute(
+            "CREATE TABLE overlay_values (row INTEGER, overlay INTEGER, "
+            "value TEXT, PRIMARY KEY (row, overlay)) WITHOUT ROWID"
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self._connection.close()
+        shutil.rmtree(self._tmp_dir)
+
+    def _insert(self, values):
+        self._connection.executemany(
+            "INSERT OR REPLACE INTO overlay_values VALUES (?, ?, ?)",
+            values
+        )
+
+    def add_overlay(self, items):
+        """Add the next column from the (identifier, value) tuples of an
+        overlay.
+
+        Values of items that are not in the manifest are ignored.
+        """
+        column = self._num_overlays
+        self._num_overlays += 1
+        identifiers = self._manifest.identifiers
+        num_rows = len(self._manifest)
+        batch = []
+        with self._connection:
+            # Overlays are usually written in manifest order, so try the row
+            # after the previous item before looking the identifier up.
+            row = 0
+            for identifier, value in items:
+                if row >= num_rows or identifiers[row] != identifier:
+                    try:
+                        row = self._manifest.row(identifier)
+                    except KeyError:
+                        continue
+                batch.append((row, column, json.dumps(value)))
+                row += 1
+                if len(batch) >= BATCH_SIZE:
+                    self._insert(batch)
+                    batch = []
+            self._insert(batch)
+
+    def rows(self):
+        """Yield [identifier, relpath, value, ...] rows in manifest order.
+
+        Items without a value in an overlay have the value None.
+        """
+        manifest = self._manifest
+        cursor = self._connection.execute(
+            "SELECT row, overlay, value FROM overlay_values "
+            "ORDER BY row, overlay"
+        )
+        pending = next(cursor, None)
+        for row in range(len(manifest)):
+            values = [None] * self._num_overlays
+            while pending is not None and pending[0] == row:
+                values[pending[1]] = json.loads(pending[2])
+                pending = next(cursor, None)
+            yield [manifest.identifiers[row], manifest.relpath(row)] + values
+
+
+@overlay.command()
+@dataset_uri_argument
+@click.argument("overlay_names", nargs=-1)
+@click.option(
+    "-f",
+    "--format",
+    type=click.Choice(["tsv", "csv", "ndjson"]),
+    default="tsv",
+    help="Select the output format."
+)
+@timings_option
+def export(dataset_uri, overlay_names, format):
+    """
+    Export item relpaths and overlay values as a table.
+
+    The table has one row per item, sorted by identifier, and one column per
+    overlay. All overlays are exported if no overlay names are given.
+
+    The manifest is held in a compact form and the overlays of datasets on
+    local disk are parsed incrementally into a temporary database, so that
+    the overlays of large datasets are not held in memory. In the TSV format
+    backslashes, tabs and line breaks in values are escaped as '\\\\',
+    '\\t', '\\n' and '\\r'.
+    """
+    with phase("load dataset"):
+        dataset = dtoolcore.DataSet.from_uri(dataset_uri)
+    overlay_names = _check_overlay_names(dataset, overlay_names)
+    header = ["identifier", "relpath"] + overlay_names
+
+    with phase("load manifest"):
+        manifest = CompactManifest.from_dataset(dataset)
+
+    with OverlayTable(manifest) as table, OutputWriter() as out:
+        with phase("load overlays"):
+            for overlay_name in overlay_names:
+                table.add_overlay(OverlayStream(dataset, overlay_name))
+        rows = table.rows()
+        if format == "ndjson":
+            for row in rows:
+                out.write(json.dumps(dict(zip(header, row))) + "\n")
+        elif format == "csv":
+            writer = csv.writer(out, lineterminator="\n")
+            writer.writerow(header)
+            for row in rows:
+                writer.writerow([_value_str(v) for v in row])
+        else:
+            out.line("\t".join(_tsv_field(v) for v in header))
+            for row in rows:
+                out.line("\t".join(_tsv_field(v) for v in row))
+
+
+def _value_key(value):
+    """Return hashable key representing a JSON value."""
+    return json.dumps(value, sort_keys=True)
+
+
+class OverlayIndex(object):
+    """Inverted index mapping overlay values to item identifiers."""
+
+    def __init__(self, index):
+        self._index = index
+        self._values = None
+
+    @classmethod
+    def from_overlay(cls, overlay):
+        """Return index built from an overlay dictionary."""
+        index = {}
+        for identifier, value in overlay.items():
+            index.setdefault(_value_key(value), []).append(identifier)
+        return cls(index)
+
+    @classmethod
+    def from_file(cls, fpath, stamp):
+        """Return index stored in a JSON file, or None if it is stale.
+
+        :param stamp: stamp of the overlay the index must have been built
+                      from
+        """
+        try:
+            with open(fpath) as fh:
+                data = json.load(fh)
+            if data["stamp"] != stamp:
+                return None
+            return cls(data["index"])
+        except (ValueError, KeyError, TypeError):
+            return None
+
+    def to_file(self, fpath, stamp):
+        """Store the index in a JSON file along with the overlay stamp."""
+        tmp_fpath = fpath + ".tmp"
+        with open(tmp_fpath, "w") as fh:
+            json.dump({"stamp": stamp, "index": self._index}, fh)
+        os.rename(tmp_fpath, fpath)
+
+    def select(self, op, operand):
+        """Return set of identifiers with values satisfying the predicate."""
+        if op == "==":
+            return set(self._index.get(_value_key(operand), []))
+        if op == "in":
+            identifiers = set()
+            for value in operand:
+                identifiers.update(self._index.get(_value_key(value), []))
+            return identifiers
+
+        # Other predicates are evaluated once per distinct value.
+        if self._values is None:
+            self._values = [(json.loads(k), v) for k, v in self._index.items()]
+        identifiers = set()
+        for value, value_identifiers in self._values:
+            if evaluate_predicate(value, op, operand):
+                identifiers.update(value_identifiers)
+        return identifiers
+
+
+def _overlay_index_fpath(dataset, overlay_name):
+    return os.path.join(
+        cache_dir("overlay_index", dataset.uuid),
+        overlay_name + ".json"
+    )
+
+
+def _get_overlay_index(dataset, overlay_name, cache):
+    """Return OverlayIndex, using the local cache if requested.
+
+    Cached indexes are rebuilt when the overlay has been written since. The
+    index is not cached if the overlay cannot be stamped.
+    """
+    stamp = None
+    if cache:
+        _check_overlay_names(dataset, [overlay_name])
+        stamp = key_stamp(
+            dataset,
+            dataset._storage_broker.get_overlay_key(overlay_name)
+        )
+    if stamp is not None:
+        fpath = _overlay_index_fpath(dataset, overlay_name)
+        if os.path.isfile(fpath):
+            index = OverlayIndex.from_file(fpath, stamp)
+            if index is not None:
+                return index
+
+    _, overlays = _load_overlays(dataset, [overlay_name])
+    index = OverlayIndex.from_overlay(overlays[overlay_name])
+
+    if stamp is not None:
+        index.to_file(fpath, stamp)
+    return index
+
+
+@overlay.command()
+@dataset_uri_argument
+@click.argument("predicates", nargs=-1, required=True,
+                callback=predicate_validation)
+@click.option(
+    "-r",
+    "--relpaths",
+    is_flag=True,
+    help="Report relpaths rather than identifiers."
+)
+@click.option(
+    "-c",
+    "--cache",
+    is_flag=True,
+    help="Store overlay indexes locally and reuse them in later queries."
+)
+@timings_option
+def query(dataset_uri, predicates, relpaths, cache):
+    """
+    List the items whose overlay values satisfy all predicates.
+
+    Predicates are given as overlay name, operator and value, e.g.::
+
+        dtool overlay query <DS_URI> 'is_read1==true' 'plate in 3,4'
+
+    Supported operators are ==, !=, <, <=, >, >=, in and matches (glob
+    patterns). Values are interpreted as JSON where possible.
+
+    With the '--cache' option the value indexes are stored locally by dataset
+    UUID, so that repeated queries do not need to load the overlays.
+    """
+    dataset = dtoolcore.DataSet.from_uri(dataset_uri)
+
+    indexes = {}
+    selected = None
+    for overlay_name, op, operand in predicates:
+        if overlay_name not in indexes:
+            indexes[overlay_name] = _get_overlay_index(
+                dataset,
+                overlay_name,
+                cache
+            )
+        identifiers = indexes[overlay_name].select(op, operand)
+        if selected is None:
+            selected = identifiers
+        else:
+            selected.intersection_update(identifiers)
+
+    with OutputWriter() as out:
+        if relpaths:
+            lines = sorted(
+                dataset.item_properties(i)["relpath"] for i in selected
+            )
+        else:
+            lines = sorted(selected)
+        for line in lines:
+            out.line(line)
@@ -0,0 +1,185 @@
+"""Memory mapped on-disk cache of overlays for fast per item lookups.
+
+The cache file stores the overlay values JSON encoded, indexed by the binary
+form of the item identifiers. The layout of the file is::
+
+    header           magic string, number of records, bucket bits and
+                     digest of the stamp of the source overlay
+    bucket table     record offsets for each value of the leading bucket
+                     bits of the identifiers
+    records          (identifier, value offset, value length) sorted by
+                     identifier
+    values           concatenated JSON encoded values
+
+Looking up an identifier only needs to inspect the few records in its bucket,
+so the cost of a lookup does not depend on the size of the overlay.
+
+The stamp of the source overlay, see :func:`dtool_info.fetch.key_stamp`, is
+recorded so that cache files of overlays written since can be rebuilt.
+"""
+
+import binascii
+import hashlib
+import json
+import mmap
+import os
+import struct
+
+from operator import itemgetter
+
+from dtool_info.utils import cache_dir
+
+_MAGIC = b"DTOVLAY2"
+_HEADER = struct.Struct("<8sQI20s")
+_BUCKET_OFFSET = struct.Struct("<Q")
+_RECORD = struct.Struct("<20sQI")
+_MAX_BUCKET_BITS = 16
+
+
+def _binary_identifier(identifier):
+    """Return 20 byte binary form of a hex encoded SHA-1 identifier.
+
+    :raises: ValueError if the identifier is not a SHA-1 hex digest
+    """
+    try:
+        binary = binascii.unhexlify(identifier)
+    except (TypeError, binascii.Error):
+        raise ValueError("Not a SHA-1 identifier: {}".format(identifier))
+    if len(binary) != 20:
+        raise ValueError("Not a SHA-1 identifier: {}".format(identifier))
+    return binary
+
+
+def _bucket_bits(num_records):
+    """Return number of identifier bits used to select a bucket."""
+    bits = 0
+    while (1 << bits) < num_records and bits < _MAX_BUCKET_BITS:
+        bits += 1
+    return bits
+
+
+def _bucket(binary_identifier, bits):
+    prefix = struct.unpack(">H", binary_identifier[:2])[0]
+    return prefix >> (_MAX_BUCKET_BITS - bits)
+
+
+def _stamp_digest(stamp):
+    return hashlib.sha1(json.dumps(stamp).encode("utf-8")).digest()
+
+
+def cache_fpath(uuid, overlay_name):
+    """Return path to the cache file of an overlay."""
+    return os.path.join(
+        cache_dir("overlay_cache", uuid),
+        overlay_name + ".bin"
+    )
+
+
+def write_overlay_cache(fpath, overlay, stamp=None):
+    """Write overlay to a cache file.
+
+    :param fpath: path to the cache file
+    :param overlay: overlay dictionary
+    :param stamp: stamp of the source overlay
+    :raises: ValueError if the overlay keys are not SHA-1 identifiers
+    """
+    records = sorted(
+        ((_binary_identifier(identifier), value)
+         for identifier, value in overlay.items()),
+        key=itemgetter(0)
+    )
+
+    bits = _bucket_bits(len(records))
+    num_buckets = 1 << bits
+    buckets = [0] * (num_buckets + 1)
+    for binary_identifier, _ in records:
+        buckets[_bucket(binary_identifier, bits) + 1] += 1
+    for i in range(num_buckets):
+        buckets[i + 1] += buckets[i]
+
+    tmp_fpath = fpath + ".tmp"
+    with open(tmp_fpath, "wb") as fh:
+        fh.write(_HEADER.pack(
+            _MAGIC,
+            len(records),
+            bits,
+            _stamp_digest(stamp)
+        ))
+        fh.write(struct.pack("<{}Q".format(num_buckets + 1), *buckets))
+
+        values = []
+        offset = 0
+        for binary_identifier, value in records:
+            value = json.dumps(value).encode("utf-8")
+            fh.write(_RECORD.pack(binary_identifier, offset, len(value)))
+            values.append(value)
+            offset += len(value)
+        for value in values:
+            fh.write(value)
+    os.rename(tmp_fpath, fpath)
+
+
+class MappedOverlay(object):
+    """Read only view of an overlay cache file."""
+
+    def __init__(self, fpath):
+        with open(fpath, "rb") as fh:
+            self._mmap = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self._num_records, self._bits, self._stamp_digest = \
+            _HEADER.unpack_from(self._mmap, 0)
+        if magic != _MAGIC:
+            self._mmap.close()
+            raise ValueError("Not an overlay cache file: {}".format(fpath))
+        num_buckets = 1 << self._bits
+        self._records_offset = _HEADER.size \
+            + (num_buckets + 1) * _BUCKET_OFFSET.size
+        self._values_offset = self._records_offset \
+            + self._num_records * _RECORD.size
+
+    def __len__(self):
+        return self._num_records
+
+    def has_stamp(self, stamp):
+        """Return True if the cache was written from an overlay with stamp."""
+        return self._stamp_digest == _stamp_digest(stamp)
+
+    def __getitem__(self, identifier):
+        try:
+            binary_identifier = _binary_identifier(identifier)
+        except ValueError:
+            raise KeyError(identifier)
+
+        bucket = _bucket(binary_identifier, self._bits)
+        bucket_offset = _HEADER.size + bucket * _BUCKET_OFFSET.size
+        start, end = struct.unpack_from("<QQ", self._mmap, bucket_offset)
+        for i in range(start, end):
+            key, offset, length = _RECORD.unpack_from(
+                self._mmap,
+                self._records_offset + i * _RECORD.size
+            )
+            if key == binary_identifier:
+                offset += self._values_offset
+                return json.loads(
+                    self._mmap[offset:offset + length].decode("utf-8")
+                )
+        raise KeyError(identifier)
+
+    def close(self):
+        self._mmap.close()
+
+
+def load_overlay_cache(fpath, stamp):
+    """Return MappedOverlay of a cache file, or None if missing or stale.
+
+    :param stamp: stamp of the source overlay
+    """
+    if not os.path.isfile(fpath):
+        return None
+    try:
+        mapped = MappedOverlay(fpath)
+    except (ValueError, struct.error):
+        return None
+    if not mapped.has_stamp(stamp):
+        mapped.close()
+        return None
+    return mapped
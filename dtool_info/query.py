@@ -0,0 +1,129 @@
+"""Selecting the items of a manifest by predicates on their properties.
+
+Predicates are parsed with :func:`dtool_info.utils.parse_predicate`, keeping
+the operands as the text given, and are tested with
+:func:`dtool_info.utils.evaluate_predicate` one predicate at a time over the
+rows of a :class:`dtool_info.manifest.CompactManifest`, each predicate only
+testing the rows selected by the previous ones.
+
+Operands are converted to the type of the property they are compared with, so
+that relpaths such as ``1.50`` or ``true`` are compared as given:
+sizes can be given with units, e.g. ``size_in_bytes>1GiB``, and timestamps
+as dates, e.g. ``utc_timestamp>=2020-01-31``. The values of ``in``
+predicates can be read from a file with one value per line, e.g.
+``hash in @hashes.txt``.
+"""
+
+import calendar
+import datetime
+
+from dtool_info.utils import (
+    evaluate_predicate,
+    parse_predicate,
+    parse_size,
+)
+
+#: Item properties that can be used in predicates.
+PROPERTIES = (
+    "identifier",
+    "relpath",
+    "size_in_bytes",
+    "hash",
+    "utc_timestamp",
+)
+
+_DATE_FORMATS = ("%Y-%m-%d", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d %H:%M:%S")
+
+
+def parse_timestamp(text):
+    """Return UTC timestamp from a date such as "2020-01-31T12:00:00".
+
+    :raises: ValueError if the text is not a valid date
+    """
+    for fmt in _DATE_FORMATS:
+        try:
+            date = datetime.datetime.strptime(text, fmt)
+        except ValueError:
+            continue
+        return float(calendar.timegm(date.timetuple()))
+    raise ValueError("Invalid date: {}".format(text))
+
+
+def _read_values(fpath):
+    with open(fpath) as fh:
+        return [line.strip() for line in fh if line.strip()]
+
+
+def _convert(name, text):
+    """Return operand text converted to the type of the property."""
+    if name == "size_in_bytes":
+        return parse_size(text)
+    if name == "utc_timestamp":
+        try:
+            return float(text)
+        except ValueError:
+            return parse_timestamp(text)
+    return text
+
+
+def parse_item_predicate(expression):
+    """Return (name, op, operand) tuple ready for testing from an expression.
+
+    :raises: ValueError if the expression cannot be parsed, the property is
+             unknown or the operand cannot be converted to the type of the
+             property
+    """
+    return prepare_predicate(*parse_predicate(expression, raw=True))
+
+
+def prepare_predicate(name, op, operand):
+    """Return (name, op, operand) tuple with the operand ready for testing.
+
+    :param operand: operand text, or list of texts for ``in`` predicates, as
+                    returned by :func:`dtool_info.utils.parse_predicate` with
+                    raw=True
+    :raises: ValueError if the property is unknown or the operand cannot be
+             converted to the type of the property
+    """
+    if name not in PROPERTIES:
+        raise ValueError("Unknown item property: {}; use one of {}".format(
+            name, ", ".join(PROPERTIES)))
+    if op == "matches":
+        return name, op, operand
+    if op == "in":
+        if len(operand) == 1 and operand[0].startswith("@"):
+            operand = _read_values(operand[0][1:])
+        return name, op, frozenset(_convert(name, v) for v in operand)
+    return name, op, _convert(name, operand)
+
+
+def _column(manifest, name):
+    """Return function returning the value of a property by row."""
+    if name == "identifier":
+        return manifest.identifiers.__getitem__
+    if name == "relpath":
+        return manifest.relpath
+    if name == "size_in_bytes":
+        return manifest.sizes.__getitem__
+    if name == "hash":
+        return manifest.hashes.__getitem__
+    return manifest.timestamps.__getitem__
+
+
+def select_rows(manifest, predicates):
+    """Return list of the rows of the items satisfying all predicates.
+
+    The rows are in manifest order, i.e. sorted by identifier.
+
+    :param manifest: :class:`dtool_info.manifest.CompactManifest`
+    :param predicates: list of (name, op, operand) tuples as returned by
+                       :func:`prepare_predicate`
+    """
+    rows = range(len(manifest))
+    for name, op, operand in predicates:
+        value = _column(manifest, name)
+        rows = [
+            row for row in rows
+            if evaluate_predicate(value(row), op, operand)
+        ]
+    return list(rows)
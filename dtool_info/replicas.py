@@ -0,0 +1,163 @@
+"""Comparing the replicas of datasets held in several base URIs."""
+
+import sys
+
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+
+import dtoolcore
+import dtoolcore.utils
+
+from dtool_cli.cli import CONFIG_PATH
+
+from dtool_info.fingerprint import dataset_fingerprint
+from dtool_info.instrumentation import phase, timings_option
+from dtool_info.utils import OutputWriter
+
+IN_SYNC = "in-sync"
+DIVERGED = "diverged"
+MISSING = "missing"
+
+STATUS_COLOURS = {
+    IN_SYNC: "green",
+    DIVERGED: "red",
+    MISSING: "yellow",
+}
+
+
+def _list_dataset_uris(base_uri):
+    with phase("list datasets"):
+        StorageBroker = dtoolcore._get_storage_broker(base_uri, CONFIG_PATH)
+        return list(StorageBroker.list_dataset_uris(base_uri, CONFIG_PATH))
+
+
+def _admin_metadata(uri):
+    with phase("load admin metadata"):
+        return dtoolcore._admin_metadata_from_uri(uri, CONFIG_PATH)
+
+
+def _fingerprint(uri, cache):
+    with phase("load dataset"):
+        dataset = dtoolcore.DataSet.from_uri(uri, CONFIG_PATH)
+    return dataset_fingerprint(dataset, cache)
+
+
+def find_replicas(base_uris, executor):
+    """Return dictionary of the replicas of the frozen datasets by UUID.
+
+    The replicas of a dataset are a dictionary of dataset URIs by base URI.
+    Proto datasets are ignored.
+
+    :param base_uris: list of sanitised base URIs
+    :param executor: executor listing the base URIs and reading the admin
+                     metadata of the datasets concurrently
+    """
+    uris_by_base_uri = executor.map(_list_dataset_uris, base_uris)
+    located = [
+        (base_uri, uri)
+        for base_uri, uris in zip(base_uris, uris_by_base_uri)
+        for uri in uris
+    ]
+    admin_metadata = executor.map(_admin_metadata, [u for _, u in located])
+
+    replicas = {}
+    for (base_uri, uri), metadata in zip(located, admin_metadata):
+        if metadata["type"] != "dataset":
+            continue
+        info = replicas.setdefault(metadata["uuid"], {
+            "name": metadata["name"],
+            "uris": {},
+        })
+        info["uris"].setdefault(base_uri, uri)
+    return replicas
+
+
+def replica_status(base_uris, uris, fingerprints):
+    """Return (status of the dataset, list of statuses of the replicas).
+
+    The replica in the first base URI holding the dataset is the reference
+    the others are compared to.
+
+    :param base_uris: list of base URIs in the order given
+    :param uris: dictionary of the dataset URIs by base URI
+    :param fingerprints: dictionary of fingerprints by dataset URI
+    """
+    reference = None
+    statuses = []
+    for base_uri in base_uris:
+        if base_uri not in uris:
+            statuses.append(MISSING)
+            continue
+        fingerprint = fingerprints.get(uris[base_uri])
+        if reference is None:
+            reference = fingerprint
+        statuses.append(IN_SYNC if fingerprint == reference else DIVERGED)
+
+    for status in (DIVERGED, MISSING):
+        if status in statuses:
+            return status, statuses
+    return IN_SYNC, statuses
+
+
+@click.command(name="sync-status")
+@click.option(
+    "-j",
+    "--jobs",
+    type=click.IntRange(min=1),
+    default=4,
+    show_default=True,
+    help="Number of base URIs and datasets read concurrently."
+)
+@click.option(
+    "-c",
+    "--cache",
+    is_flag=True,
+    help="Store the fingerprints locally and reuse them later."
+)
+@click.argument("base_uris", nargs=-1, required=True)
+@timings_option
+def sync_status(jobs, cache, base_uris):
+    """Report whether the datasets in several base URIs are in sync.
+
+    Datasets are matched by UUID. The fingerprints of the manifests of the
+    replicas of a dataset are compared to that of the replica in the first
+    base URI holding it. Replicas are reported in-sync, diverged or missing,
+    in a table with a column for each base URI.
+
+    Exits with status 1 unless all datasets are in sync.
+    """
+    base_uris = [dtoolcore.utils.sanitise_uri(u) for u in base_uris]
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        replicas = find_replicas(base_uris, executor)
+
+        # Datasets held in a single base URI have nothing to compare with.
+        to_compare = [
+            uri
+            for info in replicas.values() if len(info["uris"]) > 1
+            for uri in info["uris"].values()
+        ]
+        fingerprints = dict(zip(
+            to_compare,
+            executor.map(lambda u: _fingerprint(u, cache), to_compare)
+        ))
+
+    all_in_sync = True
+    with OutputWriter() as out, phase("output"):
+        out.line("\t".join(["status", "name", "uuid"] + base_uris))
+        for uuid, info in sorted(
+            replicas.items(),
+            key=lambda r: (r[1]["name"], r[0])
+        ):
+            status, statuses = replica_status(
+                base_uris,
+                info["uris"],
+                fingerprints
+            )
+            all_in_sync = all_in_sync and status == IN_SYNC
+            out.write(status, fg=STATUS_COLOURS[status])
+            out.line("\t" + "\t".join([info["name"], uuid] + statuses))
+
+    if not all_in_sync:
+        sys.exit(1)
@@ -0,0 +1,81 @@
+"""Sizes of the directories in the relpaths of dataset items.
+
+:class:`SizeTree` is a prefix trie of the directory names in item relpaths.
+Items are only counted in the directory holding them, found through a
+dictionary of the directories seen, so that adding an item does not walk the
+trie. The totals of a directory, including its subdirectories, are summed
+when the tree is reported. The memory needed grows with the number of
+directories rather than with the number of items.
+"""
+
+
+class _Node(object):
+    """Directory in a :class:`SizeTree`."""
+
+    __slots__ = ("size", "count", "children")
+
+    def __init__(self):
+        self.size = 0
+        self.count = 0
+        self.children = {}
+
+
+class SizeTree(object):
+    """Prefix trie of the directories in item relpaths."""
+
+    def __init__(self, items=()):
+        """Build the trie from (identifier, properties) tuples.
+
+        :param items: iterable of (identifier, properties) tuples
+        """
+        self._root = _Node()
+        self._nodes = {"": self._root}
+        for _, props in items:
+            self.add(props["relpath"], props["size_in_bytes"])
+
+    def _node(self, dirname):
+        node = self._nodes.get(dirname)
+        if node is None:
+            parent, _, name = dirname.rpartition("/")
+            node = self._node(parent).children.setdefault(name, _Node())
+            self._nodes[dirname] = node
+        return node
+
+    def add(self, relpath, size_in_bytes):
+        """Count an item in the directory holding it."""
+        node = self._node(relpath.rpartition("/")[0])
+        node.size += size_in_bytes
+        node.count += 1
+
+    def summary(self, depth=None):
+        """Return list of the total size and number of items by directory.
+
+        Tuple structure:
+        (path, number of bytes, number of items)
+
+        The totals include the items in subdirectories. The path of the top
+        level is "." and the paths of directories end with "/". The list is
+        sorted by decreasing number of bytes, then by path.
+
+        :param depth: only list directories up to this many levels below the
+                      top level; all directories if None
+        """
+        listed = []
+
+        def total(node, path, level):
+            size = node.size
+            count = node.count
+            for name, child in node.children.items():
+                child_size, child_count = total(
+                    child,
+                    path + name + "/",
+                    level + 1
+                )
+                size += child_size
+                count += child_count
+            if depth is None or level <= depth:
+                listed.append((path or ".", size, count))
+            return size, count
+
+        total(self._root, "", 0)
+        return sorted(listed, key=lambda d: (-d[1], d[0]))
@@ -1,6 +1,21 @@
 """Utility functions."""
 
 import datetime
+import errno
+import fnmatch
+import json
+import os
+import re
+import sys
+
+import click
+
+import dtoolcore.utils
+
+from dtool_cli.cli import CONFIG_PATH
+
+#: Number of characters accumulated before writing to the output stream.
+OUTPUT_BUFFER_SIZE = 64 * 1024
 
 
 def sizeof_fmt(num, suffix='B'):
@@ -11,7 +26,220 @@ def sizeof_fmt(num, suffix='B'):
     return "{:6.1f}{:3s}".format(num, "Yi" + suffix)
 
 
+_SIZE_REGEX = re.compile(
+    r"^\s*(?P<number>\d+(\.\d*)?)\s*(?P<unit>[KMGTP]?)(i?B)?\s*$",
+    re.IGNORECASE
+)
+
+
+def parse_size(text):
+    """Return number of bytes from a size such as "512", "100M" or "1.5GiB".
+
+    Units are powers of 1024.
+
+    :raises: ValueError if the text is not a valid size
+    """
+    match = _SIZE_REGEX.match(text)
+    if match is None:
+        raise ValueError("Invalid size: {}".format(text))
+    exponent = " KMGTP".index(match.group("unit").upper() or " ")
+    return int(float(match.group("number")) * 1024 ** exponent)
+
+
+def size_validation(ctx, param, value):
+    """Click callback for parsing size options."""
+    if value is None:
+        return None
+    try:
+        return parse_size(value)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+
+
 def date_fmt(timestamp):
     timestamp = float(timestamp)
     datetime_obj = datetime.datetime.fromtimestamp(timestamp)
     return datetime_obj.strftime("%Y-%m-%d")
+
+
+def cache_dir(*names):
+    """Return path to a dtool-info cache directory, creating it if needed.
+
+    The directory is placed under the ``DTOOL_CACHE_DIRECTORY``.
+    """
+    base = dtoolcore.utils.get_config_value(
+        "DTOOL_CACHE_DIRECTORY",
+        config_path=CONFIG_PATH,
+        default=dtoolcore.utils.DEFAULT_CACHE_PATH
+    )
+    path = os.path.join(base, "dtool-info", *names)
+    dtoolcore.utils.mkdir_parents(path)
+    return path
+
+
+_PREDICATE_REGEX = re.compile(
+    r"^\s*(?P<name>[^\s=!<>]+)\s*"
+    r"(?P<op>==|!=|<=|>=|=|<|>|\s+in\s+|\s+matches\s+)"
+    r"\s*(?P<value>.*?)\s*$"
+)
+
+
+def _parse_value(text):
+    """Return the JSON value of the text, or the text itself if not JSON."""
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+
+def parse_predicate(expression, raw=False):
+    """Return (name, operator, value) tuple from a predicate expression.
+
+    Supported expressions::
+
+        name==value
+        name!=value
+        name<value, name<=value, name>value, name>=value
+        name in value1,value2
+        name matches pattern
+
+    Values are parsed as JSON where possible, otherwise they are strings. The
+    value of an ``in`` expression is a list of values.
+
+    :param raw: keep the values as the text given rather than parsing them as
+                JSON, e.g. for comparing with string properties
+    :raises: ValueError if the expression cannot be parsed
+    """
+    match = _PREDICATE_REGEX.match(expression)
+    if match is None:
+        raise ValueError("Invalid expression: {}".format(expression))
+    name = match.group("name")
+    op = match.group("op").strip()
+    value = match.group("value")
+    if op == "=":
+        op = "=="
+    parse_value = (lambda v: v) if raw else _parse_value
+    if op == "in":
+        value = [parse_value(v.strip()) for v in value.split(",")]
+    elif op != "matches":
+        value = parse_value(value)
+    return name, op, value
+
+
+def evaluate_predicate(value, op, operand):
+    """Return True if the value satisfies the predicate.
+
+    Values that cannot be compared with the operand do not satisfy range
+    predicates.
+    """
+    if op == "==":
+        return value == operand
+    if op == "!=":
+        return value != operand
+    if op == "in":
+        return value in operand
+    if op == "matches":
+        return isinstance(value, str) and fnmatch.fnmatchcase(value, operand)
+    try:
+        if op == "<":
+            return value < operand
+        if op == "<=":
+            return value <= operand
+        if op == ">":
+            return value > operand
+        if op == ">=":
+            return value >= operand
+    except TypeError:
+        return False
+    raise ValueError("Unknown operator: {}".format(op))
+
+
+def predicate_validation(ctx, param, value):
+    """Click callback for parsing predicate expression arguments."""
+    try:
+        return [parse_predicate(expression) for expression in value]
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+
+
+def isatty(stream):
+    """Return True if the stream is connected to an interactive terminal."""
+    try:
+        return stream.isatty()
+    except (AttributeError, ValueError):
+        return False
+
+
+def exit_on_broken_pipe(stream):
+    """Exit quietly when the reader of the stream has gone away, e.g. ``head``.
+    """
+    # Python flushes stdout on shutdown, which would raise another broken
+    # pipe error, so point the stream at devnull before exiting.
+    try:
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, stream.fileno())
+    except (AttributeError, ValueError, OSError):
+        pass
+    sys.exit(1)
+
+
+class OutputWriter(object):
+    """Buffered writer for line oriented command output.
+
+    Lines are accumulated and written to the output stream in large chunks.
+    Styling is only applied when the output stream is a terminal.
+
+    Use as a context manager to make sure that the buffer is flushed::
+
+        with OutputWriter() as out:
+            for identifier in dataset.identifiers:
+                out.line(identifier)
+    """
+
+    def __init__(self, stream=None, buffer_size=OUTPUT_BUFFER_SIZE):
+        if stream is None:
+            stream = sys.stdout
+        self.stream = stream
+        self.buffer_size = buffer_size
+        self.styled = isatty(stream)
+        self._chunks = []
+        self._size = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+
+    def write(self, text, fg=None):
+        """Add text to the buffer, styled with the fg colour on terminals."""
+        if fg is not None and self.styled:
+            text = click.style(text, fg=fg)
+        self._append(text)
+
+    def line(self, text="", fg=None):
+        """Add a line of text to the buffer."""
+        if fg is not None and self.styled:
+            text = click.style(text, fg=fg)
+        self._append(text + "\n")
+
+    def _append(self, text):
+        self._chunks.append(text)
+        self._size += len(text)
+        if self._size >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered text to the output stream."""
+        if not self._chunks:
+            return
+        text = "".join(self._chunks)
+        self._chunks = []
+        self._size = 0
+        try:
+            self.stream.write(text)
+            self.stream.flush()
+        except IOError as e:
+            if e.errno != errno.EPIPE:
+                raise
+            exit_on_broken_pipe(self.stream)
@@ -19,20 +19,27 @@ setup(
         "click",
         "dtoolcore>=3.0.0",
         "dtool_cli>=0.6.0",
+        "futures; python_version == '2.7'",
         "jinja2",
         "pygments",
     ],
     entry_points={
         "dtool.cli": [
             "diff=dtool_info.dataset:diff",
+            "du=dtool_info.dataset:du",
+            "duplicates=dtool_info.duplicates:duplicates",
+            "fingerprint=dtool_info.dataset:fingerprint",
             "ls=dtool_info.dataset:ls",
             "summary=dtool_info.dataset:summary",
             "item=dtool_info.dataset:item",
             "identifiers=dtool_info.dataset:identifiers",
             "verify=dtool_info.dataset:verify",
+            "verify-merge=dtool_info.dataset:verify_merge",
             "overlay=dtool_info.overlay:overlay",
             "inventory=dtool_info.inventory:inventory",
+            "search=dtool_info.dataset:search",
             "status=dtool_info.dataset:status",
+            "sync-status=dtool_info.replicas:sync_status",
             "uri=dtool_info.dataset:uri",
             "uuid=dtool_info.dataset:uuid",
         ],
@@ -6,6 +6,8 @@ import tempfile
 
 import pytest
 
+import dtoolcore
+
 _HERE = os.path.dirname(__file__)
 _DATA = os.path.join(_HERE, "data")
 SAMPLE_DATASETS_DIR = os.path.join(_DATA, "datasets")
@@ -42,3 +44,18 @@ def local_tmp_dir_fixture(request):
     def teardown():
         shutil.rmtree(d)
     return d
+
+
+def create_dataset(base_dir, name, items):
+    """Create dataset with items given as a dictionary of content by relpath.
+
+    :returns: :class:`dtoolcore.DataSet`
+    """
+    base_uri = dtoolcore.utils.sanitise_uri(base_dir)
+    with dtoolcore.DataSetCreator(name, base_uri) as creator:
+        for relpath, content in items.items():
+            fpath = creator.prepare_staging_abspath_promise(relpath)
+            with open(fpath, "w") as fh:
+                fh.write(content)
+        uri = creator.uri
+    return dtoolcore.DataSet.from_uri(uri)
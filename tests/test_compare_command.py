@@ -1,10 +1,14 @@
 """Test the ``dtool diff`` command."""
 
 import os
+import shutil
 
 from click.testing import CliRunner
 
+import dtoolcore.utils
+
 from . import SAMPLE_DATASETS_DIR
+from . import tmp_dir_fixture  # NOQA
 
 he_dataset_uri = "file://" + os.path.join(SAMPLE_DATASETS_DIR, "he")
 she_dataset_uri = "file://" + os.path.join(SAMPLE_DATASETS_DIR, "she")
@@ -35,3 +39,156 @@ def test_dataset_diff_functional():
     result = runner.invoke(diff, ["--full", cat_dataset_uri, she_dataset_uri])
     assert result.exit_code == 3
     assert result.output.find("Different content") != -1
+
+    result = runner.invoke(
+        diff,
+        ["--full", "-j", "2", "--max-bandwidth", "1M", "--max-iops", "100",
+         cat_dataset_uri, she_dataset_uri]
+    )
+    assert result.exit_code == 3
+    assert result.output.find("Different content") != -1
+
+
+def test_dataset_diff_with_cache(tmp_dir_fixture, monkeypatch):  # NOQA
+
+    from dtool_info.dataset import diff
+
+    monkeypatch.setenv("DTOOL_CACHE_DIRECTORY", tmp_dir_fixture)
+
+    runner = CliRunner()
+
+    for _ in range(2):
+        result = runner.invoke(diff, ["-c", he_dataset_uri, he_dataset_uri])
+        assert result.exit_code == 0
+
+        result = runner.invoke(diff, ["-c", he_dataset_uri, she_dataset_uri])
+        assert result.exit_code == 1
+        assert result.output.startswith("Different identifiers")
+
+        result = runner.invoke(
+            diff,
+            ["-c", cat_dataset_uri, lion_dataset_uri]
+        )
+        assert result.exit_code == 2
+        assert result.output.find("Different sizes") != -1
+
+        result = runner.invoke(diff, ["-c", cat_dataset_uri, she_dataset_uri])
+        assert result.exit_code == 0
+
+        result = runner.invoke(
+            diff,
+            ["-c", "--full", cat_dataset_uri, she_dataset_uri]
+        )
+        assert result.exit_code == 3
+        assert result.output.find("Different content") != -1
+
+    expected = runner.invoke(diff, [he_dataset_uri, she_dataset_uri]).output
+    result = runner.invoke(diff, ["-c", he_dataset_uri, she_dataset_uri])
+    assert result.output == expected
+
+
+def test_fingerprint_command(tmp_dir_fixture, monkeypatch):  # NOQA
+
+    import dtoolcore
+    from dtool_info.dataset import fingerprint
+
+    monkeypatch.setenv("DTOOL_CACHE_DIRECTORY", tmp_dir_fixture)
+
+    runner = CliRunner()
+
+    result = runner.invoke(fingerprint, [he_dataset_uri])
+    assert result.exit_code == 0
+    he_fingerprint = result.output.strip()
+    assert len(he_fingerprint) == 64
+
+    result = runner.invoke(fingerprint, ["--cache", he_dataset_uri])
+    assert result.output.strip() == he_fingerprint
+    result = runner.invoke(fingerprint, ["--cache", he_dataset_uri])
+    assert result.output.strip() == he_fingerprint
+
+    result = runner.invoke(fingerprint, [cat_dataset_uri])
+    assert result.output.strip() != he_fingerprint
+
+    uri = dtoolcore.copy(he_dataset_uri, tmp_dir_fixture, "file")
+    result = runner.invoke(fingerprint, ["--annotate", uri])
+    assert result.exit_code == 0
+    assert result.output.strip() == he_fingerprint
+    annotation = dtoolcore.DataSet.from_uri(uri).get_annotation("fingerprint")
+    assert annotation["root"] == he_fingerprint
+
+
+
+def test_fingerprint_cache_without_manifest_stamp(tmp_dir_fixture, monkeypatch):  # NOQA
+
+    import dtoolcore
+    from dtool_info.fingerprint import (
+        cache_fingerprint,
+        dataset_fingerprint,
+        load_cached_fingerprint,
+    )
+
+    monkeypatch.setenv("DTOOL_CACHE_DIRECTORY", tmp_dir_fixture)
+
+    dataset = dtoolcore.DataSet.from_uri(he_dataset_uri)
+    fp = dataset_fingerprint(dataset, cache=True)
+    assert load_cached_fingerprint(dataset) == fp
+
+    # Storage brokers whose manifests cannot be stamped are not cached.
+    monkeypatch.setattr(
+        "dtool_info.fingerprint.key_stamp",
+        lambda dataset, key: None
+    )
+    assert load_cached_fingerprint(dataset) is None
+    uri = dtoolcore.copy(he_dataset_uri, tmp_dir_fixture, "file")
+    copied = dtoolcore.DataSet.from_uri(uri)
+    cache_fingerprint(copied, fp)
+    monkeypatch.undo()
+    monkeypatch.setenv("DTOOL_CACHE_DIRECTORY", tmp_dir_fixture)
+    assert load_cached_fingerprint(copied) is None
+
+def test_dataset_diff_directory(tmp_dir_fixture):  # NOQA
+
+    from dtool_info.dataset import diff
+
+    directory = os.path.join(tmp_dir_fixture, "lion")
+    shutil.copytree(
+        os.path.join(SAMPLE_DATASETS_DIR, "lion", "data"),
+        directory
+    )
+    item_fpath = os.path.join(directory, "file.txt")
+
+    runner = CliRunner()
+
+    for first in (directory, "file://" + directory):
+        result = runner.invoke(diff, ["--full", first, lion_dataset_uri])
+        assert result.exit_code == 0
+
+    with open(item_fpath, "w") as fh:
+        fh.write("lio\n")
+    result = runner.invoke(diff, [directory, lion_dataset_uri])
+    assert result.exit_code == 2
+    assert result.output.find("Different sizes") != -1
+    assert result.output.find("in 'lion'") != -1
+
+    with open(item_fpath, "w") as fh:
+        fh.write("tiger")
+    result = runner.invoke(diff, ["-c", directory, lion_dataset_uri])
+    assert result.exit_code == 0
+    result = runner.invoke(diff, ["--full", "-j", "2", directory,
+                                  lion_dataset_uri])
+    assert result.exit_code == 3
+    assert result.output.find("Different content") != -1
+
+    os.mkdir(os.path.join(directory, "sub"))
+    with open(os.path.join(directory, "sub", "extra.txt"), "w") as fh:
+        fh.write("extra")
+    result = runner.invoke(diff, [directory, lion_dataset_uri])
+    assert result.exit_code == 1
+    assert result.output.startswith("Different identifiers")
+    assert result.output.find(
+        dtoolcore.utils.generate_identifier("sub/extra.txt")) != -1
+
+    # The reference must be a dataset.
+    result = runner.invoke(diff, [lion_dataset_uri, directory])
+    assert result.exit_code == 2
+    assert result.output.find("Usage") != -1
@@ -0,0 +1,99 @@
+"""Test the ``dtool du`` command."""
+
+import json
+
+from click.testing import CliRunner
+
+from . import create_dataset
+from . import tmp_dir_fixture  # NOQA
+
+
+def test_size_tree():
+
+    from dtool_info.tree import SizeTree
+
+    tree = SizeTree([
+        ("a", {"relpath": "top.txt", "size_in_bytes": 1}),
+        ("b", {"relpath": "data/raw/x.csv", "size_in_bytes": 100}),
+        ("c", {"relpath": "data/raw/y.csv", "size_in_bytes": 50}),
+        ("d", {"relpath": "data/z.csv", "size_in_bytes": 10}),
+        ("e", {"relpath": "docs/readme.txt", "size_in_bytes": 10}),
+    ])
+
+    assert tree.summary(0) == [(".", 171, 5)]
+    assert tree.summary(1) == [
+        (".", 171, 5),
+        ("data/", 160, 3),
+        ("docs/", 10, 1),
+    ]
+    assert tree.summary() == [
+        (".", 171, 5),
+        ("data/", 160, 3),
+        ("data/raw/", 150, 2),
+        ("docs/", 10, 1),
+    ]
+
+    tree.add("docs/big/manual.pdf", 500)
+    assert tree.summary(1) == [
+        (".", 671, 6),
+        ("docs/", 510, 2),
+        ("data/", 160, 3),
+    ]
+
+
+def test_du_functional(tmp_dir_fixture):  # NOQA
+
+    from dtool_info.dataset import du
+    from dtool_info.utils import sizeof_fmt
+
+    uri = create_dataset(tmp_dir_fixture, "nested", {
+        "top.txt": "a",
+        "data/raw/x.csv": "0123456789",
+        "data/z.csv": "01234",
+        "docs/readme.txt": "012",
+    }).uri
+
+    runner = CliRunner()
+
+    result = runner.invoke(du, [uri])
+    assert result.exit_code == 0
+    assert result.output.splitlines() == [
+        "{}\t4\t.".format(sizeof_fmt(19)),
+        "{}\t2\tdata/".format(sizeof_fmt(15)),
+        "{}\t1\tdocs/".format(sizeof_fmt(3)),
+    ]
+
+    result = runner.invoke(du, ["--stream", "-b", "-d", "2", uri])
+    assert result.exit_code == 0
+    assert result.output.splitlines() == [
+        "19\t4\t.",
+        "15\t2\tdata/",
+        "10\t1\tdata/raw/",
+        "3\t1\tdocs/",
+    ]
+
+    result = runner.invoke(du, ["--depth", "0", "--bytes", uri])
+    assert result.output.splitlines() == ["19\t4\t."]
+
+
+def test_du_memstats(tmp_dir_fixture, monkeypatch):  # NOQA
+
+    from dtool_info.dataset import du
+
+    uri = create_dataset(tmp_dir_fixture, "nested", dict(
+        ("dir_{}/item_{}.txt".format(i % 10, i), "x" * i)
+        for i in range(100)
+    )).uri
+
+    monkeypatch.setenv("DTOOL_INFO_MEMSTATS", "json")
+    runner = CliRunner()
+
+    for options in ([], ["--stream"]):
+        result = runner.invoke(du, ["--memstats"] + options + [uri])
+        assert result.exit_code == 0
+        phases = dict(
+            (p["name"], p) for p in json.loads(result.stderr)["phases"]
+        )
+        build_tree = phases["build tree"]
+        assert build_tree["peak_traced_bytes"] > 0
+        assert build_tree["allocation_sites"]
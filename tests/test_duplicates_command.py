@@ -0,0 +1,109 @@
+"""Test the ``dtool duplicates`` command."""
+
+import os
+
+from click.testing import CliRunner
+
+import dtoolcore
+
+from . import create_dataset
+from . import tmp_dir_fixture  # NOQA
+
+
+def test_duplicates_functional(tmp_dir_fixture):  # NOQA
+
+    from dtool_info.duplicates import duplicates
+    from dtool_info.utils import sizeof_fmt
+
+    a_dir = os.path.join(tmp_dir_fixture, "a")
+    b_dir = os.path.join(tmp_dir_fixture, "b")
+    os.mkdir(a_dir)
+    os.mkdir(b_dir)
+
+    first = create_dataset(a_dir, "first", {
+        "x.txt": "hello",
+        "y.txt": "world!",
+        "copy/y.txt": "world!",
+        "empty.txt": "",
+    })
+    second = create_dataset(b_dir, "second", {
+        "x.txt": "hello",
+        "z.txt": "world!",
+        "empty.txt": "",
+        "other.txt": "other",
+    })
+    dtoolcore.copy(first.uri, b_dir)
+
+    runner = CliRunner()
+
+    result = runner.invoke(duplicates, [a_dir, b_dir])
+    assert result.exit_code == 0
+    lines = result.output.splitlines()
+    pair = sorted([
+        (first.uuid, "first"),
+        (second.uuid, "second"),
+    ])
+    assert lines == [
+        "Duplicate content",
+        "\t".join([
+            sizeof_fmt(11), "2",
+            pair[0][0], pair[0][1], pair[1][0], pair[1][1]
+        ]),
+        "\t".join([
+            sizeof_fmt(6), "1",
+            first.uuid, "first", first.uuid, "first"
+        ]),
+    ]
+
+    result = runner.invoke(duplicates, ["-j", "1", a_dir, b_dir])
+    assert result.exit_code == 0
+    assert result.output.splitlines() == lines
+    result = runner.invoke(duplicates, ["--jobs", "0", a_dir, b_dir])
+    assert result.exit_code == 2
+
+    result = runner.invoke(
+        duplicates,
+        ["--moved", "--min-size", "6", a_dir, b_dir]
+    )
+    assert result.exit_code == 0
+    lines = result.output.splitlines()
+    assert len(lines) == 6
+    assert lines[3] == "Moved items"
+    moved = set(tuple(line.split("\t")) for line in lines[4:])
+    if pair[0][1] == "first":
+        assert moved == set([
+            ("first", "y.txt", "second", "z.txt"),
+            ("first", "copy/y.txt", "second", "z.txt"),
+        ])
+    else:
+        assert moved == set([
+            ("second", "z.txt", "first", "y.txt"),
+            ("second", "z.txt", "first", "copy/y.txt"),
+        ])
+
+
+def test_diff_renamed_items(tmp_dir_fixture):  # NOQA
+
+    from dtool_info.dataset import diff
+
+    first = create_dataset(tmp_dir_fixture, "first", {
+        "x.txt": "hello",
+        "y.txt": "world!",
+    })
+    second = create_dataset(tmp_dir_fixture, "second", {
+        "x.txt": "hello",
+        "z.txt": "world!",
+        "other.txt": "other",
+    })
+
+    runner = CliRunner()
+    result = runner.invoke(diff, [first.uri, second.uri])
+    assert result.exit_code == 1
+    lines = result.output.splitlines()
+    assert lines[0] == "Different identifiers"
+    assert lines[2] == "{}, False, True".format(
+        dtoolcore.utils.generate_identifier("other.txt"))
+    assert lines[3] == "Renamed items"
+    assert lines[4] == "hash, relpath in 'first', relpath in 'second'"
+    assert lines[5].endswith(", y.txt, z.txt")
+    assert len(lines) == 6
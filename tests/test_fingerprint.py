@@ -0,0 +1,53 @@
+"""Test the dtool_info.fingerprint module."""
+
+import pytest
+
+from dtool_info.manifest import CompactManifest
+
+
+def _items(num_items, size=0):
+    return [
+        ("{:040x}".format(i * 7919), {
+            "relpath": "item_{}".format(i),
+            "size_in_bytes": size,
+            "hash": "{:032x}".format(i),
+            "utc_timestamp": 0.0,
+        })
+        for i in range(num_items)
+    ]
+
+
+def _fingerprint(items):
+    from dtool_info.fingerprint import Fingerprint
+    manifest = CompactManifest(items, {"hash_function": "md5sum_hexdigest"})
+    return Fingerprint.from_manifest(manifest)
+
+
+def test_fingerprint():
+
+    from dtool_info.fingerprint import Fingerprint, NUM_BUCKETS, bucket
+
+    items = _items(1000)
+    fingerprint = _fingerprint(items)
+    assert len(fingerprint.buckets) == NUM_BUCKETS
+
+    # The fingerprint does not depend on the order of the items.
+    assert _fingerprint(list(reversed(items))) == fingerprint
+    assert _fingerprint(items[1:]) != fingerprint
+
+    changed = list(items)
+    identifier, props = changed[42]
+    changed[42] = (identifier, dict(props, size_in_bytes=1))
+    assert fingerprint.differing_buckets(_fingerprint(changed)) \
+        == set([bucket(identifier)])
+
+    restored = Fingerprint.from_dict(fingerprint.as_dict())
+    assert restored == fingerprint
+    assert restored.buckets == fingerprint.buckets
+
+    data = fingerprint.as_dict()
+    data["root"] = "0" * 64
+    with pytest.raises(ValueError):
+        Fingerprint.from_dict(data)
+    with pytest.raises(ValueError):
+        Fingerprint.from_dict(dict(fingerprint.as_dict(), version=0))
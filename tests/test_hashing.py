@@ -0,0 +1,100 @@
+"""Test the dtool_info.hashing module."""
+
+import os
+
+import pytest
+
+from . import tmp_dir_fixture  # NOQA
+
+
+def test_file_hasher_matches_dtoolcore(tmp_dir_fixture):  # NOQA
+
+    from dtoolcore.filehasher import (
+        FileHasher as CoreFileHasher,
+        md5sum_hexdigest,
+        sha256sum_hexdigest,
+    )
+    from dtool_info.hashing import FileHasher
+
+    fpaths = []
+    for size in [0, 1, 7, 1000]:
+        fpath = os.path.join(tmp_dir_fixture, "{}.bin".format(size))
+        with open(fpath, "wb") as fh:
+            fh.write(os.urandom(size))
+        fpaths.append(fpath)
+
+    for hash_func in [md5sum_hexdigest, sha256sum_hexdigest]:
+        core_hasher = CoreFileHasher(hash_func)
+        readinto_hasher = FileHasher(core_hasher, buffer_size=7,
+                                     use_mmap=False)
+        mmap_hasher = FileHasher(core_hasher, use_mmap=True)
+        assert readinto_hasher.name == core_hasher.name
+        for fpath in fpaths:
+            assert readinto_hasher(fpath) == core_hasher(fpath)
+            assert mmap_hasher(fpath) == core_hasher(fpath)
+
+
+def test_file_hasher_falls_back_to_storage_broker_hasher():
+
+    from dtoolcore.filehasher import FileHasher as CoreFileHasher
+    from dtool_info.hashing import FileHasher
+
+    def custom_hexdigest(fpath):
+        return "custom"
+
+    hasher = FileHasher(CoreFileHasher(custom_hexdigest))
+    assert hasher("dontexist") == "custom"
+
+
+def test_token_bucket_limits_rate():
+
+    import time
+    from dtool_info.hashing import TokenBucket
+
+    bucket = TokenBucket(rate=1000)
+
+    start = time.time()
+    bucket.consume(1000)
+    assert time.time() - start < 0.1
+
+    bucket.consume(200)
+    assert time.time() - start >= 0.15
+
+
+def test_file_hasher_with_throttle(tmp_dir_fixture):  # NOQA
+
+    from dtoolcore.filehasher import (
+        FileHasher as CoreFileHasher,
+        md5sum_hexdigest,
+    )
+    from dtool_info.hashing import FileHasher, IOThrottle
+
+    fpath = os.path.join(tmp_dir_fixture, "file.bin")
+    with open(fpath, "wb") as fh:
+        fh.write(os.urandom(1000))
+
+    class CountingThrottle(IOThrottle):
+        num_bytes = 0
+
+        def read(self, num_bytes):
+            self.num_bytes += num_bytes
+
+    core_hasher = CoreFileHasher(md5sum_hexdigest)
+    for use_mmap in [False, True]:
+        throttle = CountingThrottle(max_iops=1000)
+        hasher = FileHasher(core_hasher, buffer_size=300, use_mmap=use_mmap,
+                            throttle=throttle)
+        assert hasher(fpath) == core_hasher(fpath)
+        assert throttle.num_bytes == 1000
+
+
+def test_io_throttle_rejects_non_positive_limits():
+
+    from dtool_info.hashing import IOThrottle
+
+    IOThrottle()
+    IOThrottle(max_bandwidth=1, max_iops=1)
+    with pytest.raises(ValueError):
+        IOThrottle(max_bandwidth=0)
+    with pytest.raises(ValueError):
+        IOThrottle(max_iops=0)
@@ -0,0 +1,101 @@
+"""Test the dtool_info.instrumentation module."""
+
+
+class _StorageBroker(object):
+
+    def get_text(self, key):
+        return "abc"
+
+    def iter_item_handles(self):
+        for handle in ("a", "b"):
+            yield handle
+
+
+def test_phase_is_noop_when_inactive():
+
+    from dtool_info.instrumentation import phase
+
+    with phase("anything"):
+        pass
+
+
+def test_phases_accumulate():
+
+    from dtool_info.instrumentation import instrumented, phase
+
+    with instrumented() as timings:
+        with phase("one"):
+            pass
+        with phase("two"):
+            pass
+        with phase("one"):
+            pass
+
+    assert list(timings.phases.keys()) == ["one", "two"]
+    assert timings.phases["one"][0] == 2
+    assert timings.phases["two"][0] == 1
+
+
+def test_instrument_storage_broker():
+
+    from dtool_info.instrumentation import (
+        Timings,
+        instrument_storage_broker,
+    )
+
+    timings = Timings()
+    storage_broker = instrument_storage_broker(_StorageBroker(), timings)
+
+    assert storage_broker.get_text("key") == "abc"
+    assert storage_broker.get_text("key") == "abc"
+    assert list(storage_broker.iter_item_handles()) == ["a", "b"]
+
+    count, _, num_bytes = timings.calls["get_text"]
+    assert count == 2
+    assert num_bytes == 6
+    assert timings.calls["iter_item_handles"][0] == 1
+
+
+def test_memory_traced():
+
+    from dtool_info.instrumentation import memory_traced, phase
+
+    with memory_traced() as memstats:
+        with phase("allocate"):
+            data = [str(i) for i in range(10000)]  # NOQA
+
+    info = memstats.as_dict()
+    assert info["peak_rss_bytes"] > 0
+    allocate, = info["phases"]
+    assert allocate["name"] == "allocate"
+    assert allocate["net_traced_bytes"] > 10000
+    assert allocate["peak_traced_bytes"] >= allocate["net_traced_bytes"]
+    sites = [s["site"] for s in allocate["allocation_sites"]]
+    assert any(site.startswith(__file__) for site in sites)
+
+
+def test_memory_traced_nested_phases():
+
+    from dtool_info.instrumentation import memory_traced, phase
+
+    with memory_traced() as memstats:
+        with phase("outer"):
+            kept = [str(i) for i in range(10000)]  # NOQA
+            with phase("inner"):
+                data = [str(i) for i in range(50000)]
+                del data
+            with phase("inner"):
+                more = [str(i) for i in range(1000)]  # NOQA
+
+    phases = dict((p["name"], p) for p in memstats.as_dict()["phases"])
+    outer = phases["outer"]
+    inner = phases["inner"]
+    assert inner["count"] == 2
+    # The allocations and peaks of the inner phases count towards the outer.
+    assert outer["net_traced_bytes"] >= inner["net_traced_bytes"] > 0
+    assert outer["net_traced_bytes"] > 10000
+    assert outer["peak_traced_bytes"] >= inner["peak_traced_bytes"]
+    assert outer["peak_traced_bytes"] > 50000 * 48
+    assert outer["allocation_sites"]
+    sites = [s["site"] for s in outer["allocation_sites"]]
+    assert any(site.startswith(__file__) for site in sites)
@@ -0,0 +1,51 @@
+"""Test the dtool_info.integrity module."""
+
+import pytest
+
+
+def test_pipelined_hashes():
+
+    from dtool_info.integrity import pipelined_hashes
+
+    identifiers = [str(i) for i in range(100)]
+
+    def fetch(identifier):
+        return "path" + identifier
+
+    def hasher(fpath):
+        return fpath.upper()
+
+    results = dict(pipelined_hashes(
+        identifiers,
+        fetch,
+        hasher,
+        num_fetchers=3,
+        num_hashers=2,
+        queue_size=2
+    ))
+    assert results == dict((i, "PATH" + i) for i in identifiers)
+
+
+def test_pipelined_hashes_raises_worker_errors():
+
+    from dtool_info.integrity import pipelined_hashes
+
+    def fetch(identifier):
+        if identifier == "3":
+            raise IOError("Cannot fetch")
+        return identifier
+
+    with pytest.raises(IOError):
+        list(pipelined_hashes([str(i) for i in range(10)], fetch, str))
+
+
+def test_in_shard_partitions_identifiers():
+
+    import dtoolcore.utils
+    from dtool_info.integrity import in_shard
+
+    identifiers = [dtoolcore.utils.generate_identifier(str(i))
+                   for i in range(100)]
+    for i in identifiers:
+        shards = [s for s in range(4) if in_shard(i, (s, 4))]
+        assert len(shards) == 1
@@ -5,7 +5,11 @@ import json
 
 from click.testing import CliRunner
 
+import dtoolcore
+
 from . import SAMPLE_DATASETS_DIR
+from . import create_dataset
+from . import tmp_dir_fixture  # NOQA
 
 lion_dataset_uri = "file://" + os.path.join(SAMPLE_DATASETS_DIR, "lion")
 item_identifier = "5436437fa01a7d3e41d46741da54b451446774ca"
@@ -95,6 +99,59 @@ def test_dataset_item_overlay_functional():
     assert result.output.startswith("No such identifier in overlay")
 
 
+def test_dataset_item_overlay_with_cache_functional(tmp_dir_fixture, monkeypatch):  # NOQA
+
+    from dtool_info.dataset import item
+
+    monkeypatch.setenv("DTOOL_CACHE_DIRECTORY", tmp_dir_fixture)
+
+    runner = CliRunner()
+
+    for _ in range(2):
+        result = runner.invoke(
+            item,
+            ["overlay", "--cache", "age", people_dataset_uri, anna_identifier])
+        assert result.exit_code == 0
+        assert result.output.strip() == "23"
+
+    result = runner.invoke(
+        item,
+        ["overlay", "--cache", "age", people_dataset_uri, "dontexist"])
+    assert result.exit_code == 5
+    assert result.output.startswith("No such identifier in overlay")
+
+    result = runner.invoke(
+        item,
+        ["overlay", "-c", "dont_exist", people_dataset_uri, anna_identifier])
+    assert result.exit_code == 4
+
+
+def test_dataset_item_overlay_cache_is_rebuilt(tmp_dir_fixture, monkeypatch):  # NOQA
+
+    from dtool_info.dataset import item
+
+    monkeypatch.setenv("DTOOL_CACHE_DIRECTORY", tmp_dir_fixture)
+    uri = dtoolcore.copy(people_dataset_uri, tmp_dir_fixture, "file")
+    dataset = dtoolcore.DataSet.from_uri(uri)
+
+    runner = CliRunner()
+
+    result = runner.invoke(
+        item,
+        ["overlay", "-c", "age", uri, anna_identifier])
+    assert result.output.strip() == "23"
+
+    age = dataset.get_overlay("age")
+    age[anna_identifier] = 230
+    dataset.put_overlay("age", age)
+
+    result = runner.invoke(
+        item,
+        ["overlay", "-c", "age", uri, anna_identifier])
+    assert result.exit_code == 0
+    assert result.output.strip() == "230"
+
+
 def test_dataset_item_relpath_functional():
 
     from dtool_info.dataset import item
@@ -108,3 +165,177 @@ def test_dataset_item_relpath_functional():
         ["relpath", people_dataset_uri, anna_identifier])
     assert result.exit_code == 0
     assert result.output.strip() == "anna.txt"
+
+
+def test_dataset_item_prefetch_functional():
+
+    from dtoolcore import DataSet
+    from dtool_info.dataset import item
+
+    people_ds = DataSet.from_uri(people_dataset_uri)
+    expected = "{}\t{}".format(
+        anna_identifier,
+        people_ds.item_content_abspath(anna_identifier)
+    )
+
+    runner = CliRunner()
+
+    result = runner.invoke(item, ["prefetch", people_dataset_uri])
+    assert result.exit_code == 0
+    assert expected in result.output.splitlines()
+    assert result.stdout.count("\n") == 3
+
+    result = runner.invoke(
+        item,
+        ["prefetch", "--glob", "a*.txt", people_dataset_uri])
+    assert result.exit_code == 0
+    assert result.stdout.splitlines() == [expected]
+
+    result = runner.invoke(
+        item,
+        ["prefetch", people_dataset_uri, "-"],
+        input=anna_identifier + "\n")
+    assert result.exit_code == 0
+    assert result.stdout.splitlines() == [expected]
+
+    result = runner.invoke(
+        item,
+        ["prefetch", people_dataset_uri, "dontexist"])
+    assert result.exit_code == 20
+
+
+def test_dataset_item_prefetch_resumes(tmp_dir_fixture, monkeypatch):  # NOQA
+
+    import dtool_info.fetch
+    from dtool_info.dataset import item
+
+    monkeypatch.setenv("DTOOL_CACHE_DIRECTORY", tmp_dir_fixture)
+    monkeypatch.setattr(dtool_info.fetch, "LOCAL_STORAGE_BROKERS", ())
+
+    runner = CliRunner()
+
+    result = runner.invoke(item, ["prefetch", "-j", "2", people_dataset_uri])
+    assert result.exit_code == 0
+    assert result.stdout.count("\n") == 3
+    assert result.stderr.startswith("Fetched 3 of 3 items")
+
+    result = runner.invoke(item, ["prefetch", people_dataset_uri])
+    assert result.exit_code == 0
+    assert result.stdout.count("\n") == 3
+    assert result.stderr.startswith("Fetched 0 of 3 items")
+
+
+def test_dataset_item_cat_functional():
+
+    from dtool_info.dataset import item
+
+    runner = CliRunner()
+
+    result = runner.invoke(
+        item,
+        ["cat", people_dataset_uri, anna_identifier])
+    assert result.exit_code == 0
+    with open(os.path.join(SAMPLE_DATASETS_DIR, "people", "data", "anna.txt"),
+              "rb") as fh:
+        expected = fh.read()
+    assert result.stdout_bytes == expected
+
+    result = runner.invoke(
+        item,
+        ["cat", "--offset", "1", "--length", "2", people_dataset_uri,
+         anna_identifier])
+    assert result.exit_code == 0
+    assert result.stdout_bytes == expected[1:3]
+
+    result = runner.invoke(
+        item,
+        ["cat", people_dataset_uri, "dontexist"])
+    assert result.exit_code == 20
+
+
+def test_dataset_item_query_functional(tmp_dir_fixture):  # NOQA
+
+    from dtool_info.dataset import item
+
+    patrick_identifier = "9ce8a10f8e38b21fe6da40e484505a7f03f0bbf8"
+    sarah_identifier = "c5e85b66ab36f5cf5147e89cfd5abecf40bc2a6a"
+
+    runner = CliRunner()
+
+    result = runner.invoke(item, ["query", people_dataset_uri])
+    assert result.exit_code == 0
+    assert result.output.splitlines() == [
+        anna_identifier, patrick_identifier, sarah_identifier]
+
+    result = runner.invoke(
+        item,
+        ["query", "-r", people_dataset_uri, "size_in_bytes>5"]
+    )
+    assert result.output.splitlines() == ["patrick.txt", "sarah.txt"]
+
+    result = runner.invoke(item, [
+        "query", "-r", people_dataset_uri,
+        "size_in_bytes>5B", "relpath matches s*.txt"
+    ])
+    assert result.output.splitlines() == ["sarah.txt"]
+
+    result = runner.invoke(item, [
+        "query", "-r", people_dataset_uri,
+        "utc_timestamp>=2017-10-20T14:24:20"
+    ])
+    assert result.output.splitlines() == ["anna.txt"]
+
+    hashes_fpath = os.path.join(tmp_dir_fixture, "hashes.txt")
+    with open(hashes_fpath, "w") as fh:
+        fh.write("e7b4ab37f430a4109d62f404877d8e05\n")
+        fh.write("fc9f8fd1d9436515eaefbe90bfce9080\n")
+    result = runner.invoke(item, [
+        "query", "-p", people_dataset_uri,
+        "hash in @{}".format(hashes_fpath), "relpath!=anna.txt"
+    ])
+    assert result.exit_code == 0
+    assert [json.loads(line) for line in result.output.splitlines()] == [{
+        "identifier": sarah_identifier,
+        "relpath": "sarah.txt",
+        "size_in_bytes": 6,
+        "hash": "fc9f8fd1d9436515eaefbe90bfce9080",
+        "utc_timestamp": 1508509454.0,
+    }]
+
+    result = runner.invoke(item, [
+        "query", "-r", people_dataset_uri, "utc_timestamp<1508509454"
+    ])
+    assert result.output.splitlines() == ["patrick.txt"]
+
+    for predicate in ("colour==red", "size_in_bytes>big", "hash in @nofile"):
+        result = runner.invoke(item, ["query", people_dataset_uri, predicate])
+        assert result.exit_code == 2
+
+
+def test_dataset_item_query_json_like_relpaths(tmp_dir_fixture):  # NOQA
+
+    from dtool_info.dataset import item
+
+    relpaths = ["1.50", "1e5", "true", "null", "01"]
+    uri = create_dataset(
+        tmp_dir_fixture,
+        "json-like",
+        dict((relpath, relpath) for relpath in relpaths)
+    ).uri
+
+    runner = CliRunner()
+
+    # Operands are compared as given, not as the JSON values they look like.
+    for relpath in relpaths:
+        result = runner.invoke(
+            item,
+            ["query", "-r", uri, "relpath=={}".format(relpath)]
+        )
+        assert result.exit_code == 0
+        assert result.output.splitlines() == [relpath]
+
+    result = runner.invoke(item, ["query", "-r", uri, "relpath in 1.50,true"])
+    assert sorted(result.output.splitlines()) == ["1.50", "true"]
+
+    result = runner.invoke(item, ["query", "-r", uri, "relpath matches 1*"])
+    assert sorted(result.output.splitlines()) == ["1.50", "1e5"]
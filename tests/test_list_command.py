@@ -63,3 +63,102 @@ def test_dataset_ls_dataset_content_functional():
     assert result.exit_code == 0
     for lin in expected_lines:
         assert result.output.find(line) != -1
+
+
+def test_dataset_ls_timings():
+
+    import dtoolcore
+    from dtool_info.dataset import ls
+
+    get_storage_broker = dtoolcore._get_storage_broker
+
+    runner = CliRunner()
+
+    result = runner.invoke(ls, ["--timings", lion_dataset_uri])
+    assert result.exit_code == 0
+    assert "Total time" not in result.stdout
+    assert "load manifest" in result.stderr
+    assert "get_manifest" in result.stderr
+
+    # The storage brokers are only instrumented while the command runs.
+    assert dtoolcore._get_storage_broker is get_storage_broker
+
+
+def test_dataset_ls_timings_json(monkeypatch):
+
+    import json
+    from dtool_info.dataset import ls
+
+    monkeypatch.setenv("DTOOL_INFO_TIMINGS", "json")
+
+    runner = CliRunner()
+
+    result = runner.invoke(ls, [lion_dataset_uri])
+    assert result.exit_code == 0
+    timings = json.loads(result.stderr)
+    phases = [p["name"] for p in timings["phases"]]
+    assert phases == [
+        "load dataset",
+        "load manifest",
+        "collect items",
+        "sort items",
+        "output",
+    ]
+    methods = [c["method"] for c in timings["storage_broker_calls"]]
+    assert "get_manifest" in methods
+
+
+def test_dataset_ls_stream_timings_json(monkeypatch):
+
+    import json
+    from dtool_info.dataset import ls
+
+    monkeypatch.setenv("DTOOL_INFO_TIMINGS", "json")
+
+    runner = CliRunner()
+
+    result = runner.invoke(ls, ["--stream", lion_dataset_uri])
+    assert result.exit_code == 0
+    timings = json.loads(result.stderr)
+    calls = dict(
+        (c["method"], c) for c in timings["storage_broker_calls"]
+    )
+    # Manifests on local disk are read directly, but still recorded.
+    manifest_fpath = os.path.join(
+        SAMPLE_DATASETS_DIR, "lion", ".dtool", "manifest.json")
+    assert calls["get_manifest"]["count"] == 1
+    assert calls["get_manifest"]["bytes"] == os.path.getsize(manifest_fpath)
+
+
+def test_dataset_ls_memstats():
+
+    from dtool_info.dataset import ls
+
+    runner = CliRunner()
+
+    result = runner.invoke(ls, ["--memstats", lion_dataset_uri])
+    assert result.exit_code == 0
+    assert "Peak RSS" in result.stderr
+    assert "sort items" in result.stderr
+
+
+def test_dataset_ls_stream():
+
+    from dtool_info.dataset import ls
+
+    people_dataset_uri = "file://" + os.path.join(
+        SAMPLE_DATASETS_DIR,
+        "people"
+    )
+
+    runner = CliRunner()
+
+    for options in ([], ["-v"], ["-q"]):
+        result = runner.invoke(ls, options + [people_dataset_uri])
+        assert result.exit_code == 0
+        stream_result = runner.invoke(
+            ls,
+            options + ["--stream", people_dataset_uri]
+        )
+        assert stream_result.exit_code == 0
+        assert stream_result.output == result.output
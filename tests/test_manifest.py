@@ -0,0 +1,180 @@
+"""Test the dtool_info.manifest module."""
+
+import io
+import json
+import os
+
+import pytest
+
+from . import SAMPLE_DATASETS_DIR
+
+people_dataset_uri = "file://" + os.path.join(SAMPLE_DATASETS_DIR, "people")
+
+
+def _manifest():
+    return {
+        "dtoolcore_version": "3.19.0",
+        "hash_function": "md5sum_hexdigest",
+        "items": {
+            "{:040x}".format(i): {
+                "relpath": u"dir/fé{}.txt".format(i),
+                "size_in_bytes": 12345 * i,
+                "hash": "{:032x}".format(i),
+                "utc_timestamp": 1500000000.5 + i,
+            }
+            for i in range(50)
+        },
+    }
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 1024 * 1024])
+@pytest.mark.parametrize("indent", [None, 2])
+def test_iter_manifest_file(chunk_size, indent):
+
+    from dtool_info.manifest import iter_manifest_file
+
+    manifest = _manifest()
+    text = json.dumps(manifest, indent=indent, sort_keys=True,
+                      ensure_ascii=False)
+
+    metadata = {}
+    items = list(iter_manifest_file(io.StringIO(text), metadata, chunk_size))
+
+    assert dict(items) == manifest["items"]
+    assert metadata == {
+        "dtoolcore_version": "3.19.0",
+        "hash_function": "md5sum_hexdigest",
+    }
+
+
+def test_iter_manifest_file_empty_items():
+
+    from dtool_info.manifest import iter_manifest_file
+
+    text = u'{"items": {}, "hash_function": "md5sum_hexdigest"}'
+    metadata = {}
+    assert list(iter_manifest_file(io.StringIO(text), metadata, 4)) == []
+    assert metadata["hash_function"] == "md5sum_hexdigest"
+
+
+def test_iter_manifest_file_truncated():
+
+    from dtool_info.manifest import iter_manifest_file
+
+    text = json.dumps(_manifest())[:-20]
+    with pytest.raises(ValueError):
+        list(iter_manifest_file(io.StringIO(text), chunk_size=16))
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 1024 * 1024])
+def test_iter_object_file(chunk_size):
+
+    from dtool_info.manifest import iter_object_file
+
+    overlay = {
+        "{:040x}".format(i): [i, {"note": u"tab\t \"fé\"", "ok": None}]
+        for i in range(20)
+    }
+    text = json.dumps(overlay, indent=2, ensure_ascii=False)
+    assert dict(iter_object_file(io.StringIO(text), chunk_size)) == overlay
+    assert list(iter_object_file(io.StringIO(u" { } "), chunk_size)) == []
+    with pytest.raises(ValueError):
+        list(iter_object_file(io.StringIO(text[:-10]), chunk_size))
+
+
+def test_overlay_stream():
+
+    import dtoolcore
+    from dtool_info.manifest import OverlayStream
+
+    dataset = dtoolcore.DataSet.from_uri(people_dataset_uri)
+    assert dict(OverlayStream(dataset, "age")) == dataset.get_overlay("age")
+
+
+def test_manifest_stream():
+
+    import dtoolcore
+    from dtool_info.manifest import ManifestStream
+
+    dataset = dtoolcore.DataSet.from_uri(people_dataset_uri)
+    manifest = ManifestStream(dataset)
+
+    assert dict(manifest) == dataset._manifest["items"]
+    assert manifest.metadata["hash_function"] == "md5sum_hexdigest"
+
+
+@pytest.mark.parametrize("loaded", [False, True])
+def test_compact_manifest(loaded):
+
+    import dtoolcore
+    from dtool_info.manifest import CompactManifest
+
+    dataset = dtoolcore.DataSet.from_uri(people_dataset_uri)
+    if loaded:
+        dataset._manifest
+    manifest = CompactManifest.from_dataset(dataset)
+
+    assert len(manifest) == 3
+    assert manifest.hash_function == "md5sum_hexdigest"
+    assert list(manifest.identifiers) == sorted(dataset.identifiers)
+    for i in dataset.identifiers:
+        assert i in manifest
+        props = manifest.item_properties(i)
+        assert props.identifier == i
+        assert props.as_dict() == dataset.item_properties(i)
+        assert props["relpath"] == props.relpath
+    assert sorted(manifest.relpath(r) for r in range(len(manifest))) == [
+        "anna.txt", "patrick.txt", "sarah.txt"]
+
+    assert "0" * 40 not in manifest
+    assert "not-hex" not in manifest
+    with pytest.raises(KeyError):
+        manifest.item_properties("0" * 40)
+
+
+def test_compact_manifest_select_and_fallback_hashes():
+
+    from dtool_info.manifest import CompactManifest
+
+    items = _manifest()["items"]
+    items["{:040x}".format(7)]["hash"] = "NOT-HEX"
+    manifest = CompactManifest(
+        items.items(),
+        select=lambda i: int(i, 16) % 2 == 1
+    )
+
+    assert len(manifest) == 25
+    for i, props in items.items():
+        if int(i, 16) % 2 == 1:
+            assert manifest.item_properties(i).as_dict() == props
+        else:
+            assert i not in manifest
+
+
+def test_compact_manifest_unordered_items():
+
+    from dtool_info.manifest import CompactManifest
+
+    items = sorted(
+        _manifest()["items"].items(),
+        key=lambda item: item[1]["relpath"]
+    )
+    manifest = CompactManifest(items)
+
+    assert list(manifest.identifiers) == sorted(i for i, _ in items)
+    for i, props in items:
+        assert manifest.item_properties(i).as_dict() == props
+
+
+def test_iter_manifest_file_escaped_keys_and_invalid_separators():
+
+    from dtool_info.manifest import iter_manifest_file
+
+    text = u'{"items": {"a": 1, "b\\"c": 2 , "d\\u00e9": 3}}'
+    assert list(iter_manifest_file(io.StringIO(text), chunk_size=5)) == [
+        ("a", 1), ('b"c', 2), (u"d\u00e9", 3)]
+
+    for text in (u'{"items": {"a": 1 "b": 2}}',
+                 u'{"items": {"a": 1,, "b": 2}}'):
+        with pytest.raises(ValueError):
+            list(iter_manifest_file(io.StringIO(text)))
@@ -0,0 +1,59 @@
+"""Test the dtool_info.overlay_cache module."""
+
+import pytest
+
+from . import tmp_dir_fixture  # NOQA
+
+
+def test_mapped_overlay(tmp_dir_fixture):  # NOQA
+
+    import os
+    import dtoolcore.utils
+    from dtool_info.overlay_cache import write_overlay_cache, MappedOverlay
+
+    overlay = {}
+    for i in range(1000):
+        identifier = dtoolcore.utils.generate_identifier(str(i))
+        overlay[identifier] = {"number": i} if i % 2 else str(i)
+
+    fpath = os.path.join(tmp_dir_fixture, "overlay.bin")
+    write_overlay_cache(fpath, overlay)
+
+    mapped = MappedOverlay(fpath)
+    assert len(mapped) == 1000
+    for identifier, value in overlay.items():
+        assert mapped[identifier] == value
+
+    with pytest.raises(KeyError):
+        mapped["0" * 40]
+    with pytest.raises(KeyError):
+        mapped["nonsense"]
+    mapped.close()
+
+    with pytest.raises(ValueError):
+        write_overlay_cache(fpath, {"nonsense": 1})
+
+
+def test_load_overlay_cache(tmp_dir_fixture):  # NOQA
+
+    import os
+    import dtoolcore.utils
+    from dtool_info.overlay_cache import (
+        load_overlay_cache,
+        write_overlay_cache,
+    )
+
+    identifier = dtoolcore.utils.generate_identifier("a.txt")
+    fpath = os.path.join(tmp_dir_fixture, "overlay.bin")
+    assert load_overlay_cache(fpath, [1.0, 10]) is None
+
+    write_overlay_cache(fpath, {identifier: "a"}, [1.0, 10])
+    mapped = load_overlay_cache(fpath, [1.0, 10])
+    assert mapped[identifier] == "a"
+    mapped.close()
+
+    assert load_overlay_cache(fpath, [2.0, 10]) is None
+
+    with open(fpath, "wb") as fh:
+        fh.write(b"DTOVLAY1")
+    assert load_overlay_cache(fpath, [1.0, 10]) is None
@@ -8,6 +8,7 @@ from click.testing import CliRunner
 import dtoolcore
 
 from . import SAMPLE_DATASETS_DIR
+from . import tmp_dir_fixture  # NOQA
 
 people_dataset_uri = "file://" + os.path.join(
     SAMPLE_DATASETS_DIR,
@@ -47,3 +48,227 @@ def test_overlay_show_command_with_nonexisting_overlay_name():
 
     result = runner.invoke(show, [people_dataset_uri, "dontexit"])
     assert result.exit_code == 11
+
+
+def test_overlay_show_command_json_matches_json_dumps():
+    from dtool_info.overlay import show
+
+    dataset = dtoolcore.DataSet.from_uri(people_dataset_uri)
+    expected = json.dumps(dataset.get_overlay("age"), indent=2) + "\n"
+
+    runner = CliRunner()
+
+    result = runner.invoke(show, [people_dataset_uri, "age"])
+    assert result.exit_code == 0
+    assert result.output == expected
+
+
+def test_overlay_show_command_ndjson():
+    from dtool_info.overlay import show
+
+    runner = CliRunner()
+
+    result = runner.invoke(show, ["-f", "ndjson", people_dataset_uri, "age"])
+    assert result.exit_code == 0
+
+    records = [json.loads(line) for line in result.output.splitlines()]
+    assert len(records) == 3
+
+    patrick_id = dtoolcore.utils.generate_identifier("patrick.txt")
+    assert {"identifier": patrick_id, "value": 34} in records
+
+
+def test_overlay_show_command_tsv():
+    from dtool_info.overlay import show
+
+    runner = CliRunner()
+
+    result = runner.invoke(show, ["-f", "tsv", people_dataset_uri, "gender"])
+    assert result.exit_code == 0
+
+    anna_id = dtoolcore.utils.generate_identifier("anna.txt")
+    assert "{}\tfemale".format(anna_id) in result.output.splitlines()
+
+
+def test_overlay_export_command():
+    from dtool_info.overlay import export
+
+    runner = CliRunner()
+
+    result = runner.invoke(export, [people_dataset_uri])
+    assert result.exit_code == 0
+
+    lines = result.output.splitlines()
+    assert lines[0] == "identifier\trelpath\tage\tgender"
+    anna_id = dtoolcore.utils.generate_identifier("anna.txt")
+    assert lines[1] == "{}\tanna.txt\t23\tfemale".format(anna_id)
+    assert len(lines) == 4
+
+
+def test_overlay_export_command_formats():
+    from dtool_info.overlay import export
+
+    runner = CliRunner()
+
+    result = runner.invoke(
+        export,
+        ["-f", "csv", people_dataset_uri, "gender", "age"]
+    )
+    assert result.exit_code == 0
+    lines = result.output.splitlines()
+    assert lines[0] == "identifier,relpath,gender,age"
+    assert lines[1].endswith(",anna.txt,female,23")
+
+    result = runner.invoke(export, ["-f", "ndjson", people_dataset_uri, "age"])
+    assert result.exit_code == 0
+    first = json.loads(result.output.splitlines()[0])
+    assert first == {
+        "identifier": dtoolcore.utils.generate_identifier("anna.txt"),
+        "relpath": "anna.txt",
+        "age": 23,
+    }
+
+
+def test_overlay_export_command_tsv_escapes(tmp_dir_fixture):  # NOQA
+    from dtool_info.overlay import export
+
+    uri = dtoolcore.copy(people_dataset_uri, tmp_dir_fixture, "file")
+    dataset = dtoolcore.DataSet.from_uri(uri)
+    anna_id = dtoolcore.utils.generate_identifier("anna.txt")
+    notes = dict((i, "") for i in dataset.identifiers)
+    notes[anna_id] = "first\tsecond\nthird\\"
+    dataset.put_overlay("notes", notes)
+
+    runner = CliRunner()
+
+    result = runner.invoke(export, [uri, "notes"])
+    assert result.exit_code == 0
+    lines = result.output.splitlines()
+    assert len(lines) == 4
+    assert lines[1] == "{}\tanna.txt\tfirst\\tsecond\\nthird\\\\".format(
+        anna_id)
+
+
+def test_overlay_export_command_join(tmp_dir_fixture):  # NOQA
+    from dtool_info.overlay import export
+
+    uri = dtoolcore.copy(people_dataset_uri, tmp_dir_fixture, "file")
+    dataset = dtoolcore.DataSet.from_uri(uri)
+    identifiers = sorted(dataset.identifiers)
+
+    # Overlays need not list every item, nor be in identifier order, and
+    # values of unknown items are ignored.
+    dataset._storage_broker.put_overlay("partial", {
+        identifiers[2]: "c",
+        identifiers[0]: "a",
+        "0" * 40: "unknown",
+    })
+    dataset.put_overlay("reversed", dict(
+        (i, n) for n, i in reversed(list(enumerate(identifiers)))
+    ))
+
+    runner = CliRunner()
+
+    result = runner.invoke(
+        export,
+        ["-f", "ndjson", uri, "partial", "reversed"]
+    )
+    assert result.exit_code == 0
+    rows = [json.loads(line) for line in result.output.splitlines()]
+    assert [r["identifier"] for r in rows] == identifiers
+    assert [r["partial"] for r in rows] == ["a", None, "c"]
+    assert [r["reversed"] for r in rows] == [0, 1, 2]
+    assert [r["relpath"] for r in rows] == [
+        dataset.item_properties(i)["relpath"] for i in identifiers
+    ]
+
+
+def test_overlay_export_command_with_nonexisting_overlay_name():
+    from dtool_info.overlay import export
+
+    runner = CliRunner()
+
+    result = runner.invoke(export, [people_dataset_uri, "age", "dontexist"])
+    assert result.exit_code == 11
+
+
+def test_overlay_query_command(tmp_dir_fixture, monkeypatch):  # NOQA
+    from dtool_info.overlay import query
+
+    monkeypatch.setenv("DTOOL_CACHE_DIRECTORY", tmp_dir_fixture)
+    anna_id = dtoolcore.utils.generate_identifier("anna.txt")
+    sarah_id = dtoolcore.utils.generate_identifier("sarah.txt")
+
+    runner = CliRunner()
+
+    result = runner.invoke(query, [people_dataset_uri, "gender==female"])
+    assert result.exit_code == 0
+    assert result.output.splitlines() == sorted([anna_id, sarah_id])
+
+    result = runner.invoke(
+        query,
+        ["-r", people_dataset_uri, "gender==female", "age>30"]
+    )
+    assert result.exit_code == 0
+    assert result.output.splitlines() == ["sarah.txt"]
+
+    result = runner.invoke(query, ["-r", people_dataset_uri, "age in 23,34"])
+    assert result.exit_code == 0
+    assert result.output.splitlines() == ["anna.txt", "patrick.txt"]
+
+    result = runner.invoke(query, [people_dataset_uri, "dontexist==1"])
+    assert result.exit_code == 11
+
+    result = runner.invoke(query, [people_dataset_uri, "nonsense"])
+    assert result.exit_code == 2
+
+
+def test_overlay_query_command_with_cache(tmp_dir_fixture, monkeypatch):  # NOQA
+    from dtool_info.overlay import query
+
+    monkeypatch.setenv("DTOOL_CACHE_DIRECTORY", tmp_dir_fixture)
+    dataset = dtoolcore.DataSet.from_uri(people_dataset_uri)
+
+    runner = CliRunner()
+
+    result = runner.invoke(query, ["-c", "-r", people_dataset_uri, "age<30"])
+    assert result.exit_code == 0
+    assert result.output.splitlines() == ["anna.txt"]
+
+    index_fpath = os.path.join(
+        tmp_dir_fixture,
+        "dtool-info",
+        "overlay_index",
+        dataset.uuid,
+        "age.json"
+    )
+    assert os.path.isfile(index_fpath)
+
+    result = runner.invoke(query, ["-c", "-r", people_dataset_uri, "age<30"])
+    assert result.exit_code == 0
+    assert result.output.splitlines() == ["anna.txt"]
+
+
+def test_overlay_query_command_cache_is_rebuilt(tmp_dir_fixture, monkeypatch):  # NOQA
+    from dtool_info.overlay import query
+
+    monkeypatch.setenv("DTOOL_CACHE_DIRECTORY", tmp_dir_fixture)
+    uri = dtoolcore.copy(people_dataset_uri, tmp_dir_fixture, "file")
+    dataset = dtoolcore.DataSet.from_uri(uri)
+
+    runner = CliRunner()
+
+    result = runner.invoke(query, ["-c", "-r", uri, "age<30"])
+    assert result.exit_code == 0
+    assert result.output.splitlines() == ["anna.txt"]
+
+    age = dataset.get_overlay("age")
+    age[dtoolcore.utils.generate_identifier("anna.txt")] = 230
+    dataset.put_overlay("age", age)
+
+    result = runner.invoke(query, ["-c", "-r", uri, "age<30"])
+    assert result.exit_code == 0
+    assert result.output.splitlines() == []
+
+    result = runner.invoke(query, ["-c", "-r", uri, "dontexist==1"])
+    assert result.exit_code == 11
@@ -0,0 +1,204 @@
+"""Test the ``dtool search`` command."""
+
+import os
+import shutil
+
+from datetime import datetime, timedelta
+
+from click.testing import CliRunner
+
+import dtoolcore
+
+from . import SAMPLE_DATASETS_DIR
+from . import tmp_dir_fixture  # NOQA
+
+
+def test_search_functional(tmp_dir_fixture, monkeypatch):  # NOQA
+
+    from dtool_info.dataset import search
+
+    monkeypatch.setenv(
+        "DTOOL_CACHE_DIRECTORY",
+        os.path.join(tmp_dir_fixture, "cache")
+    )
+    base_dir = os.path.join(tmp_dir_fixture, "datasets")
+    os.mkdir(base_dir)
+    for name in ("he", "she", "lion"):
+        shutil.copytree(
+            os.path.join(SAMPLE_DATASETS_DIR, name),
+            os.path.join(base_dir, name)
+        )
+    base_uri = dtoolcore.utils.sanitise_uri(base_dir)
+    lion = dtoolcore.DataSet.from_uri(os.path.join(base_dir, "lion"))
+
+    runner = CliRunner()
+
+    result = runner.invoke(search, ["-q", base_dir])
+    assert result.exit_code == 0
+    assert result.output.splitlines() == [
+        base_uri + "/" + name for name in ("he", "lion", "she")
+    ]
+
+    result = runner.invoke(search, ["-q", "--name", "*he"])
+    assert result.output.splitlines() == [
+        base_uri + "/" + name for name in ("he", "she")
+    ]
+
+    result = runner.invoke(search, ["-v", "--uuid", lion.uuid[:8]])
+    lines = result.output.splitlines()
+    assert lines[0] == "lion"
+    assert lines[2].endswith(lion.uuid)
+
+    result = runner.invoke(search, ["--creator", "nobody"])
+    assert result.exit_code == 0
+    assert result.output == ""
+
+    frozen_at = float(lion._admin_metadata["frozen_at"])
+    day = datetime.fromtimestamp(frozen_at)
+    result = runner.invoke(search, [
+        "-q",
+        "--name", "lion",
+        "--after", day.strftime("%Y-%m-%d"),
+        "--before", (day + timedelta(days=1)).strftime("%Y-%m-%d"),
+    ])
+    assert result.output.splitlines() == [base_uri + "/lion"]
+    result = runner.invoke(search, [
+        "-q",
+        "--name", "lion",
+        "--before", day.strftime("%Y-%m-%d"),
+    ])
+    assert result.output == ""
+
+    # The catalog is only updated when refreshed.
+    shutil.rmtree(os.path.join(base_dir, "she"))
+    shutil.copytree(
+        os.path.join(SAMPLE_DATASETS_DIR, "cat"),
+        os.path.join(base_dir, "cat")
+    )
+    result = runner.invoke(search, ["-q", base_dir])
+    assert len(result.output.splitlines()) == 3
+    assert result.output.find("/she") != -1
+
+    result = runner.invoke(search, ["-q", "--refresh"])
+    assert result.output.splitlines() == [
+        base_uri + "/" + name for name in ("cat", "he", "lion")
+    ]
+
+    result = runner.invoke(search, ["--after", "not-a-date"])
+    assert result.exit_code == 2
+
+
+def test_search_text(tmp_dir_fixture, monkeypatch):  # NOQA
+
+    from dtool_info.dataset import search
+
+    monkeypatch.setenv(
+        "DTOOL_CACHE_DIRECTORY",
+        os.path.join(tmp_dir_fixture, "cache")
+    )
+    base_dir = os.path.join(tmp_dir_fixture, "datasets")
+    os.mkdir(base_dir)
+    readmes = {
+        "he": "description: Protein structures\nproject: folding\n",
+        "she": "description: Protein protein interactions of yeast\n",
+        "lion": "description: Yeast growth curves\n",
+        "people": "",
+    }
+    for name, readme in readmes.items():
+        path = os.path.join(base_dir, name)
+        shutil.copytree(os.path.join(SAMPLE_DATASETS_DIR, name), path)
+        with open(os.path.join(path, "README.yml"), "w") as fh:
+            fh.write(readme)
+    base_uri = dtoolcore.utils.sanitise_uri(base_dir)
+
+    runner = CliRunner()
+
+    result = runner.invoke(search, ["-q", "--text", "protein", base_dir])
+    assert result.exit_code == 0
+    assert result.output.splitlines() == [
+        base_uri + "/she",
+        base_uri + "/he",
+    ]
+
+    result = runner.invoke(search, ["-q", "--text", "YEAST Growth"])
+    assert result.output.splitlines() == [
+        base_uri + "/lion",
+        base_uri + "/she",
+    ]
+
+    # Names are indexed as well.
+    result = runner.invoke(search, ["-q", "-t", "people"])
+    assert result.output.splitlines() == [base_uri + "/people"]
+
+    result = runner.invoke(search, ["-q", "-t", "yeast", "--name", "s*"])
+    assert result.output.splitlines() == [base_uri + "/she"]
+
+    # READMEs are only read again when reindexing.
+    with open(os.path.join(base_dir, "people", "README.yml"), "w") as fh:
+        fh.write("description: yeast\n")
+    result = runner.invoke(search, ["-q", "-t", "yeast"])
+    assert len(result.output.splitlines()) == 2
+    result = runner.invoke(search, ["-q", "-t", "yeast", "--reindex"])
+    assert len(result.output.splitlines()) == 3
+
+    result = runner.invoke(search, ["-t", "nonsense"])
+    assert result.exit_code == 0
+    assert result.output == ""
+
+    result = runner.invoke(search, ["--reindex", base_dir])
+    assert result.exit_code == 2
+    assert "--text" in result.output
+
+
+def test_search_text_removed_datasets(tmp_dir_fixture, monkeypatch):  # NOQA
+
+    from dtool_info.catalog import Catalog
+    from dtool_info.dataset import search
+
+    monkeypatch.setenv(
+        "DTOOL_CACHE_DIRECTORY",
+        os.path.join(tmp_dir_fixture, "cache")
+    )
+    base_dirs = []
+    for name in ("first", "second"):
+        base_dir = os.path.join(tmp_dir_fixture, name)
+        os.mkdir(base_dir)
+        base_dirs.append(base_dir)
+    for name in ("he", "she"):
+        shutil.copytree(
+            os.path.join(SAMPLE_DATASETS_DIR, name),
+            os.path.join(base_dirs[0], name)
+        )
+    shutil.copytree(
+        os.path.join(SAMPLE_DATASETS_DIR, "she"),
+        os.path.join(base_dirs[1], "she")
+    )
+    she_uuid = dtoolcore.DataSet.from_uri(
+        os.path.join(base_dirs[1], "she")).uuid
+
+    def indexed_uuids():
+        with Catalog() as catalog:
+            return set(
+                row[0] for row in catalog._connection.execute(
+                    "SELECT uuid FROM postings UNION "
+                    "SELECT uuid FROM documents")
+            )
+
+    runner = CliRunner()
+
+    result = runner.invoke(search, ["-q", "-t", "she"] + base_dirs)
+    assert result.exit_code == 0
+    assert len(indexed_uuids()) == 2
+
+    # The index of a dataset is kept while a copy of it is in the catalog.
+    shutil.rmtree(os.path.join(base_dirs[0], "she"))
+    shutil.rmtree(os.path.join(base_dirs[0], "he"))
+    result = runner.invoke(search, ["-q", "--refresh", "-t", "she"])
+    assert result.exit_code == 0
+    assert indexed_uuids() == set([she_uuid])
+
+    shutil.rmtree(os.path.join(base_dirs[1], "she"))
+    result = runner.invoke(search, ["-q", "--refresh", "-t", "she"])
+    assert result.exit_code == 0
+    assert result.output == ""
+    assert indexed_uuids() == set()
@@ -60,3 +60,22 @@ def test_dataset_summary_json_functional():
 
     actual = json.loads(result.output)
     assert expected == actual
+
+
+def test_dataset_summary_stream():
+
+    from dtool_info.dataset import summary
+
+    people_dataset_uri = "file://" + os.path.join(
+        SAMPLE_DATASETS_DIR,
+        "people"
+    )
+
+    runner = CliRunner()
+
+    result = runner.invoke(summary, [people_dataset_uri])
+    assert result.exit_code == 0
+
+    stream_result = runner.invoke(summary, ["--stream", people_dataset_uri])
+    assert stream_result.exit_code == 0
+    assert stream_result.output == result.output
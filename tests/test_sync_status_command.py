@@ -0,0 +1,67 @@
+"""Test the ``dtool sync-status`` command."""
+
+import os
+
+from click.testing import CliRunner
+
+import dtoolcore
+
+from . import SAMPLE_DATASETS_DIR
+from . import tmp_dir_fixture  # NOQA
+
+he_dataset_uri = "file://" + os.path.join(SAMPLE_DATASETS_DIR, "he")
+lion_dataset_uri = "file://" + os.path.join(SAMPLE_DATASETS_DIR, "lion")
+people_dataset_uri = "file://" + os.path.join(SAMPLE_DATASETS_DIR, "people")
+
+
+def test_sync_status_functional(tmp_dir_fixture, monkeypatch):  # NOQA
+
+    from dtool_info.replicas import sync_status
+
+    monkeypatch.setenv("DTOOL_CACHE_DIRECTORY", tmp_dir_fixture)
+
+    base_uris = []
+    for name in ("a", "b"):
+        base_dir = os.path.join(tmp_dir_fixture, name)
+        os.mkdir(base_dir)
+        base_uris.append(dtoolcore.utils.sanitise_uri(base_dir))
+    a, b = base_uris
+
+    for uri in (he_dataset_uri, people_dataset_uri):
+        dtoolcore.copy(uri, a, "file")
+        dtoolcore.copy(uri, b, "file")
+    dtoolcore.copy(lion_dataset_uri, b, "file")
+
+    runner = CliRunner()
+
+    result = runner.invoke(sync_status, [a, b])
+    lines = result.output.splitlines()
+    assert lines[0] == "status\tname\tuuid\t{}\t{}".format(a, b)
+    assert lines[1].startswith("in-sync\the\t")
+    assert lines[1].endswith("\tin-sync\tin-sync")
+    assert lines[2].startswith("missing\tlion\t")
+    assert lines[2].endswith("\tmissing\tin-sync")
+    assert lines[3].startswith("in-sync\tpeople\t")
+    assert result.exit_code == 1
+
+    result = runner.invoke(sync_status, [a])
+    assert result.exit_code == 0
+
+    # Change the size of an item in the manifest of a replica.
+    people = dtoolcore.DataSet.from_uri(
+        os.path.join(b, "people")
+    )
+    manifest = people._storage_broker.get_manifest()
+    item = list(manifest["items"].values())[0]
+    item["size_in_bytes"] += 1
+    people._storage_broker.put_manifest(manifest)
+
+    for _ in range(2):
+        result = runner.invoke(sync_status, ["-c", "-j", "1", a, b])
+        assert result.exit_code == 1
+        lines = result.output.splitlines()
+        assert lines[3].startswith("diverged\tpeople\t")
+        assert lines[3].endswith("\tin-sync\tdiverged")
+
+    result = runner.invoke(sync_status, [b, a])
+    assert result.output.splitlines()[3].endswith("\tin-sync\tdiverged")
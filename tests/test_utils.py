@@ -0,0 +1,108 @@
+"""Test the dtool_info.utils module."""
+
+import errno
+
+import pytest
+
+
+class _Stream(object):
+
+    def __init__(self, tty=False):
+        self.tty = tty
+        self.writes = []
+
+    def isatty(self):
+        return self.tty
+
+    def write(self, text):
+        self.writes.append(text)
+
+    def flush(self):
+        pass
+
+
+class _BrokenStream(_Stream):
+
+    def write(self, text):
+        raise IOError(errno.EPIPE, "Broken pipe")
+
+
+def test_output_writer_buffers_lines():
+
+    from dtool_info.utils import OutputWriter
+
+    stream = _Stream()
+    with OutputWriter(stream, buffer_size=10) as out:
+        out.line("abc")
+        assert stream.writes == []
+        out.line("defghi")
+        assert stream.writes == ["abc\ndefghi\n"]
+        out.line("jkl")
+    assert stream.writes == ["abc\ndefghi\n", "jkl\n"]
+
+
+def test_output_writer_only_styles_terminals():
+
+    from dtool_info.utils import OutputWriter
+
+    stream = _Stream()
+    with OutputWriter(stream) as out:
+        out.line("plain", fg="red")
+    assert stream.writes == ["plain\n"]
+
+    stream = _Stream(tty=True)
+    with OutputWriter(stream) as out:
+        out.line("styled", fg="red")
+    assert stream.writes[0].startswith("\x1b[31mstyled")
+
+
+def test_output_writer_exits_on_broken_pipe():
+
+    from dtool_info.utils import OutputWriter
+
+    with pytest.raises(SystemExit):
+        with OutputWriter(_BrokenStream()) as out:
+            out.line("head has gone away")
+
+
+def test_parse_predicate():
+
+    from dtool_info.utils import parse_predicate
+
+    assert parse_predicate("is_read1==true") == ("is_read1", "==", True)
+    assert parse_predicate("name=lion") == ("name", "==", "lion")
+    assert parse_predicate("age >= 30") == ("age", ">=", 30)
+    assert parse_predicate("plate in 3, 4") == ("plate", "in", [3, 4])
+    assert parse_predicate("relpath matches *.txt") == (
+        "relpath", "matches", "*.txt")
+
+    assert parse_predicate("relpath==1.50", raw=True) == (
+        "relpath", "==", "1.50")
+    assert parse_predicate("relpath in true, null", raw=True) == (
+        "relpath", "in", ["true", "null"])
+
+    with pytest.raises(ValueError):
+        parse_predicate("nonsense")
+
+
+def test_evaluate_predicate():
+
+    from dtool_info.utils import evaluate_predicate
+
+    assert evaluate_predicate(3, "in", [3, 4])
+    assert evaluate_predicate(3, "<", 4)
+    assert not evaluate_predicate("a", "<", 4)
+    assert evaluate_predicate("a.txt", "matches", "*.txt")
+
+
+def test_parse_size():
+
+    from dtool_info.utils import parse_size
+
+    assert parse_size("512") == 512
+    assert parse_size("100M") == 100 * 1024 ** 2
+    assert parse_size("1.5GiB") == int(1.5 * 1024 ** 3)
+    assert parse_size("10 kB") == 10 * 1024
+
+    with pytest.raises(ValueError):
+        parse_size("fast")
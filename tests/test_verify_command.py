@@ -1,15 +1,18 @@
 """Test the ``dtool verify`` command."""
 
+import json
 import os
 
 from click.testing import CliRunner
 
 import dtoolcore
+from dtoolcore.storagebroker import DiskStorageBroker
 
 from . import SAMPLE_DATASETS_DIR
 from . import tmp_dir_fixture  # NOQA
 
 lion_dataset_uri = "file://" + os.path.join(SAMPLE_DATASETS_DIR, "lion")
+people_dataset_uri = "file://" + os.path.join(SAMPLE_DATASETS_DIR, "people")
 
 
 def test_dataset_verify_functional(tmp_dir_fixture):  # NOQA
@@ -59,3 +62,196 @@ def test_dataset_verify_functional(tmp_dir_fixture):  # NOQA
     assert result.exit_code == 1
     assert result.output.startswith("Altered item size: ")
     assert result.output.find("Altered item hash: ") != -1
+
+    result = runner.invoke(verify, ["--full", "-j", "2", uri])
+    assert result.exit_code == 1
+    assert result.output.find("Altered item hash: ") != -1
+
+    result = runner.invoke(
+        verify,
+        ["--full", "--max-bandwidth", "10M", "--max-iops", "100", uri]
+    )
+    assert result.exit_code == 1
+    assert result.output.find("Altered item hash: ") != -1
+
+    for limit in (["--max-bandwidth", "0"], ["--max-iops", "0"]):
+        result = runner.invoke(verify, ["--full"] + limit + [uri])
+        assert result.exit_code == 2
+
+
+def test_dataset_verify_shards_functional(tmp_dir_fixture):  # NOQA
+
+    from dtool_info.dataset import verify, verify_merge
+
+    uri = dtoolcore.copy(people_dataset_uri, tmp_dir_fixture, "file")
+    dataset = dtoolcore.DataSet.from_uri(uri)
+
+    runner = CliRunner()
+
+    result_fpaths = []
+    for i in range(3):
+        fpath = os.path.join(tmp_dir_fixture, "shard{}.json".format(i))
+        result_fpaths.append(fpath)
+        result = runner.invoke(
+            verify,
+            ["--full", "--shard", "{}/3".format(i), "--result", fpath, uri]
+        )
+        assert result.exit_code == 0
+
+    result = runner.invoke(verify_merge, result_fpaths)
+    assert result.exit_code == 0
+    assert result.output.startswith("All good")
+
+    result = runner.invoke(verify_merge, result_fpaths[:2])
+    assert result.exit_code == 2
+    assert result.output.startswith("Cannot merge verify results")
+
+    with open(result_fpaths[0]) as fh:
+        shard_result = json.load(fh)
+    shard_result["version"] = 2
+    future_fpath = os.path.join(tmp_dir_fixture, "future.json")
+    with open(future_fpath, "w") as fh:
+        json.dump(shard_result, fh)
+    result = runner.invoke(verify_merge, [future_fpath] + result_fpaths[1:])
+    assert result.exit_code == 2
+    assert result.output.find("Unsupported result format version") != -1
+
+    item_fpath = os.path.join(
+        dataset._storage_broker._data_abspath,
+        "anna.txt"
+    )
+    os.unlink(item_fpath)
+
+    for i, fpath in enumerate(result_fpaths):
+        runner.invoke(
+            verify,
+            ["--full", "--shard", "{}/3".format(i), "--result", fpath, uri]
+        )
+
+    result = runner.invoke(verify_merge, result_fpaths)
+    assert result.exit_code == 1
+    assert result.output.startswith("Missing item: ")
+    assert result.output.find("anna.txt") != -1
+
+
+def test_dataset_verify_invalid_shard():
+
+    from dtool_info.dataset import verify
+
+    runner = CliRunner()
+
+    result = runner.invoke(verify, ["--shard", "3/3", lion_dataset_uri])
+    assert result.exit_code == 2
+
+
+class _ChecksumStorageBroker(DiskStorageBroker):
+    """Stand-in for a storage broker exposing checksums kept by storage."""
+
+    checksums = {}
+
+    def get_native_checksum(self, identifier):
+        return self.checksums.get(identifier)
+
+
+def test_dataset_verify_native_checksums(tmp_dir_fixture, monkeypatch):  # NOQA
+
+    from dtool_info.dataset import verify
+
+    uri = dtoolcore.copy(lion_dataset_uri, tmp_dir_fixture, "file")
+    dataset = dtoolcore.DataSet.from_uri(uri)
+    (identifier,) = dataset.identifiers
+    manifest_hash = dataset.item_properties(identifier)["hash"]
+
+    monkeypatch.setattr(
+        dtoolcore,
+        "_get_storage_broker",
+        _ChecksumStorageBroker
+    )
+
+    # Alter the content, but not the size, of the item in storage. The
+    # checksum kept by storage is used instead of hashing the content.
+    item_fpath = os.path.join(
+        dataset._storage_broker._data_abspath,
+        "file.txt"
+    )
+    with open(item_fpath, "r") as fh:
+        content = fh.read()
+    with open(item_fpath, "w") as fh:
+        fh.write(content.upper())
+
+    runner = CliRunner()
+
+    _ChecksumStorageBroker.checksums = {
+        identifier: ("md5sum_hexdigest", manifest_hash)
+    }
+    result = runner.invoke(verify, ["--full", uri])
+    assert result.exit_code == 0
+    assert result.stdout.startswith("All good")
+    assert result.stderr.startswith(
+        "Checked hashes of 1 items using storage checksums and 0 items")
+
+    _ChecksumStorageBroker.checksums = {
+        identifier: ("md5sum_hexdigest", "not" + manifest_hash)
+    }
+    result = runner.invoke(verify, ["--full", uri])
+    assert result.exit_code == 1
+    assert result.stdout.startswith("Altered item hash: ")
+
+    # Checksums calculated using other hash functions are not used.
+    _ChecksumStorageBroker.checksums = {
+        identifier: ("sha256sum_hexdigest", manifest_hash)
+    }
+    result = runner.invoke(verify, ["--full", uri])
+    assert result.exit_code == 1
+    assert result.stderr.startswith(
+        "Checked hashes of 0 items using storage checksums and 1 items")
+
+
+def test_dataset_verify_identifiers(tmp_dir_fixture):  # NOQA
+
+    from dtool_info.dataset import verify
+
+    uri = dtoolcore.copy(people_dataset_uri, tmp_dir_fixture, "file")
+    dataset = dtoolcore.DataSet.from_uri(uri)
+    with open(os.path.join(
+        dataset._storage_broker._data_abspath,
+        "anna.txt"
+    ), "w") as fh:
+        fh.write("Different content")
+
+    anna_identifier = dtoolcore.utils.generate_identifier("anna.txt")
+    sarah_identifier = dtoolcore.utils.generate_identifier("sarah.txt")
+
+    runner = CliRunner()
+
+    result = runner.invoke(
+        verify,
+        ["--identifiers", "-", uri],
+        input=sarah_identifier + "\n"
+    )
+    assert result.exit_code == 0
+
+    result = runner.invoke(
+        verify,
+        ["--identifiers", "-", uri],
+        input="{}\n{}\n".format(sarah_identifier, anna_identifier)
+    )
+    assert result.exit_code == 1
+    assert result.output.startswith("Altered item size: ")
+
+
+def test_dataset_verify_jobs_default(monkeypatch):
+
+    from dtool_info.dataset import verify
+
+    monkeypatch.setenv("DTOOL_NUM_PROCESSES", "3")
+    ctx = verify.make_context("verify", [lion_dataset_uri])
+    assert ctx.params["jobs"] == 3
+
+    ctx = verify.make_context("verify", ["-j", "2", lion_dataset_uri])
+    assert ctx.params["jobs"] == 2
+
+    monkeypatch.setenv("DTOOL_NUM_PROCESSES", "many")
+    runner = CliRunner()
+    result = runner.invoke(verify, [lion_dataset_uri])
+    assert result.exit_code == 2